@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
 
-from pysam import AlignmentFile
+from pysam import AlignmentFile, TabixFile
 import sys, os, gzip, re, math
+import genomicFileHandler.read_info_extractor as read_info_extractor
 
 # The regular expression pattern for "chrXX 1234567" in both VarScan2 Output and VCF files:
 pattern_major_chr_position = re.compile(r'^(?:chr)?(?:[1-9]|1[0-9]|2[0-2]|[XY]|MT?)\t[0-9]+\b')
@@ -23,14 +24,28 @@ AA_1to3 = {"A": "Ala", "R": "Arg", "N": "Asn", "D": "Asp", "C": "Cys", "E": "Glu
 
 
 ### ### ### ### ### MAJOR CLASSES ### ### ### ### ###
+# An INFO column of KEY=VALUE items and flags, where the KEY's are words, and the VALUE's have no "=", ";", or white space:
+pattern_plain_info = re.compile(r'\w+(?:=[^;=\s]+)?(?:;\w+(?:=[^;=\s]+)?)*')
+
 class Vcf_line:
-    '''Each instance of this object is a line from the vcf file (no header).'''
+    '''
+    Each instance of this object is a line from the vcf file (no header).
+    INFO and sample values are parsed on demand, once per line, into dictionaries that are reused by later get_info_value and get_sample_value calls.
+    The caches remember the strings they were parsed from, so they are parsed again if vcf_line, info, field, or samples are changed.
+    '''
+
+    __slots__ = ('vcf_line', 'chromosome', 'position', 'identifier', 'refbase', 'altbase', 'qual', 'filters', 'info', 'has_samples', 'field', 'samples', \
+                 '_info_values', '_info_flags', '_sample_values')
 
     def __init__(self, vcf_line):
 
         '''Argument is a line in pileup file.'''
         self.vcf_line = vcf_line.rstrip('\n')
 
+        self._info_values   = None   # (vcf_line, {KEY: VALUE} or None if the line is not "plain", {variable: get_info_value(variable)})
+        self._info_flags    = None   # (info, set of INFO items)
+        self._sample_values = {}     # {idx: (field, samples[idx], {FORMAT: sample value})}
+
         try:
             self.chromosome, self.position, self.identifier, self.refbase, self.altbase, self.qual, self.filters, self.info, *self.has_samples = vcf_line.rstrip('\n').split('\t')
             self.position = int(self.position)
@@ -49,39 +64,86 @@ class Vcf_line:
         return self.info.split(';')
 
 
+    def _parse_info_values(self):
+        '''
+        get_info_value looks for the first "KEY=VALUE" in the whole line.
+        If the only "=" in the line are those of a "plain" INFO column (see pattern_plain_info) without repeated KEY's, that is simply the INFO item of that KEY.
+        Otherwise, the line is searched with the regular expression, once for each variable.
+        '''
+
+        line_items = self.vcf_line.split('\t')
+        info_values = None
+
+        if len(line_items) > 7:
+            info_column = line_items[7]
+
+            if self.vcf_line.count('=') == info_column.count('=') and pattern_plain_info.fullmatch(info_column):
+                info_values = dict( item_i.split('=') for item_i in info_column.split(';') if '=' in item_i )
+
+                if len(info_values) != info_column.count('='):
+                    info_values = None
+
+        self._info_values = (self.vcf_line, info_values, {})
+
+
     def get_info_value(self, variable):
 
-        key_item = re.search(r'\b{}=([^;\s]+)([;\W]|$)'.format(variable), self.vcf_line)
+        if self._info_values is None or self._info_values[0] is not self.vcf_line:
+            self._parse_info_values()
+
+        line_i, info_values, searched_values = self._info_values
 
         # The key has a value attached to it, e.g., VAR=1,2,3
-        if key_item:
-            return key_item.groups()[0]
+        if info_values is not None and variable.replace('_', '').isalnum():
+            if variable in info_values:
+                return info_values[variable]
+
+        elif variable in searched_values:
+            return searched_values[variable]
 
-        # Perhaps it's simply a flag without "="
         else:
-            key_item = self.info.split(';')
-            return True if variable in key_item else False
+            key_item = re.search(r'\b{}=([^;\s]+)([;\W]|$)'.format(variable), line_i)
+
+            if key_item:
+                searched_values[variable] = key_item.groups()[0]
+                return searched_values[variable]
+
+        # Perhaps it's simply a flag without "="
+        if self._info_flags is None or self._info_flags[0] is not self.info:
+            self._info_flags = ( self.info, set(self.info.split(';')) )
+
+        return True if variable in self._info_flags[1] else False
 
 
     def get_sample_variable(self):
         return self.field.split(':')
 
 
+    def _get_sample_values(self, idx):
+
+        sample_i = self.samples[idx]
+        cached   = self._sample_values.get(idx)
+
+        if cached is None or cached[0] is not self.field or cached[1] is not sample_i:
+            cached = ( self.field, sample_i, dict( zip( self.field.split(':'), sample_i.split(':') ) ) )
+            self._sample_values[idx] = cached
+
+        return cached[2]
+
+
     def get_sample_item(self, idx=0, out_type='d'):
         '''d to output a dictionary. l to output a tuple of lists'''
 
         if out_type.lower() == 'd':
-            return dict( zip(self.get_sample_variable(), self.samples[idx].split(':') ) )
+            return dict( self._get_sample_values(idx) )
         elif out_type.lower() == 'l':
             return ( self.get_sample_variable(), self.samples[idx].split(':') )
 
 
     def get_sample_value(self, variable, idx=0):
 
-        var2value = dict( zip( self.field.split(':'), self.samples[idx].split(':') ))
-
         try:
-            return var2value[variable]
+            return self._get_sample_values(idx)[variable]
         except KeyError:
             return None
 
@@ -112,6 +174,178 @@ class pysam_header:
         return sample_name
 
 
+
+
+class Bam_window:
+    '''
+    A sliding read window over a coordinate-sorted, indexed BAM file, used in place of the pysam AlignmentFile when sites are visited in sorted order.
+    Instead of a new index lookup at every site, reads are pulled from a single iterator and kept only while they can still overlap the upcoming sites.
+    fetch(contig, start, stop) returns the same reads, in the same order, as AlignmentFile.fetch(contig, start, stop).
+    A query that changes contig, goes backward, or jumps more than max_gap bases ahead simply starts a new iterator.
+    fetch_records returns the reads as read_info_extractor.Read_record, each decoded once while it stays in the window.
+    '''
+
+    def __init__(self, bam, max_gap=1000):
+
+        self.bam       = bam
+        self.max_gap   = max_gap
+        self.contig    = None
+        self.start     = None
+        self.iterator  = iter(())
+        self.next_read = None
+        self.reads     = []   # [reference_start, reference_end, read, Read_record or None until needed] in file order
+
+
+    def _reset(self, contig, start):
+
+        self.contig    = contig
+        self.iterator  = self.bam.fetch(contig, start)
+        self.next_read = next(self.iterator, None)
+        self.reads     = []
+
+
+    def _slide(self, contig, start, stop):
+        '''Move the window to cover the reads overlapping [start, stop).'''
+
+        if contig != self.contig or start < self.start or start - self.start > self.max_gap:
+            self._reset(contig, start)
+
+        # Reads that end at or before the start cannot overlap this or any later site:
+        if start != self.start:
+            self.reads = [ read_i for read_i in self.reads if read_i[1] > start ]
+            self.start = start
+
+        while self.next_read is not None and self.next_read.reference_start < stop:
+
+            read_start = self.next_read.reference_start
+            read_end   = self.next_read.reference_end
+
+            # Same as htslib: unmapped reads, or reads not consuming the reference, span 1 bp
+            if read_end is None or read_end == read_start:
+                read_end = read_start + 1
+
+            if read_end > start:
+                self.reads.append( [read_start, read_end, self.next_read, None] )
+
+            self.next_read = next(self.iterator, None)
+
+
+    def fetch(self, contig, start, stop):
+
+        self._slide(contig, start, stop)
+
+        return [ read_i for read_start, read_end, read_i, record_i in self.reads if read_start < stop and read_end > start ]
+
+
+    def fetch_records(self, contig, start, stop):
+
+        self._slide(contig, start, stop)
+
+        records = []
+        for window_read_i in self.reads:
+            if window_read_i[0] < stop and window_read_i[1] > start:
+
+                if window_read_i[3] is None:
+                    window_read_i[3] = read_info_extractor.Read_record( window_read_i[2] )
+
+                records.append( window_read_i[3] )
+
+        return records
+
+
+    def close(self):
+        self.bam.close()
+
+
+
+
+class Fasta_window:
+    '''
+    A cached chunk of reference sequence over a pysam FastaFile, used in place of the FastaFile when sites are visited in sorted order.
+    Each contig is read in chunks of chunk_size bases, and the small windows around each site are sliced out of the current chunk.
+    fetch(contig, start, stop) returns the same sequence as FastaFile.fetch(contig, start, stop).
+    A window outside of the current chunk loads a new chunk starting lookback bases before it, so windows that reach back a little behind the site stay in the chunk.
+    '''
+
+    def __init__(self, fasta, chunk_size=1000000, lookback=1000):
+
+        self.fasta         = fasta
+        self.chunk_size    = chunk_size
+        self.lookback      = lookback
+        self.contig        = None
+        self.contig_length = None
+        self.chunk_start   = 0
+        self.chunk_end     = 0
+        self.sequence      = ''
+
+
+    def get_reference_length(self, contig):
+        return self.fasta.get_reference_length(contig)
+
+
+    def fetch(self, contig, start, stop):
+
+        # Let FastaFile raise its own errors for invalid coordinates
+        if start < 0 or start > stop:
+            return self.fasta.fetch(contig, start, stop)
+
+        if contig != self.contig:
+            self.contig_length = self.fasta.get_reference_length(contig)
+            self.contig        = contig
+            self.chunk_start   = self.chunk_end = 0
+            self.sequence      = ''
+
+        stop = min(stop, self.contig_length)
+        if start >= stop:
+            return ''
+
+        if start < self.chunk_start or stop > self.chunk_end:
+            self.chunk_start = max(0, start - self.lookback)
+            self.chunk_end   = min( self.contig_length, max(stop, self.chunk_start + self.chunk_size) )
+            self.sequence    = self.fasta.fetch(contig, self.chunk_start, self.chunk_end)
+
+        return self.sequence[ start-self.chunk_start : stop-self.chunk_start ]
+
+
+    def close(self):
+        self.fasta.close()
+
+
+class Indexed_vcf:
+    '''
+    A bgzipped VCF file with a tabix or CSI index, used in place of the opened text file in find_vcf_at_coordinate.
+    The lines at each coordinate are looked up through the index, so only the parts of a large file (e.g., dbSNP or COSMIC) near the sites are read.
+    '''
+
+    def __init__(self, file_name):
+
+        self.name    = file_name
+        self.tabix   = TabixFile(file_name)
+        self.contigs = set(self.tabix.contigs)
+
+
+    def lines_at(self, my_coordinate):
+        '''All the lines whose CHROM and POS are my_coordinate, in file order.'''
+
+        contig_i, position_i = my_coordinate
+
+        if contig_i not in self.contigs:
+            return []
+
+        # The index also returns the lines of earlier deletions that span the position
+        position_string = str(position_i)
+        return [ line_i for line_i in self.tabix.fetch(contig_i, int(position_i)-1, int(position_i)) if line_i.split('\t', 2)[1] == position_string ]
+
+
+    def readline(self):
+        # Nothing is read line by line: skip_vcf_header() gets an empty line, which the lookups never use.
+        return ''
+
+
+    def close(self):
+        self.tabix.close()
+
+
 ### ### ### ### ### MAJOR CLASSES OVER ### ### ### ### ###
 
 
@@ -172,6 +406,19 @@ def open_textfile(file_name):
 
 
 
+def open_vcf_file(file_name):
+    '''An Indexed_vcf if the file is bgzipped with a .tbi or .csi index, otherwise the opened text file (see open_textfile) to be read through in order.'''
+
+    if str(file_name).lower().endswith('.gz') and ( os.path.exists(file_name + '.tbi') or os.path.exists(file_name + '.csi') ):
+        try:
+            return Indexed_vcf(file_name)
+        except (OSError, ValueError):
+            pass
+
+    return open_textfile(file_name)
+
+
+
 def open_bam_file(file_name):
 
     try:
@@ -280,69 +527,67 @@ chrom_seq = {}
 for n,contig_i in enumerate(chrom_sequence):
     chrom_seq[contig_i] = n
 
-def whoisbehind(coord_0, coord_1, chrom_sequence):
+# Coordinate keys, i.e., (contig_rank, position), compare the same way whoisbehind does, so the end of a file (i.e., an empty coordinate) comes after everything.
+end_of_file_key = (inf, inf)
+
+def coordinate_key(coordinate, chrom_sequence):
     '''
-    coord_0 and coord_1 are two strings or two lists, specifying the chromosome, a (typically) tab, and then the location.
-    Return the index where the coordinate is behind. Return 10 if they are the same position.
+    coordinate is a string (contig, a (typically) tab, and then the location) or a list/tuple of (contig, position).
+    Return the integer key (contig_rank, position), where contig_rank is from chrom_sequence (a dict or a list), or end_of_file_key for an empty coordinate.
     '''
 
-    end_of_0 = end_of_1 = False
+    if not coordinate or not coordinate[0]:
+        return end_of_file_key
 
-    if coord_0 == '' or coord_0==['',''] or coord_0==('','') or not coord_0:
-        end_of_0 = True
+    if isinstance(coordinate, str):
+        contig_i, position_i = coordinate.split()
+    else:
+        contig_i, position_i = coordinate[0], coordinate[1]
 
-    if coord_1 == '' or coord_1==['',''] or coord_1==('','') or not coord_1:
-        end_of_1 = True
+    if isinstance(chrom_sequence, dict):
+        return chrom_sequence[contig_i], int(position_i)
+    else:
+        return chrom_sequence.index(contig_i), int(position_i)
 
-    if end_of_0 and end_of_1:
-        return 10
 
-    elif end_of_1:
-        return 0
 
-    elif end_of_0:
-        return 1
+def line_coordinate_key(line_i, chrom_sequence):
+    '''coordinate_key of a VCF (or similarly tab-separated) line, or end_of_file_key if the line does not start with a contig and a position.'''
 
-    else:
-
-        if isinstance(coord_0, str):
-            chrom0, position0 = coord_0.split()
-        elif isinstance(coord_0, list) or isinstance(coord_0, tuple):
-            chrom0, position0 = coord_0[0], coord_0[1]
+    coordinate_i = pattern_chr_position.match(line_i)
 
-        if isinstance(coord_1, str):
-            chrom1, position1 = coord_1.split()
-        elif isinstance(coord_1, list) or isinstance(coord_1, tuple):
-            chrom1, position1 = coord_1[0], coord_1[1]
+    if coordinate_i:
+        contig_i, position_i = coordinate_i.group().split('\t')
 
         if isinstance(chrom_sequence, dict):
-            chrom0_position = chrom_sequence[chrom0]
-            chrom1_position = chrom_sequence[chrom1]
-        elif isinstance(chrom_sequence, list) or isinstance(chrom_sequence, tuple):
-            chrom0_position = chrom_sequence.index(chrom0)
-            chrom1_position = chrom_sequence.index(chrom1)
+            return chrom_sequence[contig_i], int(position_i)
+        else:
+            return chrom_sequence.index(contig_i), int(position_i)
 
-        if chrom0_position < chrom1_position:
-            return 0   # 1st coordinate is ahead
+    else:
+        return end_of_file_key
 
-        elif chrom0_position > chrom1_position:
-            return 1   # 1st coordinate is ahead
 
-        # Must be in the same chromosome
-        else:
 
-            position0 = int(position0)
-            position1 = int(position1)
+def whoisbehind(coord_0, coord_1, chrom_sequence):
+    '''
+    coord_0 and coord_1 are two strings or two lists, specifying the chromosome, a (typically) tab, and then the location.
+    Return the index where the coordinate is behind. Return 10 if they are the same position.
+    Where the same coordinates are compared over and over, compare their coordinate_key's instead.
+    '''
 
-            if position0 < position1:
-                return 0
+    key_0 = coordinate_key(coord_0, chrom_sequence)
+    key_1 = coordinate_key(coord_1, chrom_sequence)
 
-            elif position0 > position1:
-                return 1
+    if key_0 < key_1:
+        return 0
 
-            # Same chromosome, same position, then same coordinate:
-            elif position0 == position1:
-                return 10
+    elif key_0 > key_1:
+        return 1
+
+    # Same chromosome, same position, then same coordinate:
+    else:
+        return 10
 
 
 
@@ -398,50 +643,16 @@ def catchup(coordinate_i, line_j, filehandle_j, chrom_sequence):
     Returns (False, Vcf_line_j) if the j_th vcf file does not contain such an entry, and therefore the function has run past the i_th coordinate, by which time the programmer can decide to move into the next i_th coordiate.
     '''
 
-    coordinate_j = re.match( pattern_chr_position, line_j )
-
-    if coordinate_j:
-        coordinate_j = coordinate_j.group()
-    else:
-        coordinate_j = ''
-
-    # Which coordinate is behind?
-    is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
-
-    # The file_j is already ahead, return the same line_j, but tag it "False"
-    if is_behind == 0:
-        reporter = (False, line_j)
+    key_i = coordinate_key(coordinate_i, chrom_sequence)
+    key_j = line_coordinate_key(line_j, chrom_sequence)
 
-    # The two coordinates are the same, return the same line_j, but tag it "True"
-    elif is_behind == 10:
-        reporter = (True, line_j)
-
-    # If file_j is behind, then needs to catch up:
-    elif is_behind == 1:
+    # If file_j is behind, then needs to catch up, until line_j is no longer behind:
+    while key_j < key_i:
+        line_j = filehandle_j.readline().rstrip()
+        key_j  = line_coordinate_key(line_j, chrom_sequence)
 
-        # Keep at it until line_j is no longer behind:
-        while is_behind == 1:
-
-            # Catch up
-            line_j = filehandle_j.readline().rstrip()
-            next_coord = re.match( pattern_chr_position, line_j )
-
-            if next_coord:
-                coordinate_j = next_coord.group()
-            else:
-                coordinate_j = ''
-
-            is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
-
-        # If file_j has caught up exactly to the position of coordinate_i:
-        if is_behind == 10:
-            reporter = (True, line_j)
-
-        # If file_j has run past coordinate_i:
-        elif is_behind == 0:
-            reporter = (False, line_j)
-
-    return reporter
+    # True if file_j has caught up exactly to the position of coordinate_i, or False if it has run past coordinate_i:
+    return (key_j == key_i, line_j)
 
 
 
@@ -460,93 +671,33 @@ def catchup_multilines(coordinate_i, line_j, filehandle_j, chrom_sequence):
     Returns (False, []        , line_j) if the j_th vcf file does not contain such an entry, and therefore the function has run past the i_th coordinate, by which time the programmer can decide to move into the next i_th coordiate.
     '''
 
-    coordinate_j = re.match( pattern_chr_position, line_j )
-
-    if coordinate_j:
-        coordinate_j = coordinate_j.group()
-    else:
-        coordinate_j = ''
-
-    # Which coordinate is behind?
-    is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
-
-    # The file_j is already ahead, return the same line_j, but tag it "False"
-    if is_behind == 0:
-        reporter = (False, [], line_j)
-
-    # The two coordinates are the same, return the same line_j, but tag it "True"
-    elif is_behind == 10:
-
-        # Create a list, initiated with the current line:
-        lines_of_coordinate_i = [ line_j ]
-
-        while is_behind == 10:
-            line_j = filehandle_j.readline().rstrip()
-            next_coord = re.match( pattern_chr_position, line_j )
-
-            if next_coord:
-                coordinate_j = next_coord.group()
-            else:
-                coordinate_j = ''
-
-            is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
-
-            # If the next line (still) has the same coordinate:
-            if is_behind == 10:
-                lines_of_coordinate_i.append( line_j )
-
-        reporter = (True, lines_of_coordinate_i, line_j)
-
+    key_i = coordinate_key(coordinate_i, chrom_sequence)
+    key_j = line_coordinate_key(line_j, chrom_sequence)
 
     # If file_j is behind, then needs to catch up:
     # This is an opportunity to check if the vcf_j file is properly sorted, by asserting current line cannot be "behind" a subsequent line
-    elif is_behind == 1:
+    while key_j < key_i:
 
-        # Keep at it until line_j is no longer behind:
-        while is_behind == 1:
+        line_j   = filehandle_j.readline().rstrip()
+        next_key = line_coordinate_key(line_j, chrom_sequence)
 
-            # Catch up
-            line_j = filehandle_j.readline().rstrip()
-            next_coord = re.match( pattern_chr_position, line_j )
+        if next_key < key_j:
+            raise Exception('{} does not seem to be properly sorted'.format(filehandle_j.name) )
 
-            if next_coord:
-                if whoisbehind(coordinate_j, next_coord.group(), chrom_sequence) == 1:
-                    raise Exception('{} does not seem to be properly sorted'.format(filehandle_j.name) )
+        key_j = next_key
 
-                coordinate_j = next_coord.group()
-            else:
-                coordinate_j = ''
+    # Store all lines with the same coordinate, until file_j goes beyond coordinate_i:
+    lines_of_coordinate_i = []
 
-            is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
+    while key_j == key_i:
+        lines_of_coordinate_i.append( line_j )
+        line_j = filehandle_j.readline().rstrip()
+        key_j  = line_coordinate_key(line_j, chrom_sequence)
 
-
-        # If file_j has caught up exactly to the position of coordinate_i:
-        if is_behind == 10:
-
-            # Create a list, initiated with the current line:
-            lines_of_coordinate_i = [ line_j ]
-
-            while is_behind == 10:
-                line_j = filehandle_j.readline().rstrip()
-                next_coord = re.match( pattern_chr_position, line_j )
-
-                if next_coord:
-                    coordinate_j = next_coord.group()
-                else:
-                    coordinate_j = ''
-
-                is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
-
-                # If the next line (still) has the same coordinate:
-                if is_behind == 10:
-                    lines_of_coordinate_i.append( line_j )
-
-            reporter = (True, lines_of_coordinate_i, line_j)
-
-
-        elif is_behind == 0:
-
-            reporter = (False, [], line_j)
+    if lines_of_coordinate_i:
+        reporter = (True, lines_of_coordinate_i, line_j)
+    else:
+        reporter = (False, [], line_j)
 
     return reporter
 
@@ -558,9 +709,15 @@ def catchup_multilines(coordinate_i, line_j, filehandle_j, chrom_sequence):
 def find_vcf_at_coordinate(my_coordinate, latest_vcf_line, vcf_file_handle, chrom_seq):
     '''Best used in conjunction with catchup_multilines.
     Given the current coordinate, the latest vcf_line from a vcf file, and the vcf file handle, it will return all the VCF variants (as VCF objects) at the given coordinate as a dictionary, where the key is the ( (contig, position), ref_base_i, alt_base_i ).
+    If the vcf file handle is an Indexed_vcf (see open_vcf_file), the variants are looked up through the index instead, and latest_vcf_line is returned as is.
     If there are two ALT bases in a given VCF line, the output dictionary will include two copies of this VCF object, with two different keys, each representing a different ALT base.
     '''
-    latest_vcf_run  = catchup_multilines(my_coordinate, latest_vcf_line, vcf_file_handle, chrom_seq)
+    if isinstance(vcf_file_handle, Indexed_vcf):
+        lines_here     = vcf_file_handle.lines_at(my_coordinate)
+        latest_vcf_run = ( len(lines_here) > 0, lines_here, latest_vcf_line )
+    else:
+        latest_vcf_run = catchup_multilines(my_coordinate, latest_vcf_line, vcf_file_handle, chrom_seq)
+
     latest_vcf_here = latest_vcf_run[1]
 
     vcf_variants = {}
@@ -594,30 +751,20 @@ def catchup_one_line_at_a_time(coordinate_i, line_j, filehandle_j, chrom_sequenc
     Return (-1, Vcf_line_j) if the coordinate_j is behind of coordinate_i.
     '''
 
-    coordinate_j = re.match( pattern_chr_position, line_j )
-
-    if coordinate_j:
-        coordinate_j = coordinate_j.group()
-    else:
-        coordinate_j = ''
-
-    # Which coordinate is behind?
-    is_behind = whoisbehind( coordinate_i, coordinate_j, chrom_sequence )
+    key_i = coordinate_key(coordinate_i, chrom_sequence)
+    key_j = line_coordinate_key(line_j, chrom_sequence)
 
-    # The file_j is already ahead, return the same line_j, but tag it "False"
-    if is_behind == 0:
+    # The file_j is already ahead:
+    if key_j > key_i:
         reporter = (1, line_j)
 
-    # The two coordinates are the same, return the same line_j, but tag it "True"
-    elif is_behind == 10:
+    # The two coordinates are the same:
+    elif key_j == key_i:
         reporter = (0, line_j)
 
-    # If file_j is behind, then needs to catch up:
-    elif is_behind == 1:
-
-        # Read one line into file_j:
+    # If file_j is behind, read one line into file_j:
+    else:
         line_j_next = filehandle_j.readline().rstrip()
-        next_coord = re.match( pattern_chr_position, line_j_next )
         reporter = (-1, line_j_next)
 
     return reporter
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-import re
+import re, random
+from bisect import bisect_right
 
 cigar_aln_match    = 0
 cigar_insertion    = 1
@@ -19,6 +20,57 @@ inf = float('inf')
 
 
 ### PYSAM ###
+
+# Each CIGAR operation is a block of aligned pairs in read.get_aligned_pairs(): 
+# (query, reference) for matches, (query, None) for insertion/soft-clip/padding, and (None, reference) for deletion/skip.
+# Hard clips (and the rarely used "B") do not produce aligned pairs.
+block_match, block_query_only, block_reference_only = 0, 1, 2
+cigar_block_type = { cigar_aln_match:    block_match, \
+                     cigar_seq_match:    block_match, \
+                     cigar_seq_mismatch: block_match, \
+                     cigar_insertion:    block_query_only, \
+                     cigar_soft_clip:    block_query_only, \
+                     cigar_padding:      block_query_only, \
+                     cigar_deletion:     block_reference_only, \
+                     cigar_skip:         block_reference_only }
+
+
+def cigar_blocks(read_i):
+    '''
+    Walk the CIGAR of a read, and return its alignment blocks as 5 lists:
+    index of the first aligned pair, block type, query position, reference position, and length of each block.
+    The blocks cover exactly the same aligned pairs as read_i.get_aligned_pairs(), without listing them base by base.
+    '''
+
+    pair_starts, block_types, query_starts, ref_starts, block_lengths = [], [], [], [], []
+
+    pair_i  = 0
+    query_i = 0
+    ref_i   = read_i.reference_start
+
+    for cigar_op, op_length in (read_i.cigartuples or ()):
+
+        if op_length == 0 or cigar_op not in cigar_block_type:
+            continue
+
+        block_type_i = cigar_block_type[cigar_op]
+
+        pair_starts.append( pair_i )
+        block_types.append( block_type_i )
+        query_starts.append( query_i )
+        ref_starts.append( ref_i )
+        block_lengths.append( op_length )
+
+        pair_i += op_length
+        if block_type_i != block_reference_only:
+            query_i += op_length
+        if block_type_i != block_query_only:
+            ref_i += op_length
+
+    return pair_starts, block_types, query_starts, ref_starts, block_lengths
+
+
+
 def position_of_aligned_read(read_i, target_position, win_size=3):
     '''
     Return the base call of the target position, and if it's a start of insertion/deletion.
@@ -31,104 +83,110 @@ def position_of_aligned_read(read_i, target_position, win_size=3):
         2: Deletion after the target position
         3: Insertion after the target position
         0: The target position does not match to reference, and may be discarded for "reference/alternate" read count purposes, but can be kept for "inconsistent read" metrics.
-    '''
-
-    flanking_deletion, flanking_insertion = nan, nan
 
-    aligned_pairs = read_i.get_aligned_pairs()
-    
-    for i, align_i in enumerate(aligned_pairs):
-
-        # If find a match:
-        if align_i[1] == target_position:
-            seq_i = align_i[0]
-            idx_aligned_pair = i
-            break
+    The i_th aligned pair below refers to read_i.get_aligned_pairs()[i], but it is located on the CIGAR blocks instead of building that list.
+    read_i may also be a Read_record, whose CIGAR blocks are already worked out.
+    '''
 
-    # If the target position is aligned:
-    try:
-        if seq_i is not None:
-            base_at_target = read_i.seq[seq_i]
+    pair_starts, block_types, query_starts, ref_starts, block_lengths = read_i.blocks if isinstance(read_i, Read_record) else cigar_blocks(read_i)
 
-            # Whether if it's a Deletion/Insertion depends on what happens after this position:
-            # If the match (i.e., i, seq_i) is the final alignment, then you cannot know if it's an indel
-            # if "i" is NOT the final alignment:
-            if i != len(aligned_pairs) - 1:
+    # Reference positions never decrease along the blocks, so the block covering the target is the last one that starts at or before it:
+    block_i = bisect_right(ref_starts, target_position) - 1
 
-                indel_length = 0
-                # If the next alignment is the next sequenced base, then the target is either a reference read of a SNP/SNV:
-                if aligned_pairs[i+1][0] == seq_i+1 and aligned_pairs[i+1][1] == target_position + 1:
+    # The target position does not exist in the read
+    if block_i < 0 or block_types[block_i] == block_query_only or target_position >= ref_starts[block_i] + block_lengths[block_i]:
+        return None, None, None, None, None
 
-                    code = 1 # Reference read for mismatch
+    # If the target position is deleted from the sequencing read (i.e., the deletion in this read occurs before the target position):
+    if block_types[block_i] == block_reference_only:
+        return 0, None, None, None, None
+
+    offset         = target_position - ref_starts[block_i]
+    i              = pair_starts[block_i] + offset
+    seq_i          = query_starts[block_i] + offset
+    base_at_target = read_i.seq[seq_i]
+    num_pairs      = pair_starts[-1] + block_lengths[-1]
+
+    # If "i" is the final alignment, cannot exam for indel:
+    if i == num_pairs - 1:
+        return 1, seq_i, base_at_target, nan, None
+
+    # Whether if it's a Deletion/Insertion depends on what happens after this position:
+    indel_length = 0
+
+    # If the next alignment is the next sequenced base, then the target is either a reference read of a SNP/SNV:
+    if offset < block_lengths[block_i] - 1 or block_types[block_i+1] == block_match:
+        code = 1
+
+    # If the next reference position has no read position to it, it is DELETED in this read:
+    elif block_types[block_i+1] == block_reference_only:
+        code = 2
+        for block_j in range(block_i+1, len(block_types)):
+            if block_types[block_j] != block_reference_only:
+                break
+            indel_length -= block_lengths[block_j]
+
+    # Opposite of deletion, if the read position cannot be aligned to the reference, it can be an INSERTION.
+    # Insertions sometimes show up wit soft-clipping at the end, if the inserted sequence is "too long" to align on a single read. In this case, the inserted length derived here is but a lower limit of the real inserted length.
+    else:
+        code = 3
+        for block_j in range(block_i+1, len(block_types)):
+            if block_types[block_j] != block_query_only:
+                break
+            indel_length += block_lengths[block_j]
+
+    # See if there is insertion/deletion within win_size of the i_th aligned pair, i.e., an aligned pair that is not a match.
+    right_indel_flanks = inf
+    left_indel_flanks  = inf
+    left_side_start    = i - 1
+    right_side_start   = i + abs(indel_length) + 1
+
+    for step_right_i in range( min(win_size, num_pairs-right_side_start-1) ):
+        j = right_side_start + step_right_i + 1
+
+        if block_types[ bisect_right(pair_starts, j) - 1 ] != block_match:
+            right_indel_flanks = step_right_i + 1
+            break
 
-                # If the next reference position has no read position to it, it is DELETED in this read:
-                elif aligned_pairs[i+1][0] == None and aligned_pairs[i+1][1] == target_position + 1:
+    for step_left_i in range( min(win_size, left_side_start) ):
+        j = left_side_start - step_left_i
 
-                    code = 2 # Deletion
+        if block_types[ bisect_right(pair_starts, j) - 1 ] != block_match:
+            left_indel_flanks = step_left_i + 1
+            break
 
-                    for align_j in aligned_pairs[ i+1:: ]:
-                        if align_j[0] == None:
-                            indel_length -= 1
-                        else:
-                            break
+    flanking_indel = min(left_indel_flanks, right_indel_flanks)
 
-                # Opposite of deletion, if the read position cannot be aligned to the reference, it can be an INSERTION.
-                # Insertions sometimes show up wit soft-clipping at the end, if the inserted sequence is "too long" to align on a single read. In this case, the inserted length derived here is but a lower limit of the real inserted length.
-                elif aligned_pairs[i+1][0] == seq_i+1 and aligned_pairs[i+1][1] == None:
+    return code, seq_i, base_at_target, indel_length, flanking_indel
 
-                    code = 3 # Insertion or soft-clipping
 
-                    for align_j in aligned_pairs[ i+1:: ]:
-                        if align_j[1] == None:
-                            indel_length += 1
-                        else:
-                            break
+class Read_record:
+    '''
+    What is needed of a read to extract the features at a site, decoded from the pysam AlignedSegment once, and then reused at every site the read overlaps.
+    pysam builds a new quality array, sequence string, or CIGAR list on every access to them, and looks up a tag by scanning all the tags.
+    The attributes are named as in the AlignedSegment, plus mean_bq (the mean base quality), NM (None without the tag), soft_clipped, and blocks (from cigar_blocks).
+    '''
 
-            # If "i" is the final alignment, cannt exam for indel:
-            else:
-                code = 1           # Assuming no indel
-                indel_length = nan # Would be zero if certain no indel, but uncertain here
+    __slots__ = ('query_name', 'is_unmapped', 'is_duplicate', 'is_proper_pair', 'is_reverse', 'mapping_quality', 'query_length', 'query_qualities', 'seq', 'mean_bq', 'NM', 'soft_clipped', 'blocks')
 
-        # If the target position is deleted from the sequencing read (i.e., the deletion in this read occurs before the target position):
-        else:
-            code = 0
-            base_at_target, indel_length, flanking_indel = None, None, None
-
-        # See if there is insertion/deletion within 5 bp of "seq_i" on the query.
-        # seq_i is the i_th aligned base
-        if isinstance(indel_length, int):
-            right_indel_flanks = inf
-            left_indel_flanks  = inf
-            left_side_start    = idx_aligned_pair - 1
-            right_side_start   = idx_aligned_pair + abs(indel_length) + 1
-                        
-            #(i, None) = Insertion (or Soft-clips), i.e., means the i_th base in the query is not aligned to a reference
-            #(None, coordinate) = Deletion, i.e., there is no base in it that aligns to this coordinate.
-            # If those two scenarios occur right after an aligned base, that base position is counted as an indel.
-            for step_right_i in range( min(win_size, len(aligned_pairs)-right_side_start-1 ) ):
-                j = right_side_start + step_right_i
-                
-                if (aligned_pairs[j+1][1] == None or aligned_pairs[j+1][0] == None):
-                    right_indel_flanks = step_right_i + 1
-                    break
-            
-            for step_left_i in range( min(win_size, left_side_start) ):
-                j = left_side_start - step_left_i
-                
-                if (aligned_pairs[j][1] == None or aligned_pairs[j][0] == None):
-                    left_indel_flanks = step_left_i + 1
-                    break
-            
-            flanking_indel = min(left_indel_flanks, right_indel_flanks)
+    def __init__(self, read_i):
 
-        else:
-            flanking_indel = None
+        cigar = read_i.cigartuples
 
-        return code, seq_i, base_at_target, indel_length, flanking_indel
+        self.query_name      = read_i.query_name
+        self.is_unmapped     = read_i.is_unmapped
+        self.is_duplicate    = read_i.is_duplicate
+        self.is_proper_pair  = read_i.is_proper_pair
+        self.is_reverse      = read_i.is_reverse
+        self.mapping_quality = read_i.mapping_quality
+        self.query_length    = read_i.query_length
+        self.query_qualities = read_i.query_qualities
+        self.seq             = read_i.query_sequence
+        self.mean_bq         = mean(self.query_qualities)
+        self.NM              = read_i.get_tag('NM') if read_i.has_tag('NM') else None
+        self.soft_clipped    = bool(cigar) and (cigar[0][0] == cigar_soft_clip or cigar[-1][0] == cigar_soft_clip)
+        self.blocks          = cigar_blocks(read_i)
 
-    # The target position does not exist in the read
-    except UnboundLocalError:
-        return None, None, None, None, None
 
 
 ## Dedup test for BAM file
@@ -144,6 +202,35 @@ def dedup_test(read_i, remove_dup_or_not=True):
 
 
 
+## Depth cap for ultra-deep sites
+def downsample_reads(reads, max_depth, seed=0):
+    '''
+    Reservoir sampling of at most max_depth reads out of the reads, streamed through once.
+    Returns the sampled reads, in their original order, and the total number of reads.
+    The sample only depends on the reads and the seed, e.g., '0:chr1:12345' for a site, so it is the same on every run.
+    '''
+
+    random_generator = random.Random(seed)
+
+    reservoir = []
+    depth     = 0
+    for read_i in reads:
+
+        if depth < max_depth:
+            reservoir.append( (depth, read_i) )
+        else:
+            slot_i = random_generator.randrange(depth + 1)
+            if slot_i < max_depth:
+                reservoir[slot_i] = (depth, read_i)
+
+        depth += 1
+
+    reservoir.sort(key=lambda x: x[0])
+
+    return [read_i for order_i, read_i in reservoir], depth
+
+
+
 ### END OF PYSAM ###
 
 
@@ -1,9 +1,13 @@
 #!/usr/bin/env python3
 
 import sys, argparse, math, gzip, os
+import numpy as np
+import pandas as pd
 from datetime import datetime
 from genomicFileHandler.genomic_file_handlers import p2phred
 from somaticseq._version import vcf_header as version_line
+import somaticseq.feature_table as feature_table
+import somaticseq.tsv_writer as tsv_writer
 
 nan = float('nan')
 time_string = datetime.now().isoformat(sep='_', timespec='seconds')
@@ -14,7 +18,7 @@ def run():
     inputParameters = {}
     
     parser = argparse.ArgumentParser(description='This is a SomaticSeq subroutine SomaticSeq TSV file into VCF file.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
-    parser.add_argument('-tsv',   '--tsv-in',                    type=str,   help='TSV in', required=True)
+    parser.add_argument('-tsv',   '--tsv-in',                    type=str,   help='TSV in, or .parquet/.npz table file', required=True)
     parser.add_argument('-vcf',   '--vcf-out',                   type=str,   help='VCF iut', required=True)
     parser.add_argument('-pass',  '--pass-threshold',            type=float, help='Above which is automatically PASS', required=False, default=0.5)
     parser.add_argument('-low',   '--lowqual-threshold',         type=float, help='Low quality subject to lenient filter', required=False, default=0.1)
@@ -78,6 +82,73 @@ def dp4_to_gt(ref_for, ref_rev, alt_for, alt_rev, hom_threshold=0.85, het_thresh
 
 
 
+def integer_or_float(x):
+    return format( int(x) ) if float(x).is_integer() else format(x)
+
+
+
+def table_formatters():
+    '''
+    The functions that turn the values of the columns of a table file back into the text that vcf2tsv wrote into the TSV file, 
+    i.e., the BAM columns with the conversions of tsv_writer, and the caller flags and tiers as integers unless they are fractions, e.g., VarDict's 0.5.
+    '''
+    
+    # The table keeps the rescaled p-values, which are written with 2 decimals for any p_scale:
+    formatters = {}
+    for template_i, key_i, conversion_i in tsv_writer.BAM_COLUMNS:
+        for sample_i in ('N', 'T'):
+            formatters[ template_i.format(S=sample_i, s=sample_i.lower()) ] = tsv_writer.column_formatter(conversion_i, None)
+    
+    for column_i in feature_table.CALLER_COLUMNS:
+        formatters[ column_i ] = integer_or_float
+    
+    return formatters
+
+
+
+def tsv_values(column, formatter=None):
+    '''The values of a data frame column as they are in the TSV file written from it, i.e., with nan for the missing values.'''
+    
+    # Numpy values, e.g., float32 scores, are written as numpy writes them, and the others, i.e., strings and nullable integers, may be NA:
+    if formatter is None and isinstance(column.dtype, np.dtype):
+        return list( map(str, column.to_numpy()) )
+    
+    formatter = formatter or str
+    
+    return [ 'nan' if (value_i is pd.NA or value_i != value_i) else formatter(value_i) for value_i in column.astype(object).tolist() ]
+
+
+
+def rows_of_tsv(tsv_fn):
+    '''
+    The header, and then the rows, of the TSV file as lists of strings. 
+    For a table file, the rows of each chunk are made from its columns, the same as the lines of the TSV file of the table.
+    '''
+    
+    if feature_table.is_table(tsv_fn):
+        
+        header     = True
+        formatters = table_formatters()
+        for chunk_i in feature_table.read_data_in_chunks(tsv_fn):
+            
+            if header:
+                yield list( chunk_i.columns )
+                header = False
+            
+            yield from zip( *[tsv_values(chunk_i[column_i], formatters.get(column_i)) for column_i in chunk_i.columns] )
+    
+    else:
+        with open(tsv_fn) as tsv:
+            
+            # Stops at the end of the file, or at a blank line:
+            tsv_i = tsv.readline().rstrip()
+            while tsv_i:
+                yield tsv_i.split('\t')
+                tsv_i = tsv.readline().rstrip()
+
+
+
+
 def tsv2vcf(tsv_fn, vcf_fn, tools, pass_score=0.5, lowqual_score=0.1, hom_threshold=0.85, het_threshold=0.01, single_mode=False, paired_mode=True, normal_sample_name='NORMAL', tumor_sample_name='TUMOR', print_reject=True, phred_scaled=True, extra_headers=[]):
 
     tools_code = {'CGA':           'M',
@@ -104,12 +175,13 @@ def tsv2vcf(tsv_fn, vcf_fn, tools, pass_score=0.5, lowqual_score=0.1, hom_thresh
     tool_string = ', '.join( tools )
         
     
-    with open(tsv_fn) as tsv, open(vcf_fn, 'w') as vcf:
+    # tsv_fn can also be a .parquet/.npz table file (see feature_table)
+    tsv_rows = rows_of_tsv(tsv_fn)
+    
+    with open(vcf_fn, 'w') as vcf:
         
         # First line is a header:
-        tsv_i = tsv.readline().rstrip()
-        
-        tsv_header = tsv_i.split('\t')
+        tsv_header = list( next(tsv_rows) )
         
         # Make the header items into indices (single/paired have different tool names)
         toolcode2index = {}
@@ -238,12 +310,8 @@ def tsv2vcf(tsv_fn, vcf_fn, tools, pass_score=0.5, lowqual_score=0.1, hom_thresh
         
         
         # Start writing content:
-        tsv_i = tsv.readline().rstrip()
-        
-        
-        while tsv_i:
+        for tsv_item in tsv_rows:
             
-            tsv_item = tsv_i.split('\t')
             try:
                 score = float( tsv_item[SCORE] )
             except NameError:
@@ -425,10 +493,6 @@ def tsv2vcf(tsv_fn, vcf_fn, tools, pass_score=0.5, lowqual_score=0.1, hom_thresh
                 
                 vcf.write( vcf_line + '\n' )
     
-    
-            # Next line:
-            tsv_i = tsv.readline().rstrip()
-    
 
 
 
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+# An on-disk SQLite cache of what sequencing_features.from_bam extracts at a site, so that re-running vcf2tsv on the same BAM files,
+# e.g., after adding a caller, changing min_caller, or retraining, does not read the same reads again.
+# Entries are keyed by the BAM file (path, size, and modification time, so a changed BAM file never hits old entries),
+# the variant (contig, position, ref, first alt), min_mq/min_bq, and max_depth. The cache is kept under a size limit by evicting the least recently used entries.
+# The p-values are not cached: they are computed from the cached samples by sequencing_features.bam_statistics, as for freshly extracted sites.
+
+import os, json, sqlite3, time
+import somaticseq.sequencing_features as sequencing_features
+
+DEFAULT_CACHE_MEGABYTES = 4096
+
+# Entries waiting to be written are committed in one transaction every this many sites:
+CACHE_COMMIT_SIZE = 5000
+
+# The from_bam outputs kept in the cache, i.e., every feature written to the TSV file, and the samples that its p-values are computed from:
+CACHED_FEATURES = ('dp', 'ref_mq', 'alt_mq', 'ref_bq', 'alt_bq', 'ref_NM', 'alt_NM', 'NM_Diff', \
+                   'ref_concordant_reads', 'ref_discordant_reads', 'alt_concordant_reads', 'alt_discordant_reads', \
+                   'ref_for', 'ref_rev', 'alt_for', 'alt_rev', 'ref_SC_reads', 'alt_SC_reads', 'ref_notSC_reads', 'alt_notSC_reads', \
+                   'MQ0', 'noise_read_count', 'poor_read_count', \
+                   'ref_indel_1bp', 'ref_indel_2bp', 'ref_indel_3bp', 'alt_indel_1bp', 'alt_indel_2bp', 'alt_indel_3bp', \
+                   'consistent_mates', 'inconsistent_mates', 'downsampled', \
+                   'ref_read_mq', 'alt_read_mq', 'ref_read_bq', 'alt_read_bq', 'ref_pos_from_end', 'alt_pos_from_end')
+
+
+
+def bam_identity(bam_file):
+    '''The BAM file's absolute path, size, and modification time.'''
+
+    stat_i = os.stat(bam_file)
+    return '{}:{}:{}'.format( os.path.realpath(bam_file), stat_i.st_size, stat_i.st_mtime_ns )
+
+
+
+class Bam_feature_cache:
+
+    def __init__(self, cache_file, max_megabytes=DEFAULT_CACHE_MEGABYTES):
+
+        self.cache_file = cache_file
+        self.max_bytes  = max_megabytes * 2**20
+        self.identities = {}
+        self.to_insert  = []
+        self.to_touch   = []
+        self.hits       = 0
+        self.misses     = 0
+        self.evicted    = 0
+        self.now        = int( time.time() )
+
+        # Many vcf2tsv processes may share the cache, so wait for each other's writes rather than fail:
+        self.connection = sqlite3.connect(cache_file, timeout=600)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS bam_features (bam TEXT, contig TEXT, position INTEGER, ref TEXT, alt TEXT, min_mq REAL, min_bq REAL, max_depth INTEGER, features TEXT, size INTEGER, last_used INTEGER)')
+        self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS bam_site ON bam_features (bam, contig, position, ref, alt, min_mq, min_bq, max_depth)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS bam_features_last_used ON bam_features (last_used)')
+        self.connection.commit()
+
+
+    def from_bam(self, bam, bam_file, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10, max_depth=None):
+        '''sequencing_features.from_bam(bam, my_coordinate, ref_base, first_alt, min_mq, min_bq, defer_statistics=True, max_depth=max_depth), from the cache if bam_file has the site.'''
+
+        if bam_file not in self.identities:
+            self.identities[bam_file] = bam_identity(bam_file)
+
+        key = (self.identities[bam_file], my_coordinate[0], my_coordinate[1], ref_base, first_alt, min_mq, min_bq, max_depth or 0)
+
+        cached = self.connection.execute('SELECT features FROM bam_features WHERE bam=? AND contig=? AND position=? AND ref=? AND alt=? AND min_mq=? AND min_bq=? AND max_depth=?', key).fetchone()
+
+        if cached:
+            self.hits += 1
+            self.to_touch.append( key )
+            bam_features = json.loads( cached[0] )
+
+        else:
+            self.misses += 1
+            bam_features = sequencing_features.from_bam(bam, my_coordinate, ref_base, first_alt, min_mq, min_bq, defer_statistics=True, max_depth=max_depth)
+            features_i   = json.dumps( {feature_i: bam_features[feature_i] for feature_i in CACHED_FEATURES}, separators=(',', ':') )
+            self.to_insert.append( key + (features_i, len(features_i), self.now) )
+
+        if len(self.to_insert) + len(self.to_touch) >= CACHE_COMMIT_SIZE:
+            self.commit()
+
+        return bam_features
+
+
+    def commit(self):
+
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO bam_features VALUES (?,?,?,?,?,?,?,?,?,?,?)', self.to_insert)
+            self.connection.executemany('UPDATE bam_features SET last_used=? WHERE bam=? AND contig=? AND position=? AND ref=? AND alt=? AND min_mq=? AND min_bq=? AND max_depth=?', [ (self.now,) + key for key in self.to_touch ])
+
+        self.to_insert = []
+        self.to_touch  = []
+
+
+    def evict(self):
+        '''Delete the least recently used entries until the cached features are within max_megabytes.'''
+
+        with self.connection:
+
+            total_bytes = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM bam_features').fetchone()[0]
+            excess      = total_bytes - self.max_bytes
+
+            if excess <= 0:
+                return 0
+
+            evicted = []
+            for rowid, size in self.connection.execute('SELECT rowid, size FROM bam_features ORDER BY last_used'):
+                if excess <= 0:
+                    break
+                evicted.append( (rowid,) )
+                excess -= size
+
+            # The freed pages are reused by later entries, so the file does not keep growing:
+            self.connection.executemany('DELETE FROM bam_features WHERE rowid=?', evicted)
+
+        return len(evicted)
+
+
+    def close(self):
+
+        self.commit()
+        self.evicted = self.evict()
+        self.connection.close()
+
+
+    def summary(self):
+        return 'BAM feature cache {}: {} hits, {} misses, {} entries evicted'.format(self.cache_file, self.hits, self.misses, self.evicted)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Statistical tests for many sites at once.
+# scipy's per-call overhead is much larger than the arithmetic for the small samples at each site, so the common cases are computed here with NumPy.
+# The p-values are the same as calling scipy one site at a time.
+
+import inspect, functools
+import numpy as np
+import scipy.stats as stats
+import scipy.special as special
+
+nan = float('nan')
+
+# The vectorized Mann-Whitney U test follows scipy's own implementation (the "method" argument came with it, in scipy 1.7).
+# Older scipy computes these p-values differently, so one site at a time with the older scipy is the only way to get the same p-values there.
+vectorized_mannwhitneyu = 'method' in inspect.signature(stats.mannwhitneyu).parameters
+
+# Number of distinct 2x2 tables whose Fisher's exact test p-values are kept:
+FISHER_EXACT_CACHE_SIZE = 2**17
+
+
+
+def mannwhitneyu_less_one_site(sample_1, sample_2):
+    '''
+    stats.mannwhitneyu(sample_1, sample_2, use_continuity=True, alternative='less'),
+    but returns 0.5 if scipy rejects two non-empty samples (e.g., older scipy when all numbers are identical), or nan if either sample is empty.
+    '''
+
+    try:
+        p_value = stats.mannwhitneyu(sample_1, sample_2, use_continuity=True, alternative='less')[1]
+
+    except ValueError:
+        if len(sample_1) > 0 and len(sample_2) > 0:
+            p_value = 0.5
+        else:
+            p_value = nan
+
+    return p_value
+
+
+
+def mannwhitneyu_less(samples_1, samples_2):
+    '''
+    For each pair of samples, i.e., samples_1[k] and samples_2[k], return the same p-value as mannwhitneyu_less_one_site(samples_1[k], samples_2[k]).
+    Sites with small samples and no ties (where scipy uses the exact distribution) still go through scipy.
+    '''
+
+    num_sites = len(samples_1)
+    assert num_sites == len(samples_2)
+
+    if not vectorized_mannwhitneyu:
+        return [ mannwhitneyu_less_one_site(sample_1, sample_2) for sample_1, sample_2 in zip(samples_1, samples_2) ]
+
+    p_values = np.full(num_sites, nan)
+
+    n1 = np.array([len(sample_i) for sample_i in samples_1], dtype=np.int64)
+    n2 = np.array([len(sample_i) for sample_i in samples_2], dtype=np.int64)
+
+    # Empty samples give nan:
+    tested = np.flatnonzero( (n1 > 0) & (n2 > 0) )
+    if tested.size == 0:
+        return p_values
+
+    n1 = n1[tested]
+    n2 = n2[tested]
+    n  = n1 + n2
+
+    # All samples in one array: sample_1 followed by sample_2 for each site
+    site_of_value = np.repeat( np.arange(tested.size), n )
+    values        = np.fromiter( (value_i for k in tested for sample_i in (samples_1[k], samples_2[k]) for value_i in sample_i), dtype=np.float64, count=n.sum() )
+    site_offsets  = np.cumsum(n) - n
+    in_sample_1   = np.arange(values.size) - site_offsets[site_of_value] < n1[site_of_value]
+
+    # Rank within each site, average ranks for ties:
+    order         = np.lexsort( (values, site_of_value) )
+    sorted_values = values[order]
+    sorted_sites  = site_of_value[order]
+    new_run       = np.ones(values.size, dtype=bool)
+    new_run[1:]   = (sorted_values[1:] != sorted_values[:-1]) | (sorted_sites[1:] != sorted_sites[:-1])
+
+    run_of_value = np.cumsum(new_run) - 1
+    run_starts   = np.flatnonzero(new_run)
+    run_lengths  = np.diff( np.append(run_starts, values.size) )
+    run_sites    = sorted_sites[run_starts]
+    run_ranks    = (run_starts - site_offsets[run_sites]) + (run_lengths + 1) / 2
+
+    # Ranks are multiples of 0.5, and tie counts are integers, so these sums are exact:
+    R1       = np.bincount( sorted_sites, weights=run_ranks[run_of_value] * in_sample_1[order], minlength=tested.size )
+    ties     = run_lengths.astype(np.float64)
+    tie_term = np.bincount( run_sites, weights=ties**3 - ties, minlength=tested.size )
+    has_ties = np.bincount( run_sites, weights=run_lengths > 1, minlength=tested.size ) > 0
+
+    # Same arithmetic as scipy's asymptotic method with alternative='less', i.e., the survival function of U2:
+    U1 = R1 - n1*(n1+1)/2
+    U2 = n1 * n2 - U1
+    mu = n1 * n2 / 2
+    s  = np.sqrt( n1*n2/12 * ((n + 1) - tie_term/(n*(n-1))) )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = (U2 - mu - 0.5) / s
+
+    p_values[tested] = np.clip( special.ndtr(-z), 0., 1. )
+
+    # scipy uses the exact distribution for small samples without ties:
+    for k in np.flatnonzero( ((n1 <= 8) | (n2 <= 8)) & ~has_ties ):
+        site_k = tested[k]
+        p_values[site_k] = mannwhitneyu_less_one_site(samples_1[site_k], samples_2[site_k])
+
+    return p_values
+
+
+
+@functools.lru_cache(maxsize=FISHER_EXACT_CACHE_SIZE)
+def fisher_exact_p_value(table, alternative='two-sided'):
+    '''
+    stats.fisher_exact(table, alternative)[1], where table is a tuple of tuples, i.e., ((a, b), (c, d)).
+    The same small tables keep showing up across sites, so the p-values are kept in a bounded LRU cache shared by all the call sites.
+    '''
+    return stats.fisher_exact(table, alternative=alternative)[1]
+
+
+
+def fisher_exact(tables, alternative='two-sided'):
+    '''stats.fisher_exact(table, alternative)[1] for each 2x2 table, i.e., ((a, b), (c, d)).'''
+    return [ fisher_exact_p_value( (tuple(table_i[0]), tuple(table_i[1])), alternative ) for table_i in tables ]
+
+
+
+def fisher_exact_cache_summary():
+    '''A one-line summary of how often fisher_exact_p_value was served from its cache.'''
+
+    cache_info = fisher_exact_p_value.cache_info()
+    num_calls  = cache_info.hits + cache_info.misses
+    hit_rate   = cache_info.hits / num_calls if num_calls else nan
+
+    return 'Fisher exact test cache: {} calls, {} hits ({:.1%}), {} cached tables'.format(num_calls, cache_info.hits, hit_rate, cache_info.currsize)
@@ -157,21 +157,12 @@ def combineSingle(outdir, ref, bam, inclusion=None, exclusion=None, mutect=None,
         intermediate_vcfs['Strelka']['indel'] = indel_strelka_out
 
 
-    # Combine SNV/INDEL variant candidates
-    snv_combined   = os.sep.join(( outdir, 'unsorted.CombineVariants.snv.vcf' ))
-    indel_combined = os.sep.join(( outdir, 'unsorted.CombineVariants.indel.vcf' ))
-    
-    getUniqueVcfPositions.combine(snv_intermediates, snv_combined)
-    getUniqueVcfPositions.combine(indel_intermediates, indel_combined)
-    for file_i in snv_combined, indel_combined:
-        intermediate_files.add( file_i )
-    
-    # Sort them:
+    # Combine SNV/INDEL variant candidates, merged from the sorted VCF files into sorted VCF files
     snv_combined_sorted = os.sep.join(( outdir, 'CombineVariants.snv.vcf' ))
     indel_combined_sorted = os.sep.join(( outdir, 'CombineVariants.indel.vcf' ))
     
-    vcfsorter(ref, snv_combined,   snv_combined_sorted)
-    vcfsorter(ref, indel_combined, indel_combined_sorted)
+    getUniqueVcfPositions.combine(snv_intermediates,   snv_combined_sorted,   ref + '.fai')
+    getUniqueVcfPositions.combine(indel_intermediates, indel_combined_sorted, ref + '.fai')
     
 
     if not keep_intermediates:
@@ -439,22 +430,12 @@ def combinePaired(outdir, ref, tbam, nbam, inclusion=None, exclusion=None, mutec
 
     
     
-    # Combine SNV/INDEL variant candidates
-    snv_combined   = os.sep.join(( outdir, 'unsorted.CombineVariants.snv.vcf' ))
-    indel_combined = os.sep.join(( outdir, 'unsorted.CombineVariants.indel.vcf' ))
-    
-    getUniqueVcfPositions.combine(snv_intermediates, snv_combined)
-    getUniqueVcfPositions.combine(indel_intermediates, indel_combined)
-    
-    for file_i in snv_combined, indel_combined:
-        intermediate_files.add( file_i )
-    
-    # Sort them:
+    # Combine SNV/INDEL variant candidates, merged from the sorted VCF files into sorted VCF files
     snv_combined_sorted = os.sep.join(( outdir, 'CombineVariants.snv.vcf' ))
     indel_combined_sorted = os.sep.join(( outdir, 'CombineVariants.indel.vcf' ))
     
-    vcfsorter(ref, snv_combined,   snv_combined_sorted)
-    vcfsorter(ref, indel_combined, indel_combined_sorted)
+    getUniqueVcfPositions.combine(snv_intermediates,   snv_combined_sorted,   ref + '.fai')
+    getUniqueVcfPositions.combine(indel_intermediates, indel_combined_sorted, ref + '.fai')
     
     if not keep_intermediates:
         for file_i in intermediate_files:
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+
+# Which output columns of somatic_vcf2tsv.py and single_sample_vcf2tsv.py come out of which of their costlier computations,
+# so that the computations none of whose columns are wanted (e.g., by the classifier that will score the output) can be skipped.
+# Skipped columns are written as nan. Every other column is always computed.
+
+import os
+import numpy as np
+
+# computation: the columns it produces
+LAZY_FEATURES = { \
+'sequence_complexity':   ('Seq_Complexity_Span', 'Seq_Complexity_Adj'),               \
+'homopolymer':           ('MaxHomopolymer_Length', 'SiteHomopolymer_Length'),          \
+'varscan2_score':        ('VarScan2_Score',),                                          \
+'p_mannwhitneyu_mq':     ('nBAM_p_MannWhitneyU_MQ', 'tBAM_p_MannWhitneyU_MQ'),         \
+'p_mannwhitneyu_bq':     ('nBAM_p_MannWhitneyU_BQ', 'tBAM_p_MannWhitneyU_BQ'),         \
+'p_mannwhitneyu_endpos': ('nBAM_p_MannWhitneyU_EndPos', 'tBAM_p_MannWhitneyU_EndPos'), \
+'concordance_fet':       ('nBAM_Concordance_FET', 'tBAM_Concordance_FET'),             \
+'strandbias_fet':        ('nBAM_StrandBias_FET', 'tBAM_StrandBias_FET'),               \
+'clipping_fet':          ('nBAM_Clipping_FET', 'tBAM_Clipping_FET'),                   \
+}
+
+
+
+def skipped_computations(features=None):
+    '''The computations in LAZY_FEATURES that produce none of the features. Nothing is skipped if features is None.'''
+
+    if features is None:
+        return set()
+
+    return { computation_i for computation_i in LAZY_FEATURES if not set(LAZY_FEATURES[computation_i]) & set(features) }
+
+
+
+def model_features(model_file):
+    '''
+    The features a classifier actually splits on:
+    from a model compiled by tree_ensemble.py, from the .feature_importance.txt file saved next to an xgboost model,
+    or from the xgboost model itself.
+    '''
+
+    if model_file.endswith('.trees.npz'):
+        with np.load(model_file, allow_pickle=False) as model:
+            is_split = model['left'] != np.arange( model['left'].shape[1] )
+            return set( model['feature_names'][ np.unique(model['feature'][is_split]) ] )
+
+    if os.path.exists(model_file + '.feature_importance.txt'):
+        with open(model_file + '.feature_importance.txt') as importance:
+            importance.readline()
+            return { line_i.split('\t')[0] for line_i in importance if line_i.strip() }
+
+    import xgboost as xgb
+
+    xgb_model = xgb.Booster()
+    xgb_model.load_model(model_file)
+
+    return set( xgb_model.get_score(importance_type='weight') )
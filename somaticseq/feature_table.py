@@ -0,0 +1,329 @@
+#!/usr/bin/env python3
+
+# The Ensemble TSV files as typed, columnar tables, i.e., Parquet files (if pyarrow is installed) or NPZ files,
+# so that training, prediction, and tsv2vcf do not parse every number out of the text again.
+# Every column of the Ensemble TSV files has a declared type (COLUMN_TYPES), which is applied whenever a table file is read or written,
+# so a column has the same type in every table file, e.g., T_DP is an integer column whether or not it has a nan.
+# A TSV file is read with the types pandas infers, as it always has been, so that the TSV files made from it, e.g., by the predictors, are unchanged.
+
+import zipfile
+import numpy as np
+import pandas as pd
+import somaticseq.tsv_writer as tsv_writer
+
+TABLE_EXTENSIONS = ('.parquet', '.npz')
+TABLE_CHUNK_SIZE = 10000
+
+# Arrays in the NPZ file that are not columns, i.e., the column names, and the number of rows of each chunk:
+NPZ_COLUMN_ORDER = '__columns__'
+NPZ_CHUNK_ROWS   = '__chunk_rows__'
+
+STRING_COLUMNS = ('CHROM', 'ID', 'REF', 'ALT')
+
+# Caller columns. The if_* flags are floats, as some are fractions, e.g., 0.5 for VarDict's LikelySomatic calls:
+CALLER_COLUMNS = ('if_MuTect', 'if_VarScan2', 'if_JointSNVMix2', 'if_SomaticSniper', 'if_VarDict', 'MuSE_Tier', 'if_LoFreq', 'if_Scalpel', 'if_Strelka', 'if_TNscope', 'if_Platypus', \
+                  'Strelka_Score', 'Strelka_QSS', 'Strelka_TQSS', 'VarScan2_Score', 'SNVMix2_Score', 'Sniper_Score', 'VarDict_Score', \
+                  'M2_NLOD', 'M2_TLOD', 'M2_STR', 'M2_ECNT', 'SOR', 'MSI', 'MSILEN', 'SHIFT3')
+
+# Annotation columns that are counts or flags, and those that are not:
+INTEGER_ANNOTATION_COLUMNS = ('if_dbsnp', 'COMMON', 'if_COSMIC', 'COSMIC_CNT', 'MaxHomopolymer_Length', 'SiteHomopolymer_Length', 'InDel_Length')
+FLOAT_ANNOTATION_COLUMNS   = ('Seq_Complexity_Span', 'Seq_Complexity_Adj')
+
+LABEL_COLUMN = 'TrueVariant_or_False'
+# The predictors' scores are float32, as xgboost computes them:
+SCORE_COLUMN = 'SCORE'
+
+
+def declared_column_types():
+    '''
+    The type of every column of the Ensemble TSV files. The BAM columns written as is (tsv_writer.BAM_COLUMNS) are counts,
+    and they, the mates, and the other integer columns are nullable integers (Int64), because any of them can be nan.
+    '''
+
+    column_types = { column_i: 'str' for column_i in STRING_COLUMNS }
+    column_types['POS'] = 'int64'
+
+    column_types.update( (column_i, 'float64') for column_i in CALLER_COLUMNS + FLOAT_ANNOTATION_COLUMNS )
+    column_types[ SCORE_COLUMN ] = 'float32'
+    column_types.update( (column_i, 'Int64')   for column_i in INTEGER_ANNOTATION_COLUMNS + (LABEL_COLUMN,) )
+    column_types.update( (column_i, 'Int64')   for column_i, key_i in tsv_writer.MATE_COLUMNS )
+
+    for sample_i in ('N', 'T'):
+        for template_i, key_i, conversion_i in tsv_writer.BAM_COLUMNS:
+            column_i = template_i.format(S=sample_i.upper(), s=sample_i.lower())
+            column_types[ column_i ] = 'float64' if conversion_i else 'Int64'
+
+    return column_types
+
+COLUMN_TYPES = declared_column_types()
+
+
+
+def with_column_types(data_frame):
+    '''The data frame with the declared types of its columns. Other columns, if any, are kept as they are.'''
+
+    column_types = { column_i: COLUMN_TYPES[column_i] for column_i in data_frame.columns if column_i in COLUMN_TYPES and data_frame[column_i].dtype != COLUMN_TYPES[column_i] }
+
+    return data_frame.astype(column_types) if column_types else data_frame
+
+
+
+def is_table(file_name):
+    return file_name.lower().endswith(TABLE_EXTENSIONS)
+
+
+
+def read_tsv(tsv_file, chunksize=None):
+    return pd.read_csv(tsv_file, sep='\t', dtype={ column_i: str for column_i in STRING_COLUMNS }, chunksize=chunksize, low_memory=False)
+
+
+
+def npz_array(column):
+    '''The column as a plain numpy array, i.e., nan for the missing values of the nullable integer columns.'''
+
+    if isinstance(column.dtype, pd.Int64Dtype):
+        return column.to_numpy(dtype=np.float64, na_value=np.nan)
+
+    return column.to_numpy( dtype=str if column.name in STRING_COLUMNS else None )
+
+
+
+def import_pyarrow():
+
+    try:
+        import pyarrow, pyarrow.parquet
+    except ImportError:
+        raise ImportError('Parquet files require pyarrow. Use a .npz file name instead.')
+
+    return pyarrow
+
+
+
+class Table_writer:
+    '''
+    Write a table file a chunk of rows at a time, so the whole table never has to be in memory.
+    Each chunk is a row group of the Parquet file, or a set of arrays of the NPZ file, i.e., c{n}_{k} for column n of chunk k, 
+    so that read_table_in_chunks also reads them back one at a time.
+    '''
+
+    def __init__(self, table_file):
+
+        self.table_file = table_file
+        self.is_parquet = table_file.lower().endswith('.parquet')
+        self.columns    = None
+        self.chunk_rows = []
+
+        if self.is_parquet:
+            self.pyarrow        = import_pyarrow()
+            self.parquet_writer = None
+        else:
+            self.npz = zipfile.ZipFile(table_file, 'w', compression=zipfile.ZIP_DEFLATED)
+
+
+    def write(self, data_frame):
+
+        data_frame = with_column_types(data_frame)
+
+        if self.columns is None:
+            self.columns = list(data_frame.columns)
+
+        if self.is_parquet:
+
+            # The schema of the first chunk is that of the file, which the declared column types keep the same for every chunk:
+            if self.parquet_writer is None:
+                self.schema         = self.pyarrow.Schema.from_pandas(data_frame, preserve_index=False)
+                self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.table_file, self.schema)
+
+            self.parquet_writer.write_table( self.pyarrow.Table.from_pandas(data_frame, schema=self.schema, preserve_index=False) )
+
+        else:
+            for n, column_i in enumerate(self.columns):
+                self.write_npz_array( 'c{}_{}'.format(n, len(self.chunk_rows)), npz_array(data_frame[column_i]) )
+
+        self.chunk_rows.append( len(data_frame) )
+
+
+    def write_npz_array(self, name, array):
+        with self.npz.open(name + '.npy', 'w', force_zip64=True) as npy:
+            np.lib.format.write_array(npy, array, allow_pickle=False)
+
+
+    def close(self):
+
+        if self.is_parquet:
+            if self.parquet_writer is None:
+                self.parquet_writer = self.pyarrow.parquet.ParquetWriter(self.table_file, self.pyarrow.schema([]))
+            self.parquet_writer.close()
+
+        else:
+            self.write_npz_array( NPZ_COLUMN_ORDER, np.array(self.columns or [], dtype=str) )
+            self.write_npz_array( NPZ_CHUNK_ROWS,   np.array(self.chunk_rows, dtype=np.int64) )
+            self.npz.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+
+def write_table(data_frame, table_file, chunksize=TABLE_CHUNK_SIZE):
+
+    with Table_writer(table_file) as table:
+
+        # An empty data frame is still written, for its columns:
+        for start_i in range(0, max(len(data_frame), 1), chunksize):
+            table.write( data_frame.iloc[start_i:start_i+chunksize] )
+
+    return table_file
+
+
+
+def read_table_in_chunks(table_file, chunksize=TABLE_CHUNK_SIZE, columns=None):
+    '''
+    The table file as data frames of up to chunksize rows, reading a Parquet row group or an NPZ chunk at a time.
+    With chunksize=None, the NPZ chunks are returned as they were written.
+    '''
+
+    if table_file.lower().endswith('.parquet'):
+
+        parquet_file = import_pyarrow().parquet.ParquetFile(table_file)
+
+        for batch_i in parquet_file.iter_batches(batch_size=chunksize or TABLE_CHUNK_SIZE, columns=columns):
+            yield with_column_types( batch_i.to_pandas() )
+
+    else:
+        with np.load(table_file, allow_pickle=False) as npz:
+
+            column_names = list( npz[NPZ_COLUMN_ORDER] )
+
+            for k, num_rows in enumerate( npz[NPZ_CHUNK_ROWS] ):
+
+                chunk_k = pd.DataFrame( { column_i: npz['c{}_{}'.format(n, k)] for n, column_i in enumerate(column_names) if (columns is None) or (column_i in columns) } )
+                chunk_k = with_column_types(chunk_k)
+
+                if chunksize:
+                    for start_i in range(0, num_rows, chunksize):
+                        yield chunk_k.iloc[start_i:start_i+chunksize]
+                else:
+                    yield chunk_k
+
+
+
+def read_table(table_file, columns=None):
+
+    if table_file.lower().endswith('.parquet'):
+        return with_column_types( pd.read_parquet(table_file, columns=columns) )
+
+    chunks = list( read_table_in_chunks(table_file, None, columns) )
+
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+
+
+def tsv2table(tsv_file, table_file):
+    '''Write the TSV file as a table file, with the declared column types, a chunk at a time.'''
+
+    with Table_writer(table_file) as table:
+        for chunk_i in read_tsv(tsv_file, chunksize=TABLE_CHUNK_SIZE):
+            table.write( chunk_i )
+
+    return table_file
+
+
+
+def text_columns_as_frame(columns, column_buffers):
+    '''
+    A data frame of the block of TSV lines that are still in memory as columns of text, i.e., as tsv_writer.Block_writer formats them.
+    Each column is converted into its declared type, with anything that is not a number, e.g., nan, as missing.
+    '''
+
+    data_frame = {}
+    for column_i, values_i in zip(columns, column_buffers):
+
+        type_i = COLUMN_TYPES.get(column_i, 'str')
+
+        if type_i == 'str':
+            data_frame[ column_i ] = pd.Series(values_i, dtype=type_i)
+        else:
+            data_frame[ column_i ] = pd.to_numeric( pd.Series(values_i, dtype=object), errors='coerce' ).astype(type_i)
+
+    return pd.DataFrame(data_frame, columns=columns)
+
+
+
+def concat_tables(table_files, table_file):
+    '''Write the table files one after another into table_file, a chunk at a time.'''
+
+    with Table_writer(table_file) as table:
+        for table_file_i in table_files:
+            for chunk_i in read_table_in_chunks(table_file_i, None):
+                table.write( chunk_i )
+
+    return table_file
+
+
+
+def read_columns(file_name):
+    '''The column names of the TSV or table file, from its header or schema, without reading the rows.'''
+
+    if file_name.lower().endswith('.parquet'):
+        return list( import_pyarrow().parquet.read_schema(file_name).names )
+
+    elif is_table(file_name):
+        with np.load(file_name, allow_pickle=False) as npz:
+            return list( npz[NPZ_COLUMN_ORDER] )
+
+    else:
+        return list( pd.read_csv(file_name, sep='\t', nrows=0).columns )
+
+
+
+def read_data(file_name):
+    '''The whole TSV or table file as a data frame.'''
+    return read_table(file_name) if is_table(file_name) else read_tsv(file_name)
+
+
+
+def read_data_in_chunks(file_name, chunksize=TABLE_CHUNK_SIZE):
+    '''The TSV or table file as data frames of (up to) chunksize rows, only one of which is in memory at a time.'''
+
+    if is_table(file_name):
+        yield from read_table_in_chunks(file_name, chunksize)
+    else:
+        yield from read_tsv(file_name, chunksize=chunksize)
+
+
+
+class Tsv_writer:
+    '''Write a TSV file a chunk of rows at a time, like Table_writer, with the header before the first chunk.'''
+
+    def __init__(self, tsv_file):
+        self.outhandle = open(tsv_file, 'w')
+        self.header    = True
+
+
+    def write(self, data_frame):
+        data_frame.to_csv(self.outhandle, sep='\t', index=False, header=self.header, na_rep='nan')
+        self.header = False
+
+
+    def close(self):
+        self.outhandle.close()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+
+def open_writer(file_name):
+    '''A Table_writer or Tsv_writer, depending on the file name, to write data frames into one after another.'''
+    return Table_writer(file_name) if is_table(file_name) else Tsv_writer(file_name)
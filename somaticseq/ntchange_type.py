@@ -1,76 +1,25 @@
 #!/usr/bin/env python3
 
+import numpy as np
+import pandas as pd
+
+NTCHANGE_COLUMNS = ('GC2CG', 'GC2TA', 'GC2AT', 'TA2AT', 'TA2GC', 'TA2CG')
+
 
 def ntchange( variant_frame ):
+    '''
+    Add the six nucleotide substitution columns, GC2CG, GC2TA, GC2AT, TA2AT, TA2GC, and TA2CG, for the REF/ALT of every row.
+    N.B.: every one of the six columns is the GC2CG indicator, i.e., 1 for G>C or C>G and 0 otherwise, 
+    which is what the existing classifiers have been trained with, so it stays this way.
+    '''
     
-    GC2CG = []
-    GC2TA = []
-    GC2AT = []
-    TA2AT = []
-    TA2GC = []
-    TA2CG = []
+    ref = variant_frame['REF']
+    alt = variant_frame['ALT']
     
-    for ref, alt in zip(variant_frame['REF'], variant_frame['ALT']):
-        
-        ref = ref.upper()
-        alt = alt.upper()
-        
-        if (ref == 'G' and alt == 'C') or (ref == 'C' and alt == 'G'):
-            GC2CG.append(1)
-            GC2TA.append(0)
-            GC2AT.append(0)
-            TA2AT.append(0)
-            TA2GC.append(0)
-            TA2CG.append(0)
-            
-        elif (ref == 'G' and alt == 'T') or (ref == 'C' and alt == 'A'):
-            GC2CG.append(0)
-            GC2TA.append(1)
-            GC2AT.append(0)
-            TA2AT.append(0)
-            TA2GC.append(0)
-            TA2CG.append(0)
-
-        elif (ref == 'G' and alt == 'A') or (ref == 'C' and alt == 'T'):
-            GC2CG.append(0)
-            GC2TA.append(0)
-            GC2AT.append(1)
-            TA2AT.append(0)
-            TA2GC.append(0)
-            TA2CG.append(0)
-
-        elif (ref == 'T' and alt == 'A') or (ref == 'A' and alt == 'T'):
-            GC2CG.append(0)
-            GC2TA.append(0)
-            GC2AT.append(0)
-            TA2AT.append(1)
-            TA2GC.append(0)
-            TA2CG.append(0)
-
-        elif (ref == 'T' and alt == 'G') or (ref == 'A' and alt == 'C'):
-            GC2CG.append(0)
-            GC2TA.append(0)
-            GC2AT.append(0)
-            TA2AT.append(0)
-            TA2GC.append(1)
-            TA2CG.append(0)
-
-        elif (ref == 'T' and alt == 'C') or (ref == 'A' and alt == 'G'):
-            GC2CG.append(0)
-            GC2TA.append(0)
-            GC2AT.append(0)
-            TA2AT.append(0)
-            TA2GC.append(0)
-            TA2CG.append(1)
-            
-        else:
-            GC2CG.append(0)
-            GC2TA.append(0)
-            GC2AT.append(0)
-            TA2AT.append(0)
-            TA2GC.append(0)
-            TA2CG.append(0)
-
-    new_data = variant_frame.assign(GC2CG = GC2CG, GC2TA = GC2CG, GC2AT = GC2CG, TA2AT = GC2CG, TA2GC = GC2CG, TA2CG = GC2CG)
+    GC2CG = ( (ref.isin(('G', 'g')) & alt.isin(('C', 'c'))) | (ref.isin(('C', 'c')) & alt.isin(('G', 'g'))) ).to_numpy(dtype=np.int64)
+    
+    # Joined all at once, as inserting the columns one by one into a frame of ~100 columns fragments it (pandas PerformanceWarning):
+    ntchange_columns = pd.DataFrame({column_i: GC2CG for column_i in NTCHANGE_COLUMNS}, index=variant_frame.index)
+    new_data         = pd.concat( (variant_frame.drop(columns=list(NTCHANGE_COLUMNS), errors='ignore'), ntchange_columns), axis=1 )
     
     return new_data
@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-import sys, argparse, gzip, os, re, subprocess, logging
+import sys, argparse, gzip, os, re, subprocess, logging, logging.handlers, multiprocessing
 import genomicFileHandler.genomic_file_handlers as genome
 import vcfModifier.copy_TextFile as copy_TextFile
 import somaticseq.combine_callers as combineCallers
@@ -57,7 +57,7 @@ def modelTrainer(input_file, algo, threads=1, seed=0, max_depth=12, iterations=2
 
 
     
-def modelPredictor(input_file, output_file, algo, classifier, iterations=100, features_to_exclude=[]):
+def modelPredictor(input_file, output_file, algo, classifier, iterations=100, features_to_exclude=[], threads=1):
     
     logger = logging.getLogger(modelPredictor.__name__)
     
@@ -70,6 +70,15 @@ def modelPredictor(input_file, output_file, algo, classifier, iterations=100, fe
         return output_file
 
 
+    # A model compiled by tree_ensemble.py is scored without xgboost, with the features it was trained on
+    if algo == 'xgboost' and classifier.endswith('.trees.npz'):
+        import somaticseq.tree_ensemble as tree_ensemble
+        
+        tree_ensemble.predictor(classifier, input_file, output_file, iterations)
+        
+        return output_file
+
+
     if algo == 'xgboost':
         import somaticseq.somatic_xgboost as somatic_xgboost
         
@@ -77,13 +86,104 @@ def modelPredictor(input_file, output_file, algo, classifier, iterations=100, fe
         for feature_i in features_to_exclude:
             non_features.append( feature_i )
 
-        somatic_xgboost.predictor(classifier, input_file, output_file, non_features, iterations)
+        somatic_xgboost.predictor(classifier, input_file, output_file, non_features, iterations, nthread=threads)
         
         return output_file
 
 
 
-def runPaired(outdir, ref, tbam, nbam, tumor_name='TUMOR', normal_name='NORMAL', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, inclusion=None, exclusion=None, mutect=None, indelocator=None, mutect2=None, varscan_snv=None, varscan_indel=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq_snv=None, lofreq_indel=None, scalpel=None, strelka_snv=None, strelka_indel=None, tnscope=None, platypus=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=None, features_excluded=[]):
+def ensemble_table(ensemble_tsv, feature_table_format=None):
+    '''The table file written along with the Ensemble TSV file, e.g., Ensemble.sSNV.npz for Ensemble.sSNV.tsv, if there is a feature_table_format.'''
+    return re.sub(r'\.tsv$', '', ensemble_tsv) + '.' + feature_table_format if feature_table_format else None
+
+
+
+def model_input(ensemble_tsv, ensemble_table, algo):
+    '''xgboost reads the table file (see feature_table) rather than the TSV file, if there is one.'''
+    return ensemble_table if (ensemble_table and algo == 'xgboost') else ensemble_tsv
+
+
+
+def features_of_classifier(classifier, algo, somaticseq_train=False, skip_unused_features=False):
+    '''The features vcf2tsv needs to compute for the classifier, or None for all of them.'''
+
+    # Training needs every feature, and ada models in .RData files cannot be read here:
+    if not (skip_unused_features and classifier and algo == 'xgboost' and not somaticseq_train):
+        return None
+
+    import somaticseq.feature_registry as feature_registry
+
+    return feature_registry.model_features(classifier)
+
+
+
+def run_tracks(tracks, threads=1):
+    '''
+    Run the tracks, i.e., (name, function of the number of threads), each in its own process, with the threads split between them.
+    Their log records are sent back to, and written out by, this process, with the track's name in front of the logger's name.
+    With fewer threads than tracks, or in a daemonic process (e.g., a worker of somaticseq_parallel.py) that cannot start processes, they run one after another.
+    '''
+
+    logger = logging.getLogger(run_tracks.__name__)
+
+    if threads < len(tracks) or multiprocessing.current_process().daemon:
+        for track_name, track_function in tracks:
+            track_function(threads)
+        return
+
+    # e.g., 5 threads are split into 3 for the SNV and 2 for the INDEL track:
+    track_threads = [ threads // len(tracks) + (n < threads % len(tracks)) for n in range( len(tracks) ) ]
+
+    # The tracks are closures over the inputs, so their processes are forked rather than spawned:
+    fork = multiprocessing.get_context('fork')
+
+    log_queue    = fork.Queue()
+    log_listener = logging.handlers.QueueListener(log_queue, *logging.getLogger().handlers, respect_handler_level=True)
+
+    processes = []
+    for (track_name, track_function), threads_i in zip(tracks, track_threads):
+
+        logger.info('{} track with {} threads'.format(track_name, threads_i) )
+
+        process_i = fork.Process(target=run_track, args=(track_name, track_function, threads_i, log_queue), name=track_name)
+        process_i.start()
+        processes.append( process_i )
+
+    # The listener's thread is only started after the forks, so that no child is forked while it holds a lock. The queue keeps the records until then.
+    log_listener.start()
+
+    for process_i in processes:
+        process_i.join()
+
+    log_listener.stop()
+
+    failed_tracks = [ process_i.name for process_i in processes if process_i.exitcode != 0 ]
+    if failed_tracks:
+        raise Exception( 'Failed track(s): {}'.format(', '.join(failed_tracks)) )
+
+
+
+def run_track(track_name, track_function, threads, log_queue):
+    '''The track in its own process, which logs through the log_queue only.'''
+
+    def label_record(record):
+        record.name = '{}:{}'.format(track_name, record.name)
+        return True
+
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter( label_record )
+    logging.getLogger().handlers = [queue_handler]
+
+    # Loggers with handlers of their own, e.g., those of the vcf2tsv scripts, would write around the queue:
+    for logger_i in list( logging.Logger.manager.loggerDict.values() ):
+        if isinstance(logger_i, logging.Logger):
+            logger_i.handlers = []
+
+    track_function(threads)
+
+
+
+def runPaired(outdir, ref, tbam, nbam, tumor_name='TUMOR', normal_name='NORMAL', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, inclusion=None, exclusion=None, mutect=None, indelocator=None, mutect2=None, varscan_snv=None, varscan_indel=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq_snv=None, lofreq_indel=None, scalpel=None, strelka_snv=None, strelka_indel=None, tnscope=None, platypus=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=None, features_excluded=[], threads=1, skip_unused_features=False, feature_cache=None, feature_table_format=None):
 
     logger = logging.getLogger(runPaired.__name__)
 
@@ -126,65 +226,76 @@ def runPaired(outdir, ref, tbam, nbam, tumor_name='TUMOR', normal_name='NORMAL',
     ensembleSnv   = os.sep.join(( outdir, ensembleOutPrefix + 'sSNV.tsv' ))
     ensembleIndel = os.sep.join(( outdir, ensembleOutPrefix + 'sINDEL.tsv' ))
 
+    # With a feature_table_format, the Ensemble features are also written into table files:
+    ensembleSnvTable   = ensemble_table(ensembleSnv,   feature_table_format)
+    ensembleIndelTable = ensemble_table(ensembleIndel, feature_table_format)
+
 
     ######################  SNV  ######################
-    mutect_infile = intermediateVcfs['MuTect2']['snv'] if intermediateVcfs['MuTect2']['snv'] else mutect
+    def snv_track(threads):
 
-    somatic_vcf2tsv.vcf2tsv(is_vcf=outSnv, nbam_fn=nbam, tbam_fn=tbam, truth=truth_snv, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=varscan_snv, jsm=jsm, sniper=sniper, vardict=intermediateVcfs['VarDict']['snv'], muse=muse, lofreq=lofreq_snv, scalpel=None, strelka=strelka_snv, tnscope=intermediateVcfs['TNscope']['snv'], platypus=intermediateVcfs['Platypus']['snv'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleSnv)
+        mutect_infile = intermediateVcfs['MuTect2']['snv'] if intermediateVcfs['MuTect2']['snv'] else mutect
 
+        somatic_vcf2tsv.vcf2tsv(is_vcf=outSnv, nbam_fn=nbam, tbam_fn=tbam, truth=truth_snv, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=varscan_snv, jsm=jsm, sniper=sniper, vardict=intermediateVcfs['VarDict']['snv'], muse=muse, lofreq=lofreq_snv, scalpel=None, strelka=strelka_snv, tnscope=intermediateVcfs['TNscope']['snv'], platypus=intermediateVcfs['Platypus']['snv'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleSnv, threads=threads, features=features_of_classifier(classifier_snv, algo, somaticseq_train, skip_unused_features), feature_cache=feature_cache, output_table=ensembleSnvTable)
 
-    # Classify SNV calls
-    if classifier_snv:
-        classifiedSnvTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.tsv' ))
-        classifiedSnvVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.vcf' ))
 
-        iterations = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
-        modelPredictor(ensembleSnv, classifiedSnvTsv, algo, classifier_snv, iterations=iterations, features_to_exclude=features_excluded)
+        # Classify SNV calls
+        if classifier_snv:
+            classifiedSnvTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.tsv' ))
+            classifiedSnvVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.vcf' ))
 
-        extra_header = ['##SomaticSeqClassifier={}'.format(classifier_snv), ]
+            iterations_i = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
+            modelPredictor(model_input(ensembleSnv, ensembleSnvTable, algo), classifiedSnvTsv, algo, classifier_snv, iterations=iterations_i, features_to_exclude=features_excluded, threads=threads)
 
-        tsv2vcf.tsv2vcf(classifiedSnvTsv, classifiedSnvVcf, snvCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
+            extra_header = ['##SomaticSeqClassifier={}'.format(classifier_snv), ]
 
+            tsv2vcf.tsv2vcf(classifiedSnvTsv, classifiedSnvVcf, snvCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
 
-    else:
-        # Train SNV classifier:
-        if somaticseq_train and truth_snv:
-            
-            iterations = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
-            modelTrainer(ensembleSnv, algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations, features_to_exclude=features_excluded)
-        
-        consensusSnvVcf = os.sep.join(( outdir, consensusOutPrefix + 'sSNV.vcf' ))
-        tsv2vcf.tsv2vcf(ensembleSnv, consensusSnvVcf, snvCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True)
 
+        else:
+            # Train SNV classifier:
+            if somaticseq_train and truth_snv:
+
+                iterations_i = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
+                modelTrainer(model_input(ensembleSnv, ensembleSnvTable, algo), algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations_i, features_to_exclude=features_excluded)
+
+            consensusSnvVcf = os.sep.join(( outdir, consensusOutPrefix + 'sSNV.vcf' ))
+            tsv2vcf.tsv2vcf(ensembleSnv, consensusSnvVcf, snvCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True)
 
 
     ###################### INDEL ######################
-    mutect_infile = intermediateVcfs['MuTect2']['indel'] if intermediateVcfs['MuTect2']['indel'] else indelocator
+    def indel_track(threads):
 
-    somatic_vcf2tsv.vcf2tsv(is_vcf=outIndel, nbam_fn=nbam, tbam_fn=tbam, truth=truth_indel, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=varscan_indel, vardict=intermediateVcfs['VarDict']['indel'], lofreq=lofreq_indel, scalpel=scalpel, strelka=strelka_indel, tnscope=intermediateVcfs['TNscope']['indel'], platypus=intermediateVcfs['Platypus']['indel'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleIndel)
+        mutect_infile = intermediateVcfs['MuTect2']['indel'] if intermediateVcfs['MuTect2']['indel'] else indelocator
 
+        somatic_vcf2tsv.vcf2tsv(is_vcf=outIndel, nbam_fn=nbam, tbam_fn=tbam, truth=truth_indel, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=varscan_indel, vardict=intermediateVcfs['VarDict']['indel'], lofreq=lofreq_indel, scalpel=scalpel, strelka=strelka_indel, tnscope=intermediateVcfs['TNscope']['indel'], platypus=intermediateVcfs['Platypus']['indel'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleIndel, threads=threads, features=features_of_classifier(classifier_indel, algo, somaticseq_train, skip_unused_features), feature_cache=feature_cache, output_table=ensembleIndelTable)
 
-    # Classify INDEL calls
-    if classifier_indel:
-        classifiedIndelTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.tsv' ))
-        classifiedIndelVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.vcf' ))
 
-        iterations = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
-        modelPredictor(ensembleIndel, classifiedIndelTsv, algo, classifier_indel, iterations=iterations, features_to_exclude=features_excluded)
-        
-        extra_header = ['##SomaticSeqClassifier={}'.format(classifier_indel), ]
-        
-        tsv2vcf.tsv2vcf(classifiedIndelTsv, classifiedIndelVcf, indelCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
+        # Classify INDEL calls
+        if classifier_indel:
+            classifiedIndelTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.tsv' ))
+            classifiedIndelVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.vcf' ))
+
+            iterations_i = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
+            modelPredictor(model_input(ensembleIndel, ensembleIndelTable, algo), classifiedIndelTsv, algo, classifier_indel, iterations=iterations_i, features_to_exclude=features_excluded, threads=threads)
+
+            extra_header = ['##SomaticSeqClassifier={}'.format(classifier_indel), ]
+
+            tsv2vcf.tsv2vcf(classifiedIndelTsv, classifiedIndelVcf, indelCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
+
+        else:
+            # Train INDEL classifier:
+            if somaticseq_train and truth_indel:
+
+                iterations_i = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
+                modelTrainer(model_input(ensembleIndel, ensembleIndelTable, algo), algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations_i, features_to_exclude=features_excluded)
 
-    else:
-        # Train INDEL classifier:
-        if somaticseq_train and truth_indel:
-            
-            iterations = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
-            modelTrainer(ensembleIndel, algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations, features_to_exclude=features_excluded)
+            consensusIndelVcf = os.sep.join(( outdir, consensusOutPrefix + 'sINDEL.vcf' ))
+            tsv2vcf.tsv2vcf(ensembleIndel, consensusIndelVcf, indelCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True)
 
-        consensusIndelVcf = os.sep.join(( outdir, consensusOutPrefix + 'sINDEL.vcf' ))
-        tsv2vcf.tsv2vcf(ensembleIndel, consensusIndelVcf, indelCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=False, paired_mode=True, normal_sample_name=normal_name, tumor_sample_name=tumor_name, print_reject=True)
+
+    # The two tracks share nothing but read-only inputs, so they run at the same time with the threads split between them:
+    run_tracks( (('sSNV', snv_track), ('sINDEL', indel_track)), threads )
 
 
     ## Clean up after yourself ##
@@ -198,7 +309,7 @@ def runPaired(outdir, ref, tbam, nbam, tumor_name='TUMOR', normal_name='NORMAL',
 
 
 
-def runSingle(outdir, ref, bam, sample_name='TUMOR', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, inclusion=None, exclusion=None, mutect=None, mutect2=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=None, features_excluded=[]):
+def runSingle(outdir, ref, bam, sample_name='TUMOR', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, inclusion=None, exclusion=None, mutect=None, mutect2=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=None, features_excluded=[], threads=1, skip_unused_features=False, feature_cache=None, feature_table_format=None):
 
     logger = logging.getLogger(runSingle.__name__)
 
@@ -234,63 +345,74 @@ def runSingle(outdir, ref, bam, sample_name='TUMOR', truth_snv=None, truth_indel
     ensembleSnv   = os.sep.join(( outdir, ensembleOutPrefix + 'sSNV.tsv' ))
     ensembleIndel = os.sep.join(( outdir, ensembleOutPrefix + 'sINDEL.tsv' ))
 
+    # With a feature_table_format, the Ensemble features are also written into table files:
+    ensembleSnvTable   = ensemble_table(ensembleSnv,   feature_table_format)
+    ensembleIndelTable = ensemble_table(ensembleIndel, feature_table_format)
+
 
     ######################  SNV  ######################
-    mutect_infile = intermediateVcfs['MuTect2']['snv'] if intermediateVcfs['MuTect2']['snv'] else mutect
+    def snv_track(threads):
 
-    single_sample_vcf2tsv.vcf2tsv(is_vcf=outSnv, bam_fn=bam, truth=truth_snv, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=intermediateVcfs['VarScan2']['snv'], vardict=intermediateVcfs['VarDict']['snv'], lofreq=intermediateVcfs['LoFreq']['snv'], scalpel=None, strelka=intermediateVcfs['Strelka']['snv'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleSnv)
+        mutect_infile = intermediateVcfs['MuTect2']['snv'] if intermediateVcfs['MuTect2']['snv'] else mutect
 
+        single_sample_vcf2tsv.vcf2tsv(is_vcf=outSnv, bam_fn=bam, truth=truth_snv, cosmic=cosmic, dbsnp=dbsnp, mutect=mutect_infile, varscan=intermediateVcfs['VarScan2']['snv'], vardict=intermediateVcfs['VarDict']['snv'], lofreq=intermediateVcfs['LoFreq']['snv'], scalpel=None, strelka=intermediateVcfs['Strelka']['snv'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleSnv, features=features_of_classifier(classifier_snv, algo, somaticseq_train, skip_unused_features), feature_cache=feature_cache, output_table=ensembleSnvTable)
 
-    # Classify SNV calls
-    if classifier_snv:
-        classifiedSnvTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.tsv' ))
-        classifiedSnvVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.vcf' ))
 
-        iterations = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
-        modelPredictor(ensembleSnv, classifiedSnvTsv, algo, classifier_snv, iterations=iterations, features_to_exclude=features_excluded)
-        
-        extra_header = ['##SomaticSeqClassifier={}'.format(classifier_snv), ]
-        
-        tsv2vcf.tsv2vcf(classifiedSnvTsv, classifiedSnvVcf, snvCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
+        # Classify SNV calls
+        if classifier_snv:
+            classifiedSnvTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.tsv' ))
+            classifiedSnvVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sSNV.vcf' ))
 
+            iterations_i = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
+            modelPredictor(model_input(ensembleSnv, ensembleSnvTable, algo), classifiedSnvTsv, algo, classifier_snv, iterations=iterations_i, features_to_exclude=features_excluded, threads=threads)
 
-    else:
-        # Train SNV classifier:
-        if somaticseq_train and truth_snv:
-            
-            iterations = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
-            modelTrainer(ensembleSnv, algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations, features_to_exclude=features_excluded)
+            extra_header = ['##SomaticSeqClassifier={}'.format(classifier_snv), ]
 
-        consensusSnvVcf = os.sep.join(( outdir, consensusOutPrefix + 'sSNV.vcf' ))
-        tsv2vcf.tsv2vcf(ensembleSnv, consensusSnvVcf, snvCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True)
+            tsv2vcf.tsv2vcf(classifiedSnvTsv, classifiedSnvVcf, snvCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
 
 
+        else:
+            # Train SNV classifier:
+            if somaticseq_train and truth_snv:
+
+                iterations_i = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
+                modelTrainer(model_input(ensembleSnv, ensembleSnvTable, algo), algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations_i, features_to_exclude=features_excluded)
+
+            consensusSnvVcf = os.sep.join(( outdir, consensusOutPrefix + 'sSNV.vcf' ))
+            tsv2vcf.tsv2vcf(ensembleSnv, consensusSnvVcf, snvCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True)
+
 
     ###################### INDEL ######################
-    single_sample_vcf2tsv.vcf2tsv(is_vcf=outIndel, bam_fn=bam, truth=truth_indel, cosmic=cosmic, dbsnp=dbsnp, mutect=intermediateVcfs['MuTect2']['indel'], varscan=intermediateVcfs['VarScan2']['indel'], vardict=intermediateVcfs['VarDict']['indel'], lofreq=intermediateVcfs['LoFreq']['indel'], scalpel=scalpel, strelka=intermediateVcfs['Strelka']['indel'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleIndel)
+    def indel_track(threads):
 
+        single_sample_vcf2tsv.vcf2tsv(is_vcf=outIndel, bam_fn=bam, truth=truth_indel, cosmic=cosmic, dbsnp=dbsnp, mutect=intermediateVcfs['MuTect2']['indel'], varscan=intermediateVcfs['VarScan2']['indel'], vardict=intermediateVcfs['VarDict']['indel'], lofreq=intermediateVcfs['LoFreq']['indel'], scalpel=scalpel, strelka=intermediateVcfs['Strelka']['indel'], dedup=True, min_mq=min_mq, min_bq=min_bq, min_caller=min_caller, ref_fa=ref, p_scale=None, outfile=ensembleIndel, features=features_of_classifier(classifier_indel, algo, somaticseq_train, skip_unused_features), feature_cache=feature_cache, output_table=ensembleIndelTable)
 
-    # Classify INDEL calls
-    if classifier_indel:
-        classifiedIndelTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.tsv' ))
-        classifiedIndelVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.vcf' ))
 
-        iterations = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
-        modelPredictor(ensembleIndel, classifiedIndelTsv, algo, classifier_indel, iterations=iterations, features_to_exclude=features_excluded)
-        
-        extra_header = ['##SomaticSeqClassifier={}'.format(classifier_indel), ]
-        
-        tsv2vcf.tsv2vcf(classifiedIndelTsv, classifiedIndelVcf, indelCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
+        # Classify INDEL calls
+        if classifier_indel:
+            classifiedIndelTsv = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.tsv' ))
+            classifiedIndelVcf = os.sep.join(( outdir, classifiedOutPrefix + 'sINDEL.vcf' ))
+
+            iterations_i = iterations if iterations else DEFAULT_NUM_TREES_PREDICT
+            modelPredictor(model_input(ensembleIndel, ensembleIndelTable, algo), classifiedIndelTsv, algo, classifier_indel, iterations=iterations_i, features_to_exclude=features_excluded, threads=threads)
+
+            extra_header = ['##SomaticSeqClassifier={}'.format(classifier_indel), ]
+
+            tsv2vcf.tsv2vcf(classifiedIndelTsv, classifiedIndelVcf, indelCallers, pass_score=pass_threshold, lowqual_score=lowqual_threshold, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True, phred_scaled=True, extra_headers=extra_header)
 
-    else:
-        # Train INDEL classifier:
-        if somaticseq_train and truth_indel:
-            
-            iterations = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
-            modelTrainer(ensembleIndel, algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations, features_to_exclude=features_excluded)
+        else:
+            # Train INDEL classifier:
+            if somaticseq_train and truth_indel:
 
-        consensusIndelVcf = os.sep.join(( outdir, consensusOutPrefix + 'sINDEL.vcf' ))
-        tsv2vcf.tsv2vcf(ensembleIndel, consensusIndelVcf, indelCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True)
+                iterations_i = iterations if iterations else DEFAULT_XGB_BOOST_ROUNDS
+                modelTrainer(model_input(ensembleIndel, ensembleIndelTable, algo), algo, threads=1, seed=train_seed, max_depth=tree_depth, iterations=iterations_i, features_to_exclude=features_excluded)
+
+            consensusIndelVcf = os.sep.join(( outdir, consensusOutPrefix + 'sINDEL.vcf' ))
+            tsv2vcf.tsv2vcf(ensembleIndel, consensusIndelVcf, indelCallers, hom_threshold=hom_threshold, het_threshold=het_threshold, single_mode=True, paired_mode=False, tumor_sample_name=sample_name, print_reject=True)
+
+
+    # The two tracks share nothing but read-only inputs, so they run at the same time with the threads split between them:
+    run_tracks( (('sSNV', snv_track), ('sINDEL', indel_track)), threads )
 
 
     ## Clean up after yourself ##
@@ -334,6 +456,8 @@ def run():
     parser.add_argument('-exclude',  '--exclusion-region', type=str,   help='exclusion bed')
 
     parser.add_argument('-nt', '--threads',  type=int, help='number of threads', default=1)
+    parser.add_argument('--split-by-base-pairs', action='store_true', help='with multiple threads in somaticseq_parallel.py, split the regions by base pairs rather than by the candidate variants and reads in them', default=False)
+    parser.add_argument('--chunks-per-thread',   type=int, help='with somaticseq_parallel.py, split the regions into this many chunks per thread, which are run by whichever thread is free', default=10)
 
     parser.add_argument('-train',  '--somaticseq-train', action='store_true', help='Invoke training mode with ground truths', default=False)
     parser.add_argument('-seed',   '--seed',        type=int, help='seed for xgboost training', default=0)
@@ -341,6 +465,10 @@ def run():
     parser.add_argument('-iters',  '--iterations',  type=int, help='num boosting rounds for xgboost: default is 500 for training and 100 for predicting, i.e., by default, 500 trees are built for classifier, but only the first 100 trees are used.')
     parser.add_argument('--features-excluded',      type=str, nargs='*', help='features to exclude for xgboost training. Must be same for train/predict.', default=[] )
 
+    parser.add_argument('--skip-unused-features',   action='store_true', help='with an xgboost classifier and no training, write nan instead of computing the features that the classifier does not use', default=False)
+    parser.add_argument('--feature-cache',          type=str, help='SQLite file of BAM features extracted in earlier runs on the same BAM files, to be reused and added to')
+    parser.add_argument('--feature-table',          type=str, choices=('parquet', 'npz'), help='also write the Ensemble features as typed, columnar table files, i.e., .parquet (requires pyarrow) or .npz, which xgboost then reads instead of the TSV files')
+
     parser.add_argument('--keep-intermediates', action='store_true', help='Keep intermediate files', default=False)
 
     # Modes:
@@ -452,6 +580,10 @@ if __name__ == '__main__':
                    iterations         = args.iterations, \
                    features_excluded  = args.features_excluded, \
                    keep_intermediates = args.keep_intermediates, \
+                   skip_unused_features = args.skip_unused_features, \
+                   feature_cache      = args.feature_cache, \
+                   threads            = args.threads, \
+                   feature_table_format = args.feature_table, \
                    )
 
     elif args.which == 'single':
@@ -489,4 +621,8 @@ if __name__ == '__main__':
                    iterations         = args.iterations, \
                    features_excluded  = args.features_excluded, \
                    keep_intermediates = args.keep_intermediates, \
+                   skip_unused_features = args.skip_unused_features, \
+                   feature_cache      = args.feature_cache, \
+                   threads            = args.threads, \
+                   feature_table_format = args.feature_table, \
                    )
@@ -1,22 +1,37 @@
 #!/usr/bin/env python3
 
 import sys, os, re, pysam
-import scipy.stats as stats
+from collections import Counter
 import genomicFileHandler.genomic_file_handlers as genome
+import somaticseq.batch_statistics as batch_statistics
 from genomicFileHandler.read_info_extractor import * 
 
 nan = float('nan')
 
+# Seed of the reservoir sampling of the reads at sites deeper than max_depth:
+DOWNSAMPLING_SEED = 0
 
-def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
+
+def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10, defer_statistics=False, max_depth=None, downsampling_seed=DOWNSAMPLING_SEED):
 
     '''
     bam is the opened file handle of bam file
     my_coordiate is a list or tuple of 0-based (contig, position)
+    If defer_statistics, the Mann-Whitney U and Fisher's exact test p-values are left out, to be added later for many sites at once by bam_statistics.
+    If there are more than max_depth reads, the features are computed from max_depth of them, sampled with a seed from downsampling_seed and the site.
+    dp is still the number of all the reads, and downsampled is 1 for such a site.
     '''
     
     indel_length = len(first_alt) - len(ref_base)
-    reads = bam.fetch( my_coordinate[0], my_coordinate[1]-1, my_coordinate[1] )
+
+    # Each read is decoded into a Read_record, by a Bam_window once for all the sites it overlaps:
+    if hasattr(bam, 'fetch_records'):
+        reads = bam.fetch_records( my_coordinate[0], my_coordinate[1]-1, my_coordinate[1] )
+    else:
+        reads = map( Read_record, bam.fetch( my_coordinate[0], my_coordinate[1]-1, my_coordinate[1] ) )
+
+    if max_depth:
+        reads, true_depth = downsample_reads( (read_i for read_i in reads if not read_i.is_unmapped and dedup_test(read_i)), max_depth, '{}:{}:{}'.format(downsampling_seed, my_coordinate[0], my_coordinate[1]) )
     
     ref_read_mq = []
     alt_read_mq = []
@@ -46,7 +61,7 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
             
             code_i, ith_base, base_call_i, indel_length_i, flanking_indel_i = position_of_aligned_read(read_i, my_coordinate[1]-1 )
             
-            if read_i.mapping_quality < min_mq and mean(read_i.query_qualities) < min_bq:
+            if read_i.mapping_quality < min_mq and read_i.mean_bq < min_bq:
                 poor_read_count += 1
             
             if read_i.mapping_quality == 0:
@@ -56,17 +71,15 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
             if code_i == 1 and base_call_i == ref_base[0]:
 
                 try:
-                    qname_collector[read_i.qname].append(0)
+                    qname_collector[read_i.query_name].append(0)
                 except KeyError:
-                    qname_collector[read_i.qname] = [0]
+                    qname_collector[read_i.query_name] = [0]
             
                 ref_read_mq.append( read_i.mapping_quality )
                 ref_read_bq.append( read_i.query_qualities[ith_base] )
                 
-                try:
-                    ref_edit_distance.append( read_i.get_tag('NM') )
-                except KeyError:
-                    pass
+                if read_i.NM is not None:
+                    ref_edit_distance.append( read_i.NM )
                 
                 # Concordance
                 if        read_i.is_proper_pair  and read_i.mapping_quality >= min_mq and read_i.query_qualities[ith_base] >= min_bq:
@@ -81,7 +94,7 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
                     ref_rev += 1
                 
                 # Soft-clipped reads?
-                if read_i.cigar[0][0] == cigar_soft_clip or read_i.cigar[-1][0] == cigar_soft_clip:
+                if read_i.soft_clipped:
                     ref_SC_reads += 1
                 else:
                     ref_notSC_reads += 1
@@ -101,17 +114,15 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
                  (indel_length > 0  and code_i == 3):
 
                 try:
-                    qname_collector[read_i.qname].append(1)
+                    qname_collector[read_i.query_name].append(1)
                 except KeyError:
-                    qname_collector[read_i.qname] = [1]
+                    qname_collector[read_i.query_name] = [1]
 
                 alt_read_mq.append( read_i.mapping_quality )
                 alt_read_bq.append( read_i.query_qualities[ith_base] )
                 
-                try:
-                    alt_edit_distance.append( read_i.get_tag('NM') )
-                except KeyError:
-                    pass
+                if read_i.NM is not None:
+                    alt_edit_distance.append( read_i.NM )
                 
                 # Concordance
                 if        read_i.is_proper_pair  and read_i.mapping_quality >= min_mq and read_i.query_qualities[ith_base] >= min_bq:
@@ -126,7 +137,7 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
                     alt_rev += 1
                 
                 # Soft-clipped reads?
-                if read_i.cigar[0][0] == cigar_soft_clip or read_i.cigar[-1][0] == cigar_soft_clip:
+                if read_i.soft_clipped:
                     alt_SC_reads += 1
                 else:
                     alt_notSC_reads += 1
@@ -143,9 +154,9 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
             else:
                 
                 try:
-                    qname_collector[read_i.qname].append(2)
+                    qname_collector[read_i.query_name].append(2)
                 except KeyError:
-                    qname_collector[read_i.qname] = [2]
+                    qname_collector[read_i.query_name] = [2]
                 
                 noise_read_count += 1
     
@@ -153,44 +164,13 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
     ref_mq            = mean(ref_read_mq)
     alt_mq            = mean(alt_read_mq)
     
-    try:
-        p_mannwhitneyu_mq = stats.mannwhitneyu(alt_read_mq, ref_read_mq, use_continuity=True, alternative='less')[1]
-    
-    except ValueError:
-        if len(alt_read_mq) > 0 and len(ref_read_mq) > 0:
-            p_mannwhitneyu_mq = 0.5
-        else:
-            p_mannwhitneyu_mq = nan
-    
     ref_bq            = mean(ref_read_bq)
     alt_bq            = mean(alt_read_bq)
     
-    try:
-        p_mannwhitneyu_bq = stats.mannwhitneyu(alt_read_bq, ref_read_bq, use_continuity=True, alternative='less')[1]
-    
-    except ValueError:
-        if len(alt_read_bq) > 0 and len(ref_read_bq) > 0:
-            p_mannwhitneyu_bq = 0.5
-        else:
-            p_mannwhitneyu_bq = nan
-    
     ref_NM            = mean(ref_edit_distance)
     alt_NM            = mean(alt_edit_distance)
     NM_Diff           = alt_NM - ref_NM - abs(indel_length)
     
-    concordance_fet = stats.fisher_exact(( (ref_concordant_reads, alt_concordant_reads), (ref_discordant_reads, alt_discordant_reads) ))[1]
-    strandbias_fet  = stats.fisher_exact(( (ref_for, alt_for), (ref_rev, alt_rev) ))[1]
-    clipping_fet    = stats.fisher_exact(( (ref_notSC_reads, alt_notSC_reads), (ref_SC_reads, alt_SC_reads) ))[1]
-    
-    try:
-        p_mannwhitneyu_endpos = stats.mannwhitneyu(alt_pos_from_end, ref_pos_from_end, use_continuity=True, alternative='less')[1]
-    
-    except ValueError:
-        if len(alt_pos_from_end) > 0 and len(ref_pos_from_end) > 0:
-            p_mannwhitneyu_endpos = 0.5
-        else:
-            p_mannwhitneyu_endpos = nan
-    
     ref_indel_1bp = ref_flanking_indel.count(1)
     ref_indel_2bp = ref_flanking_indel.count(2) + ref_indel_1bp
     ref_indel_3bp = ref_flanking_indel.count(3) + ref_indel_2bp
@@ -209,7 +189,59 @@ def from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, min_bq=10):
         elif len(qname_collector[pairs_i]) == 2 and 1 in qname_collector[pairs_i]:
             inconsistent_mates += 1
 
-    return vars()
+    # The depth of all the reads, with the other features from the sampled ones:
+    if max_depth:
+        downsampled = int(true_depth > max_depth)
+        dp          = true_depth
+    else:
+        downsampled = 0
+
+    # Read objects are no longer needed, and should not be kept alive with sites waiting for their p-values:
+    reads = read_i = qname_collector = None
+
+    bam_features = vars()
+
+    if not defer_statistics:
+        bam_statistics( [bam_features] )
+
+    return bam_features
+
+
+
+def bam_statistics(list_of_bam_features, skipped=set()):
+
+    '''
+    Add the Mann-Whitney U test p-values (MQ, BQ, and distance from the end of the read) and the Fisher's exact test p-values (concordance, strand bias, and soft-clipping),
+    in place, to a list of outputs of from_bam(..., defer_statistics=True).
+    Each test is done for all the sites at once. The tests whose p-value keys are in skipped are not done, and their p-values are nan.
+    '''
+
+    for p_value_key, alt_samples, ref_samples in ( ('p_mannwhitneyu_mq',     'alt_read_mq',      'ref_read_mq'), \
+                                                   ('p_mannwhitneyu_bq',     'alt_read_bq',      'ref_read_bq'), \
+                                                   ('p_mannwhitneyu_endpos', 'alt_pos_from_end', 'ref_pos_from_end') ):
+
+        if p_value_key in skipped:
+            p_values = [nan] * len(list_of_bam_features)
+        else:
+            p_values = batch_statistics.mannwhitneyu_less( [bam_features[alt_samples] for bam_features in list_of_bam_features], [bam_features[ref_samples] for bam_features in list_of_bam_features] )
+
+        for bam_features, p_value in zip(list_of_bam_features, p_values):
+            bam_features[p_value_key] = p_value
+
+    for p_value_key, table_keys in ( ('concordance_fet', ('ref_concordant_reads', 'alt_concordant_reads', 'ref_discordant_reads', 'alt_discordant_reads')), \
+                                     ('strandbias_fet',  ('ref_for',              'alt_for',              'ref_rev',              'alt_rev')), \
+                                     ('clipping_fet',    ('ref_notSC_reads',      'alt_notSC_reads',      'ref_SC_reads',         'alt_SC_reads')) ):
+
+        if p_value_key in skipped:
+            p_values = [nan] * len(list_of_bam_features)
+        else:
+            tables   = [ ((bam_features[table_keys[0]], bam_features[table_keys[1]]), (bam_features[table_keys[2]], bam_features[table_keys[3]])) for bam_features in list_of_bam_features ]
+            p_values = batch_statistics.fisher_exact(tables)
+
+        for bam_features, p_value in zip(list_of_bam_features, p_values):
+            bam_features[p_value_key] = p_value
+
+    return list_of_bam_features
 
 
 
@@ -396,3 +428,73 @@ def subLC(sequence, max_substring_length=20):
         lc = float('nan')
 
     return lc
+
+
+
+
+class Sliding_subLC:
+    '''
+    subLC(sequence, max_substring_length) for a window that moves forward along a contig, e.g., the same kind of window around consecutive sites.
+    The counts of all the substrings (up to max_substring_length) in the current window are kept,
+    so when the next window overlaps the current one, only the substrings leaving at the left and entering at the right are updated.
+    Windows that do not overlap enough (or go backward) are counted from scratch. Either way, the result is the same as subLC.
+    '''
+
+    def __init__(self, max_substring_length=20):
+
+        self.max_substring_length = max_substring_length
+        self.contig               = None
+        self.start                = 0
+        self.sequence             = ''
+        self.substring_counts     = Counter()
+        self.max_number_of_subseqs = {}
+
+
+    def lc(self, contig, start, sequence):
+        '''subLC of sequence, i.e., the reference from start to start+len(sequence) on contig.'''
+
+        max_length = self.max_substring_length
+
+        if len(sequence) < max_length:
+            return subLC(sequence, max_length)
+
+        sequence     = sequence.upper()
+        end          = start + len(sequence)
+        previous_end = self.start + len(self.sequence)
+
+        # Moving the window by one base costs about as much as counting 4 bases of a window from scratch:
+        if contig == self.contig and self.start <= start < previous_end <= end and 4 * (start - self.start + end - previous_end) < len(sequence):
+            self._slide(start, sequence)
+        else:
+            self.substring_counts = Counter( sequence[n: n+i] for i in range(1, max_length+1) for n in range(len(sequence) - i + 1) )
+
+        self.contig   = contig
+        self.start    = start
+        self.sequence = sequence
+
+        if 'N' in sequence:
+            return float('nan')
+
+        if len(sequence) not in self.max_number_of_subseqs:
+            self.max_number_of_subseqs[ len(sequence) ] = max_sub_vocabularies(len(sequence), max_length)
+
+        return len(self.substring_counts) / self.max_number_of_subseqs[ len(sequence) ]
+
+
+    def _slide(self, start, sequence):
+
+        max_length = self.max_substring_length
+        counts     = self.substring_counts
+        previous   = self.sequence
+
+        # Substrings that begin before the new start:
+        for n in range(start - self.start):
+            for substring_i in ( previous[n: n+i] for i in range(1, min(max_length, len(previous)-n) + 1) ):
+                if counts[substring_i] > 1:
+                    counts[substring_i] -= 1
+                else:
+                    del counts[substring_i]
+
+        # Substrings that end after the previous end:
+        for n in range(self.start + len(previous) - start, len(sequence)):
+            counts.update( sequence[n-i+1: n+1] for i in range(1, min(max_length, n+1) + 1) )
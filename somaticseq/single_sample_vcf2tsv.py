@@ -3,13 +3,17 @@
 # single-sample only
 
 import sys, argparse, math, gzip, os, pysam, re, logging
-import scipy.stats as stats
 from copy import copy
 
 from genomicFileHandler.read_info_extractor import *
 import genomicFileHandler.genomic_file_handlers as genome
 import somaticseq.annotate_caller as annotate_caller
 import somaticseq.sequencing_features as sequencing_features
+import somaticseq.batch_statistics as batch_statistics
+import somaticseq.tsv_writer as tsv_writer
+import somaticseq.feature_table as feature_table
+import somaticseq.feature_registry as feature_registry
+import somaticseq.bam_feature_cache as bam_feature_cache
 
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
@@ -19,6 +23,9 @@ logger = logging.getLogger( os.path.basename(__file__) )
 logger.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
+# Number of sites whose BAM p-values are computed together:
+STATISTICS_BATCH_SIZE = 10000
+
 # Header for the output data, created here so I won't have to indent this line:
 out_header = \
 '{CHROM}\t\
@@ -120,6 +127,11 @@ def run():
     parser.add_argument('-scale',      '--p-scale',               type=str,   help='phred, fraction, or none', required=False, default=None)
 
     parser.add_argument('-outfile',    '--output-tsv-file',       type=str,   help='Output TSV Name', required=False, default=os.sys.stdout)
+    parser.add_argument('-table',      '--output-table',          type=str,   help='Also write the output as a typed, columnar table file: .parquet (requires pyarrow) or .npz')
+    parser.add_argument('--features-from-model',                 type=str,   help='Only compute the features this classifier uses, and write nan for the other ones that can be skipped (see feature_registry.py)')
+    parser.add_argument('--feature-cache',                       type=str,   help='SQLite file of BAM features extracted in earlier runs on the same BAM files, to be reused and added to')
+    parser.add_argument('--feature-cache-megabytes',             type=int,   help='Evict the least recently used sites beyond this size of BAM features in the cache', default=bam_feature_cache.DEFAULT_CACHE_MEGABYTES)
+    parser.add_argument('--max-depth',                           type=int,   help='At sites with more reads than this, compute the features from this many reads sampled at random (with a fixed seed), and flag the sites as downsampled')
 
     args = parser.parse_args()
 
@@ -129,7 +141,24 @@ def run():
 
 
 
-def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosmic=None, dbsnp=None, mutect=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, dedup=True, min_mq=1, min_bq=5, min_caller=0, ref_fa=None, p_scale=None, outfile=None):
+def write_pending_sites(outhandle, pending_sites, p_scale, skipped=set(), header=out_header, table=None):
+    '''
+    pending_sites is a list of (site_items, tBamFeatures), where site_items are the output columns that do not come from the BAM file.
+    The p-values from the BAM file are computed for all the sites at once, and then the sites are written out in order, a column at a time (see tsv_writer.Block_writer).
+    '''
+
+    sequencing_features.bam_statistics( [ bam_features for site_i in pending_sites for bam_features in site_i[1:] ], skipped )
+
+    block_writer   = tsv_writer.Block_writer(header, ('T',), p_scale)
+    column_buffers = block_writer.write(outhandle, pending_sites)
+
+    # The same block, as it is in the TSV file, is also a chunk of the table file (see feature_table.Table_writer):
+    if table:
+        table.write( feature_table.text_columns_as_frame(block_writer.columns, column_buffers) )
+
+
+
+def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosmic=None, dbsnp=None, mutect=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, dedup=True, min_mq=1, min_bq=5, min_caller=0, ref_fa=None, p_scale=None, outfile=None, features=None, feature_cache=None, feature_cache_megabytes=bam_feature_cache.DEFAULT_CACHE_MEGABYTES, max_depth=None, output_table=None):
 
     # Convert contig_sequence to chrom_seq dict:
     fai_file  = ref_fa + '.fai'
@@ -163,50 +192,66 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
     inf = float('inf')
     pattern_chr_position = genome.pattern_chr_position
 
+    # With a subset of the features, the computations none of whose columns are in it are skipped, and those columns are nan.
+    skipped = feature_registry.skipped_computations(features)
+    if skipped:
+        logger.info( 'Skipped computations: {}'.format(', '.join(sorted(skipped))) )
+
+    # With a depth cap, the flags of the downsampled sites are written just before the label column:
+    tsv_header = out_header.replace('{TrueVariant_or_False}', '{tBAM_Downsampled}\t{TrueVariant_or_False}') if max_depth else out_header
+
 
     ## Running
     with genome.open_textfile(mysites) as my_sites, open(outfile, 'w') as outhandle:
 
         my_line = my_sites.readline().rstrip()
 
-        bam    = pysam.AlignmentFile(bam_fn, reference_filename=ref_fa)
-        ref_fa = pysam.FastaFile(ref_fa)
+        # Sites are visited in sorted order, so reads are streamed through a sliding window rather than fetched anew at every site,
+        # and the reference windows around each site are sliced out of large chunks of the reference
+        bam    = genome.Bam_window( pysam.AlignmentFile(bam_fn, reference_filename=ref_fa) )
+        ref_fa = genome.Fasta_window( pysam.FastaFile(ref_fa) )
+
+        # BAM features of the sites seen in earlier runs on the same BAM file:
+        feature_cache = bam_feature_cache.Bam_feature_cache(feature_cache, feature_cache_megabytes) if feature_cache else None
+
+        # The output, also as a typed, columnar table file, written a block of sites at a time:
+        table = feature_table.Table_writer(output_table) if output_table else None
 
         if truth:
-            truth = genome.open_textfile(truth)
+            truth = genome.open_vcf_file(truth)
             truth_line = genome.skip_vcf_header( truth )
 
         if cosmic:
-            cosmic = genome.open_textfile(cosmic)
+            cosmic = genome.open_vcf_file(cosmic)
             cosmic_line = genome.skip_vcf_header( cosmic )
 
         if dbsnp:
-            dbsnp = genome.open_textfile(dbsnp)
+            dbsnp = genome.open_vcf_file(dbsnp)
             dbsnp_line = genome.skip_vcf_header( dbsnp )
 
         # 6 Incorporate callers: get thru the #'s
         if mutect:
-            mutect = genome.open_textfile(mutect)
+            mutect = genome.open_vcf_file(mutect)
             mutect_line = genome.skip_vcf_header( mutect )
 
         if varscan:
-            varscan = genome.open_textfile(varscan)
+            varscan = genome.open_vcf_file(varscan)
             varscan_line = genome.skip_vcf_header( varscan )
 
         if vardict:
-            vardict = genome.open_textfile(vardict)
+            vardict = genome.open_vcf_file(vardict)
             vardict_line = genome.skip_vcf_header( vardict )
 
         if lofreq:
-            lofreq = genome.open_textfile(lofreq)
+            lofreq = genome.open_vcf_file(lofreq)
             lofreq_line = genome.skip_vcf_header( lofreq )
 
         if scalpel:
-            scalpel = genome.open_textfile(scalpel)
+            scalpel = genome.open_vcf_file(scalpel)
             scalpel_line = genome.skip_vcf_header( scalpel )
 
         if strelka:
-            strelka = genome.open_textfile(strelka)
+            strelka = genome.open_vcf_file(strelka)
             strelka_line = genome.skip_vcf_header( strelka )
 
 
@@ -215,11 +260,17 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
             my_line = my_sites.readline().rstrip()
 
         # First coordinate, for later purpose of making sure the input is sorted properly
-        coordinate_i = re.match( genome.pattern_chr_position, my_line )
-        coordinate_i = coordinate_i.group() if coordinate_i else ''
+        key_i = genome.line_coordinate_key(my_line, chrom_seq)
 
         # First line:
-        outhandle.write( out_header.replace('{','').replace('}','')  + '\n' )
+        outhandle.write( tsv_header.replace('{','').replace('}','')  + '\n' )
+
+        pending_sites = []
+
+        # Linguistic complexity of the windows around consecutive sites, reusing the substring counts where the windows overlap
+        lc_span_80bp  = sequencing_features.Sliding_subLC(20)
+        lc_left_80bp  = sequencing_features.Sliding_subLC(20)
+        lc_right_80bp = sequencing_features.Sliding_subLC(20)
 
         while my_line:
 
@@ -245,13 +296,12 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
                     my_vcf = genome.Vcf_line( my_line )
 
                     ########## This block is code is to ensure the input VCF file is properly sorted ##
-                    coordinate_j = re.match( genome.pattern_chr_position, my_line )
-                    coordinate_j = coordinate_j.group() if coordinate_j else ''
+                    key_j = genome.line_coordinate_key(my_line, chrom_seq)
 
-                    if genome.whoisbehind(coordinate_i, coordinate_j, chrom_seq) == 1:
+                    if key_i > key_j:
                         raise Exception( '{} does not seem to be properly sorted.'.format(mysites) )
 
-                    coordinate_i = coordinate_j
+                    key_i = key_j
                     ###################################################################################
                     
                     if my_coordinates[0] == (my_vcf.chromosome, my_vcf.position):
@@ -423,42 +473,51 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
 
                         ########## ######### INFO EXTRACTION FROM BAM FILES ########## #########
                         # Tumor tBAM file:
-                        tBamFeatures = sequencing_features.from_bam(bam, my_coordinate, ref_base, first_alt, min_mq, min_bq)
+                        if feature_cache:
+                            tBamFeatures = feature_cache.from_bam(bam, bam_fn, my_coordinate, ref_base, first_alt, min_mq, min_bq, max_depth)
+                        else:
+                            tBamFeatures = sequencing_features.from_bam(bam, my_coordinate, ref_base, first_alt, min_mq, min_bq, defer_statistics=True, max_depth=max_depth)
 
                         # Homopolymer eval:
-                        homopolymer_length, site_homopolymer_length = sequencing_features.from_genome_reference(ref_fa, my_coordinate, ref_base, first_alt)
+                        if 'homopolymer' in skipped:
+                            homopolymer_length = site_homopolymer_length = nan
+                        else:
+                            homopolymer_length, site_homopolymer_length = sequencing_features.from_genome_reference(ref_fa, my_coordinate, ref_base, first_alt)
 
                         # Linguistic sequence complexity in a +/-80bp window, but substring calculation stops at 20-bp substring.
-                        seq_span_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-41), my_coordinate[1]+40)
-                        seq_left_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-81), my_coordinate[1])
-                        seq_right_80bp = ref_fa.fetch(my_coordinate[0], my_coordinate[1], my_coordinate[1]+81)
-
-                        if len(seq_span_80bp) > 20:
-                            LC_spanning = sequencing_features.subLC(seq_span_80bp, 20)
-                        else:
-                            LC_spanning = math.nan
-                        
-                        if len(seq_left_80bp) > 20:
-                            left_LC = sequencing_features.subLC(seq_left_80bp, 20)
+                        if 'sequence_complexity' in skipped:
+                            LC_spanning_phred = LC_adjacent_phred = nan
                         else:
-                            left_LC = math.nan
-                        
-                        if len(seq_right_80bp) > 20:
-                            right_LC = sequencing_features.subLC(seq_right_80bp, 20)
-                        else:
-                            right_LC = math.nan
-                        
-                        LC_adjacent  = min(left_LC, right_LC)
+                            seq_span_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-41), my_coordinate[1]+40)
+                            seq_left_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-81), my_coordinate[1])
+                            seq_right_80bp = ref_fa.fetch(my_coordinate[0], my_coordinate[1], my_coordinate[1]+81)
+
+                            if len(seq_span_80bp) > 20:
+                                LC_spanning = lc_span_80bp.lc(my_coordinate[0], max(0, my_coordinate[1]-41), seq_span_80bp)
+                            else:
+                                LC_spanning = math.nan
+
+                            if len(seq_left_80bp) > 20:
+                                left_LC = lc_left_80bp.lc(my_coordinate[0], max(0, my_coordinate[1]-81), seq_left_80bp)
+                            else:
+                                left_LC = math.nan
 
-                        LC_spanning_phred = genome.p2phred(1-LC_spanning, 40)
-                        LC_adjacent_phred = genome.p2phred(1-LC_adjacent, 40)
+                            if len(seq_right_80bp) > 20:
+                                right_LC = lc_right_80bp.lc(my_coordinate[0], my_coordinate[1], seq_right_80bp)
+                            else:
+                                right_LC = math.nan
+
+                            LC_adjacent  = min(left_LC, right_LC)
+
+                            LC_spanning_phred = genome.p2phred(1-LC_spanning, 40)
+                            LC_adjacent_phred = genome.p2phred(1-LC_adjacent, 40)
 
 
                         # Fill the ID field of the TSV/VCF
                         my_identifiers = ';'.join(my_identifiers) if my_identifiers else '.'
 
                         ###
-                        out_line = out_header.format( \
+                        site_items = dict( \
                         CHROM                      = my_coordinate[0],                                                    \
                         POS                        = my_coordinate[1],                                                    \
                         ID                         = my_identifiers,                                                      \
@@ -475,8 +534,6 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
                         COMMON                     = if_common,                                                           \
                         if_COSMIC                  = if_cosmic,                                                           \
                         COSMIC_CNT                 = num_cases,                                                           \
-                        Consistent_Mates           = tBamFeatures['consistent_mates'],                                    \
-                        Inconsistent_Mates         = tBamFeatures['inconsistent_mates'],                                  \
                         Seq_Complexity_Span        = LC_spanning_phred,                                                   \
                         Seq_Complexity_Adj         = LC_adjacent_phred,                                                   \
                         M2_TLOD                    = tlod,                                                                \
@@ -486,49 +543,30 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
                         SHIFT3                     = shift3,                                                              \
                         MaxHomopolymer_Length      = homopolymer_length,                                                  \
                         SiteHomopolymer_Length     = site_homopolymer_length,                                             \
-                        T_DP                       = tBamFeatures['dp'],                                                  \
-                        tBAM_REF_MQ                = '%g' % tBamFeatures['ref_mq'],                                       \
-                        tBAM_ALT_MQ                = '%g' % tBamFeatures['alt_mq'],                                       \
-                        tBAM_p_MannWhitneyU_MQ     = '%g' % tBamFeatures['p_mannwhitneyu_mq'],                            \
-                        tBAM_REF_BQ                = '%g' % tBamFeatures['ref_bq'],                                       \
-                        tBAM_ALT_BQ                = '%g' % tBamFeatures['alt_bq'],                                       \
-                        tBAM_p_MannWhitneyU_BQ     = '%g' % tBamFeatures['p_mannwhitneyu_bq'],                            \
-                        tBAM_REF_NM                = '%g' % tBamFeatures['ref_NM'],                                       \
-                        tBAM_ALT_NM                = '%g' % tBamFeatures['alt_NM'],                                       \
-                        tBAM_NM_Diff               = '%g' % tBamFeatures['NM_Diff'],                                      \
-                        tBAM_REF_Concordant        = tBamFeatures['ref_concordant_reads'],                                \
-                        tBAM_REF_Discordant        = tBamFeatures['ref_discordant_reads'],                                \
-                        tBAM_ALT_Concordant        = tBamFeatures['alt_concordant_reads'],                                \
-                        tBAM_ALT_Discordant        = tBamFeatures['alt_discordant_reads'],                                \
-                        tBAM_Concordance_FET       = rescale(tBamFeatures['concordance_fet'], 'fraction', p_scale, 1001), \
-                        T_REF_FOR                  = tBamFeatures['ref_for'],                                             \
-                        T_REF_REV                  = tBamFeatures['ref_rev'],                                             \
-                        T_ALT_FOR                  = tBamFeatures['alt_for'],                                             \
-                        T_ALT_REV                  = tBamFeatures['alt_rev'],                                             \
-                        tBAM_StrandBias_FET        = rescale(tBamFeatures['strandbias_fet'], 'fraction', p_scale, 1001),  \
-                        tBAM_p_MannWhitneyU_EndPos = '%g' % tBamFeatures['p_mannwhitneyu_endpos'],                        \
-                        tBAM_REF_Clipped_Reads     = tBamFeatures['ref_SC_reads'],                                        \
-                        tBAM_ALT_Clipped_Reads     = tBamFeatures['alt_SC_reads'],                                        \
-                        tBAM_Clipping_FET          = rescale(tBamFeatures['clipping_fet'], 'fraction', p_scale, 1001),    \
-                        tBAM_MQ0                   = tBamFeatures['MQ0'],                                                 \
-                        tBAM_Other_Reads           = tBamFeatures['noise_read_count'],                                    \
-                        tBAM_Poor_Reads            = tBamFeatures['poor_read_count'],                                     \
-                        tBAM_REF_InDel_3bp         = tBamFeatures['ref_indel_3bp'],                                       \
-                        tBAM_REF_InDel_2bp         = tBamFeatures['ref_indel_2bp'],                                       \
-                        tBAM_REF_InDel_1bp         = tBamFeatures['ref_indel_1bp'],                                       \
-                        tBAM_ALT_InDel_3bp         = tBamFeatures['alt_indel_3bp'],                                       \
-                        tBAM_ALT_InDel_2bp         = tBamFeatures['alt_indel_2bp'],                                       \
-                        tBAM_ALT_InDel_1bp         = tBamFeatures['alt_indel_1bp'],                                       \
                         InDel_Length               = indel_length,                                                        \
                         TrueVariant_or_False       = judgement )
 
-                        # Print it out to stdout:
-                        outhandle.write(out_line + '\n')
+                        # The p-values from the BAM file are computed for many sites at once, so the sites are written out in batches:
+                        pending_sites.append( (site_items, tBamFeatures) )
+
+                        if len(pending_sites) >= STATISTICS_BATCH_SIZE:
+                            write_pending_sites(outhandle, pending_sites, p_scale, skipped, tsv_header, table)
+                            pending_sites = []
 
             # Read into the next line:
             if not is_vcf:
                 my_line = my_sites.readline().rstrip()
 
+        write_pending_sites(outhandle, pending_sites, p_scale, skipped, tsv_header, table)
+        logger.info( batch_statistics.fisher_exact_cache_summary() )
+
+        if feature_cache:
+            feature_cache.close()
+            logger.info( feature_cache.summary() )
+
+        if table:
+            table.close()
+
         ##########  Close all open files if they were opened  ##########
         opened_files = (ref_fa, bam, truth, cosmic, dbsnp, mutect, varscan, vardict, lofreq, scalpel, strelka)
         [opened_file.close() for opened_file in opened_files if opened_file]
@@ -537,6 +575,8 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, bam_fn=None, truth=None, cosm
 if __name__ == '__main__':
     runParameters = run()
 
+    features = feature_registry.model_features( runParameters['features_from_model'] ) if runParameters['features_from_model'] else None
+
     vcf2tsv(is_vcf     = runParameters['vcf_format'], \
             is_bed     = runParameters['bed_format'], \
             is_pos     = runParameters['positions_list'], \
@@ -556,4 +596,9 @@ if __name__ == '__main__':
             min_caller = runParameters['minimum_num_callers'], \
             ref_fa     = runParameters['genome_reference'], \
             p_scale    = runParameters['p_scale'], \
-            outfile    = runParameters['output_tsv_file'])
+            outfile    = runParameters['output_tsv_file'], \
+            features   = features, \
+            feature_cache = runParameters['feature_cache'], \
+            feature_cache_megabytes = runParameters['feature_cache_megabytes'], \
+            max_depth  = runParameters['max_depth'], \
+            output_table = runParameters['output_table'])
@@ -1,13 +1,19 @@
 #!/usr/bin/env python3
 
-import sys, argparse, math, gzip, os, pysam, re, logging
-import scipy.stats as stats
+import sys, argparse, math, gzip, os, pysam, re, logging, tempfile, shutil
 from copy import copy
+from multiprocessing import Pool
 
 from genomicFileHandler.read_info_extractor import *
 import genomicFileHandler.genomic_file_handlers as genome
+import genomicFileHandler.concat as concat
 import somaticseq.annotate_caller as annotate_caller
 import somaticseq.sequencing_features as sequencing_features
+import somaticseq.batch_statistics as batch_statistics
+import somaticseq.tsv_writer as tsv_writer
+import somaticseq.feature_table as feature_table
+import somaticseq.feature_registry as feature_registry
+import somaticseq.bam_feature_cache as bam_feature_cache
 
 ch = logging.StreamHandler()
 ch.setLevel(logging.DEBUG)
@@ -17,6 +23,9 @@ logger = logging.getLogger( os.path.basename(__file__) )
 logger.setLevel(logging.DEBUG)
 logger.addHandler(ch)
 
+# Number of sites whose BAM p-values are computed together:
+STATISTICS_BATCH_SIZE = 10000
+
 # Header for the output data, created here so I won't have to indent this line:
 out_header = \
 '{CHROM}\t\
@@ -172,6 +181,12 @@ def run():
     parser.add_argument('-scale',      '--p-scale',               type=str,   help='phred, fraction, or none')
 
     parser.add_argument('-outfile',    '--output-tsv-file',       type=str,   help='Output TSV Name', default=os.sys.stdout)
+    parser.add_argument('-table',      '--output-table',          type=str,   help='Also write the output as a typed, columnar table file: .parquet (requires pyarrow) or .npz')
+    parser.add_argument('--features-from-model',                 type=str,   help='Only compute the features this classifier uses, and write nan for the other ones that can be skipped (see feature_registry.py)')
+    parser.add_argument('--feature-cache',                       type=str,   help='SQLite file of BAM features extracted in earlier runs on the same BAM files, to be reused and added to')
+    parser.add_argument('--feature-cache-megabytes',             type=int,   help='Evict the least recently used sites beyond this size of BAM features in the cache', default=bam_feature_cache.DEFAULT_CACHE_MEGABYTES)
+    parser.add_argument('--max-depth',                           type=int,   help='At sites with more reads than this, compute the features from this many reads sampled at random (with a fixed seed), and flag the sites as downsampled')
+    parser.add_argument('-nt',         '--threads',               type=int,   help='Number of worker processes, each converting a contiguous block of the input VCF file', default=1)
 
     args = parser.parse_args()
 
@@ -181,12 +196,114 @@ def run():
 
 
 
-def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, truth=None, cosmic=None, dbsnp=None, mutect=None, varscan=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq=None, scalpel=None, strelka=None, tnscope=None, platypus=None, dedup=True, min_mq=1, min_bq=5, min_caller=0, ref_fa=None, p_scale=None, outfile=None):
+def write_pending_sites(outhandle, pending_sites, p_scale, skipped=set(), header=out_header, table=None):
+    '''
+    pending_sites is a list of (site_items, nBamFeatures, tBamFeatures), where site_items are the output columns that do not come from the BAM files.
+    The p-values from the BAM files are computed for all the sites at once, and then the sites are written out in order, a column at a time (see tsv_writer.Block_writer).
+    '''
+
+    sequencing_features.bam_statistics( [ bam_features for site_i in pending_sites for bam_features in site_i[1:] ], skipped )
+
+    block_writer   = tsv_writer.Block_writer(header, ('N', 'T'), p_scale)
+    column_buffers = block_writer.write(outhandle, pending_sites)
+
+    # The same block, as it is in the TSV file, is also a chunk of the table file (see feature_table.Table_writer):
+    if table:
+        table.write( feature_table.text_columns_as_frame(block_writer.columns, column_buffers) )
+
+
+
+def split_vcf_into_blocks(vcf_file, num_blocks, outdir, chrom_seq):
+    '''
+    Split the data lines of a sorted VCF file into (up to) num_blocks contiguous blocks of about the same number of lines, written into outdir.
+    Lines of the same coordinate are kept in the same block. Returns the list of block files in order.
+    '''
+
+    with genome.open_textfile(vcf_file) as vcf:
+        num_lines = sum( 1 for line_i in vcf if not (line_i.startswith('#') or line_i.startswith('track=')) )
+
+    lines_per_block = math.ceil( num_lines / num_blocks )
+    block_files     = []
+    block_out       = None
+    lines_in_block  = 0
+    previous_key    = None
+
+    with genome.open_textfile(vcf_file) as vcf:
+        for line_i in vcf:
+
+            if line_i.startswith('#') or line_i.startswith('track='):
+                continue
+
+            key_i = genome.line_coordinate_key(line_i, chrom_seq)
+
+            if previous_key and key_i < previous_key:
+                raise Exception( '{} does not seem to be properly sorted.'.format(vcf_file) )
+
+            if block_out is None or (lines_in_block >= lines_per_block and key_i != previous_key):
+
+                if block_out:
+                    block_out.close()
+
+                block_files.append( os.path.join(outdir, 'block_{}.vcf'.format(len(block_files))) )
+                block_out      = open(block_files[-1], 'w')
+                lines_in_block = 0
+
+            block_out.write( line_i )
+            lines_in_block += 1
+            previous_key    = key_i
+
+    if block_out:
+        block_out.close()
+
+    return block_files
+
+
+
+def vcf2tsv_block(block_arguments):
+    '''vcf2tsv for one block of the input VCF file, in a worker process with its own file handles. Returns the output TSV file.'''
+
+    vcf2tsv(**block_arguments)
+    return block_arguments['outfile']
+
+
+
+def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, truth=None, cosmic=None, dbsnp=None, mutect=None, varscan=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq=None, scalpel=None, strelka=None, tnscope=None, platypus=None, dedup=True, min_mq=1, min_bq=5, min_caller=0, ref_fa=None, p_scale=None, outfile=None, threads=1, features=None, feature_cache=None, feature_cache_megabytes=bam_feature_cache.DEFAULT_CACHE_MEGABYTES, max_depth=None, output_table=None):
+
+    vcf2tsv_arguments = dict( locals() )
 
     # Convert contig_sequence to chrom_seq dict:
     fai_file  = ref_fa + '.fai'
     chrom_seq = genome.faiordict2contigorder(fai_file, 'fai')
 
+    # With threads > 1, the input VCF file is split into contiguous blocks, and the TSV files of the blocks are concatenated in the original order:
+    if threads > 1 and is_vcf:
+
+        block_dir   = tempfile.mkdtemp( prefix='vcf2tsv.', dir=os.path.dirname(os.path.abspath(outfile)) )
+        block_files = split_vcf_into_blocks(is_vcf, threads, block_dir, chrom_seq)
+
+        if len(block_files) > 1:
+            logger.info( 'Converting {} in {} blocks with {} processes'.format(is_vcf, len(block_files), threads) )
+
+            # Each block's table file, if any, has the extension of output_table:
+            block_arguments = [ dict(vcf2tsv_arguments, is_vcf=block_i, outfile=block_i + '.tsv', threads=1, output_table=block_i + os.path.splitext(output_table)[1] if output_table else None) for block_i in block_files ]
+
+            with Pool(processes=threads) as pool:
+                block_tsvs = pool.map(vcf2tsv_block, block_arguments)
+
+            concat.tsv(block_tsvs, outfile)
+
+            if output_table:
+                feature_table.concat_tables( [arguments_i['output_table'] for arguments_i in block_arguments], output_table )
+
+            shutil.rmtree(block_dir)
+
+            return
+
+        shutil.rmtree(block_dir)
+
+    elif threads > 1:
+        logger.info('Multiple threads are only used for a VCF input. Converting with a single process.')
+
     # Determine input format:
     if is_vcf:
         mysites = is_vcf
@@ -214,70 +331,86 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
     inf = float('inf')
     pattern_chr_position = genome.pattern_chr_position
 
+    # With a subset of the features, the computations none of whose columns are in it are skipped, and those columns are nan.
+    skipped = feature_registry.skipped_computations(features)
+    if skipped:
+        logger.info( 'Skipped computations: {}'.format(', '.join(sorted(skipped))) )
+
+    # With a depth cap, the flags of the downsampled sites are written just before the label column:
+    tsv_header = out_header.replace('{TrueVariant_or_False}', '{nBAM_Downsampled}\t{tBAM_Downsampled}\t{TrueVariant_or_False}') if max_depth else out_header
+
     ## Running
     with genome.open_textfile(mysites) as my_sites, open(outfile, 'w') as outhandle:
 
         my_line = my_sites.readline().rstrip()
 
-        nbam    = pysam.AlignmentFile(nbam_fn, reference_filename=ref_fa)
-        tbam    = pysam.AlignmentFile(tbam_fn, reference_filename=ref_fa)
-        ref_fa  = pysam.FastaFile(ref_fa)
+        # Sites are visited in sorted order, so reads are streamed through a sliding window rather than fetched anew at every site,
+        # and the reference windows around each site are sliced out of large chunks of the reference
+        nbam    = genome.Bam_window( pysam.AlignmentFile(nbam_fn, reference_filename=ref_fa) )
+        tbam    = genome.Bam_window( pysam.AlignmentFile(tbam_fn, reference_filename=ref_fa) )
+        ref_fa  = genome.Fasta_window( pysam.FastaFile(ref_fa) )
+
+        # BAM features of the sites seen in earlier runs on the same BAM files:
+        feature_cache = bam_feature_cache.Bam_feature_cache(feature_cache, feature_cache_megabytes) if feature_cache else None
+
+        # The output, also as a typed, columnar table file, written a block of sites at a time:
+        table = feature_table.Table_writer(output_table) if output_table else None
 
         if truth:
-            truth = genome.open_textfile(truth)
+            truth = genome.open_vcf_file(truth)
             truth_line = genome.skip_vcf_header( truth )
 
         if cosmic:
-            cosmic = genome.open_textfile(cosmic)
+            cosmic = genome.open_vcf_file(cosmic)
             cosmic_line = genome.skip_vcf_header( cosmic )
 
         if dbsnp:
-            dbsnp = genome.open_textfile(dbsnp)
+            dbsnp = genome.open_vcf_file(dbsnp)
             dbsnp_line = genome.skip_vcf_header( dbsnp )
 
         # 10 Incorporate callers: get thru the #'s
         if mutect:
-            mutect = genome.open_textfile(mutect)
+            mutect = genome.open_vcf_file(mutect)
             mutect_line = genome.skip_vcf_header( mutect )
 
         if varscan:
-            varscan = genome.open_textfile(varscan)
+            varscan = genome.open_vcf_file(varscan)
             varscan_line = genome.skip_vcf_header( varscan )
 
         if jsm:
-            jsm = genome.open_textfile(jsm)
+            jsm = genome.open_vcf_file(jsm)
             jsm_line = genome.skip_vcf_header( jsm )
 
         if sniper:
-            sniper = genome.open_textfile(sniper)
+            sniper = genome.open_vcf_file(sniper)
             sniper_line = genome.skip_vcf_header( sniper )
 
         if vardict:
-            vardict = genome.open_textfile(vardict)
+            vardict = genome.open_vcf_file(vardict)
             vardict_line = genome.skip_vcf_header( vardict )
 
         if muse:
-            muse = genome.open_textfile(muse)
+            muse = genome.open_vcf_file(muse)
             muse_line = genome.skip_vcf_header( muse )
 
         if lofreq:
-            lofreq = genome.open_textfile(lofreq)
+            lofreq = genome.open_vcf_file(lofreq)
             lofreq_line = genome.skip_vcf_header( lofreq )
 
         if scalpel:
-            scalpel = genome.open_textfile(scalpel)
+            scalpel = genome.open_vcf_file(scalpel)
             scalpel_line = genome.skip_vcf_header( scalpel )
 
         if strelka:
-            strelka = genome.open_textfile(strelka)
+            strelka = genome.open_vcf_file(strelka)
             strelka_line = genome.skip_vcf_header( strelka )
 
         if tnscope:
-            tnscope = genome.open_textfile(tnscope)
+            tnscope = genome.open_vcf_file(tnscope)
             tnscope_line = genome.skip_vcf_header( tnscope )
 
         if platypus:
-            platypus      = genome.open_textfile(platypus)
+            platypus      = genome.open_vcf_file(platypus)
             platypus_line = genome.skip_vcf_header( platypus )
 
         # Get through all the headers:
@@ -286,11 +419,17 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
 
 
         # First coordinate, for later purpose of making sure the input is sorted properly
-        coordinate_i = re.match( genome.pattern_chr_position, my_line )
-        coordinate_i = coordinate_i.group() if coordinate_i else ''
+        key_i = genome.line_coordinate_key(my_line, chrom_seq)
 
         # First line:
-        outhandle.write( out_header.replace('{','').replace('}','')  + '\n' )
+        outhandle.write( tsv_header.replace('{','').replace('}','')  + '\n' )
+
+        pending_sites = []
+
+        # Linguistic complexity of the windows around consecutive sites, reusing the substring counts where the windows overlap
+        lc_span_80bp  = sequencing_features.Sliding_subLC(20)
+        lc_left_80bp  = sequencing_features.Sliding_subLC(20)
+        lc_right_80bp = sequencing_features.Sliding_subLC(20)
 
         while my_line:
 
@@ -317,13 +456,12 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
                     my_vcf = genome.Vcf_line( my_line )
 
                     ########## This block is code is to ensure the input VCF file is properly sorted ##
-                    coordinate_j = re.match( genome.pattern_chr_position, my_line )
-                    coordinate_j = coordinate_j.group() if coordinate_j else ''
+                    key_j = genome.line_coordinate_key(my_line, chrom_seq)
 
-                    if genome.whoisbehind(coordinate_i, coordinate_j, chrom_seq) == 1:
+                    if key_i > key_j:
                         raise Exception( '{} does not seem to be properly sorted.'.format(mysites) )
 
-                    coordinate_i = coordinate_j
+                    key_i = key_j
                     ###################################################################################
 
                     if my_coordinates[0] == (my_vcf.chromosome, my_vcf.position):
@@ -535,8 +673,12 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
 
 
                         ########## ######### ######### INFO EXTRACTION FROM BAM FILES ########## ######### #########
-                        nBamFeatures = sequencing_features.from_bam(nbam, my_coordinate, ref_base, first_alt, min_mq, min_bq)
-                        tBamFeatures = sequencing_features.from_bam(tbam, my_coordinate, ref_base, first_alt, min_mq, min_bq)
+                        if feature_cache:
+                            nBamFeatures = feature_cache.from_bam(nbam, nbam_fn, my_coordinate, ref_base, first_alt, min_mq, min_bq, max_depth)
+                            tBamFeatures = feature_cache.from_bam(tbam, tbam_fn, my_coordinate, ref_base, first_alt, min_mq, min_bq, max_depth)
+                        else:
+                            nBamFeatures = sequencing_features.from_bam(nbam, my_coordinate, ref_base, first_alt, min_mq, min_bq, defer_statistics=True, max_depth=max_depth)
+                            tBamFeatures = sequencing_features.from_bam(tbam, my_coordinate, ref_base, first_alt, min_mq, min_bq, defer_statistics=True, max_depth=max_depth)
 
                         n_ref = nBamFeatures['ref_for'] + nBamFeatures['ref_rev']
                         n_alt = nBamFeatures['alt_for'] + nBamFeatures['alt_rev']
@@ -545,44 +687,53 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
                         sor = sequencing_features.somaticOddRatio(n_ref, n_alt, t_ref, t_alt)
 
                         # Calculate VarScan'2 SCC directly without using VarScan2 output:
-                        try:
-                            score_varscan2 = genome.p2phred( stats.fisher_exact( ((t_alt, n_alt), (t_ref, n_ref)), alternative='greater' )[1] )
-                        except ValueError:
+                        if 'varscan2_score' in skipped:
                             score_varscan2 = nan
+                        else:
+                            try:
+                                score_varscan2 = genome.p2phred( batch_statistics.fisher_exact_p_value( ((t_alt, n_alt), (t_ref, n_ref)), 'greater' ) )
+                            except ValueError:
+                                score_varscan2 = nan
 
                         # Homopolymer eval:
-                        homopolymer_length, site_homopolymer_length = sequencing_features.from_genome_reference(ref_fa, my_coordinate, ref_base, first_alt)
+                        if 'homopolymer' in skipped:
+                            homopolymer_length = site_homopolymer_length = nan
+                        else:
+                            homopolymer_length, site_homopolymer_length = sequencing_features.from_genome_reference(ref_fa, my_coordinate, ref_base, first_alt)
 
                         # Linguistic sequence complexity in a +/-80bp window, but substring calculation stops at 20-bp substring.
-                        seq_span_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-41), my_coordinate[1]+40)
-                        seq_left_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-81), my_coordinate[1])
-                        seq_right_80bp = ref_fa.fetch(my_coordinate[0], my_coordinate[1], my_coordinate[1]+81)
-
-                        if len(seq_span_80bp) > 20:
-                            LC_spanning = sequencing_features.subLC(seq_span_80bp, 20)
-                        else:
-                            LC_spanning = math.nan
-                        
-                        if len(seq_left_80bp) > 20:
-                            left_LC = sequencing_features.subLC(seq_left_80bp, 20)
-                        else:
-                            left_LC = math.nan
-                        
-                        if len(seq_right_80bp) > 20:
-                            right_LC = sequencing_features.subLC(seq_right_80bp, 20)
+                        if 'sequence_complexity' in skipped:
+                            LC_spanning_phred = LC_adjacent_phred = nan
                         else:
-                            right_LC = math.nan
-                        
-                        LC_adjacent  = min(left_LC, right_LC)
+                            seq_span_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-41), my_coordinate[1]+40)
+                            seq_left_80bp  = ref_fa.fetch(my_coordinate[0], max(0, my_coordinate[1]-81), my_coordinate[1])
+                            seq_right_80bp = ref_fa.fetch(my_coordinate[0], my_coordinate[1], my_coordinate[1]+81)
+
+                            if len(seq_span_80bp) > 20:
+                                LC_spanning = lc_span_80bp.lc(my_coordinate[0], max(0, my_coordinate[1]-41), seq_span_80bp)
+                            else:
+                                LC_spanning = math.nan
+
+                            if len(seq_left_80bp) > 20:
+                                left_LC = lc_left_80bp.lc(my_coordinate[0], max(0, my_coordinate[1]-81), seq_left_80bp)
+                            else:
+                                left_LC = math.nan
 
-                        LC_spanning_phred = genome.p2phred(1-LC_spanning, 40)
-                        LC_adjacent_phred = genome.p2phred(1-LC_adjacent, 40)
+                            if len(seq_right_80bp) > 20:
+                                right_LC = lc_right_80bp.lc(my_coordinate[0], my_coordinate[1], seq_right_80bp)
+                            else:
+                                right_LC = math.nan
+
+                            LC_adjacent  = min(left_LC, right_LC)
+
+                            LC_spanning_phred = genome.p2phred(1-LC_spanning, 40)
+                            LC_adjacent_phred = genome.p2phred(1-LC_adjacent, 40)
                         
                         # Fill the ID field of the TSV/VCF
                         my_identifiers = ';'.join(my_identifiers) if my_identifiers else '.'
 
                         ###
-                        out_line = out_header.format( \
+                        site_items = dict( \
                         CHROM                      = my_coordinate[0],                                                    \
                         POS                        = my_coordinate[1],                                                    \
                         ID                         = my_identifiers,                                                      \
@@ -610,43 +761,8 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
                         COMMON                     = if_common,                                                           \
                         if_COSMIC                  = if_cosmic,                                                           \
                         COSMIC_CNT                 = num_cases,                                                           \
-                        Consistent_Mates           = tBamFeatures['consistent_mates'],                                    \
-                        Inconsistent_Mates         = tBamFeatures['inconsistent_mates'],                                  \
                         Seq_Complexity_Span        = LC_spanning_phred,                                                   \
                         Seq_Complexity_Adj         = LC_adjacent_phred,                                                   \
-                        N_DP                       = nBamFeatures['dp'],                                                  \
-                        nBAM_REF_MQ                = '%g' % nBamFeatures['ref_mq'],                                       \
-                        nBAM_ALT_MQ                = '%g' % nBamFeatures['alt_mq'],                                       \
-                        nBAM_p_MannWhitneyU_MQ     = '%g' % nBamFeatures['p_mannwhitneyu_mq'],                            \
-                        nBAM_REF_BQ                = '%g' % nBamFeatures['ref_bq'],                                       \
-                        nBAM_ALT_BQ                = '%g' % nBamFeatures['alt_bq'],                                       \
-                        nBAM_p_MannWhitneyU_BQ     = '%g' % nBamFeatures['p_mannwhitneyu_bq'],                            \
-                        nBAM_REF_NM                = '%g' % nBamFeatures['ref_NM'],                                       \
-                        nBAM_ALT_NM                = '%g' % nBamFeatures['alt_NM'],                                       \
-                        nBAM_NM_Diff               = '%g' % nBamFeatures['NM_Diff'],                                      \
-                        nBAM_REF_Concordant        = nBamFeatures['ref_concordant_reads'],                                \
-                        nBAM_REF_Discordant        = nBamFeatures['ref_discordant_reads'],                                \
-                        nBAM_ALT_Concordant        = nBamFeatures['alt_concordant_reads'],                                \
-                        nBAM_ALT_Discordant        = nBamFeatures['alt_discordant_reads'],                                \
-                        nBAM_Concordance_FET       = rescale(nBamFeatures['concordance_fet'], 'fraction', p_scale, 1001), \
-                        N_REF_FOR                  = nBamFeatures['ref_for'],                                             \
-                        N_REF_REV                  = nBamFeatures['ref_rev'],                                             \
-                        N_ALT_FOR                  = nBamFeatures['alt_for'],                                             \
-                        N_ALT_REV                  = nBamFeatures['alt_rev'],                                             \
-                        nBAM_StrandBias_FET        = rescale(nBamFeatures['strandbias_fet'], 'fraction', p_scale, 1001),  \
-                        nBAM_p_MannWhitneyU_EndPos = '%g' % nBamFeatures['p_mannwhitneyu_endpos'],                        \
-                        nBAM_REF_Clipped_Reads     = nBamFeatures['ref_SC_reads'],                                        \
-                        nBAM_ALT_Clipped_Reads     = nBamFeatures['alt_SC_reads'],                                        \
-                        nBAM_Clipping_FET          = rescale(nBamFeatures['clipping_fet'], 'fraction', p_scale, 1001),    \
-                        nBAM_MQ0                   = nBamFeatures['MQ0'],                                                 \
-                        nBAM_Other_Reads           = nBamFeatures['noise_read_count'],                                    \
-                        nBAM_Poor_Reads            = nBamFeatures['poor_read_count'],                                     \
-                        nBAM_REF_InDel_3bp         = nBamFeatures['ref_indel_3bp'],                                       \
-                        nBAM_REF_InDel_2bp         = nBamFeatures['ref_indel_2bp'],                                       \
-                        nBAM_REF_InDel_1bp         = nBamFeatures['ref_indel_1bp'],                                       \
-                        nBAM_ALT_InDel_3bp         = nBamFeatures['alt_indel_3bp'],                                       \
-                        nBAM_ALT_InDel_2bp         = nBamFeatures['alt_indel_2bp'],                                       \
-                        nBAM_ALT_InDel_1bp         = nBamFeatures['alt_indel_1bp'],                                       \
                         M2_NLOD                    = nlod,                                                                \
                         M2_TLOD                    = tlod,                                                                \
                         M2_STR                     = tandem,                                                              \
@@ -657,49 +773,30 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
                         SHIFT3                     = shift3,                                                              \
                         MaxHomopolymer_Length      = homopolymer_length,                                                  \
                         SiteHomopolymer_Length     = site_homopolymer_length,                                             \
-                        T_DP                       = tBamFeatures['dp'],                                                  \
-                        tBAM_REF_MQ                = '%g' % tBamFeatures['ref_mq'],                                       \
-                        tBAM_ALT_MQ                = '%g' % tBamFeatures['alt_mq'],                                       \
-                        tBAM_p_MannWhitneyU_MQ     = '%g' % tBamFeatures['p_mannwhitneyu_mq'],                            \
-                        tBAM_REF_BQ                = '%g' % tBamFeatures['ref_bq'],                                       \
-                        tBAM_ALT_BQ                = '%g' % tBamFeatures['alt_bq'],                                       \
-                        tBAM_p_MannWhitneyU_BQ     = '%g' % tBamFeatures['p_mannwhitneyu_bq'],                            \
-                        tBAM_REF_NM                = '%g' % tBamFeatures['ref_NM'],                                       \
-                        tBAM_ALT_NM                = '%g' % tBamFeatures['alt_NM'],                                       \
-                        tBAM_NM_Diff               = '%g' % tBamFeatures['NM_Diff'],                                      \
-                        tBAM_REF_Concordant        = tBamFeatures['ref_concordant_reads'],                                \
-                        tBAM_REF_Discordant        = tBamFeatures['ref_discordant_reads'],                                \
-                        tBAM_ALT_Concordant        = tBamFeatures['alt_concordant_reads'],                                \
-                        tBAM_ALT_Discordant        = tBamFeatures['alt_discordant_reads'],                                \
-                        tBAM_Concordance_FET       = rescale(tBamFeatures['concordance_fet'], 'fraction', p_scale, 1001), \
-                        T_REF_FOR                  = tBamFeatures['ref_for'],                                             \
-                        T_REF_REV                  = tBamFeatures['ref_rev'],                                             \
-                        T_ALT_FOR                  = tBamFeatures['alt_for'],                                             \
-                        T_ALT_REV                  = tBamFeatures['alt_rev'],                                             \
-                        tBAM_StrandBias_FET        = rescale(tBamFeatures['strandbias_fet'], 'fraction', p_scale, 1001),  \
-                        tBAM_p_MannWhitneyU_EndPos = '%g' % tBamFeatures['p_mannwhitneyu_endpos'],                        \
-                        tBAM_REF_Clipped_Reads     = tBamFeatures['ref_SC_reads'],                                        \
-                        tBAM_ALT_Clipped_Reads     = tBamFeatures['alt_SC_reads'],                                        \
-                        tBAM_Clipping_FET          = rescale(tBamFeatures['clipping_fet'], 'fraction', p_scale, 1001),    \
-                        tBAM_MQ0                   = tBamFeatures['MQ0'],                                                 \
-                        tBAM_Other_Reads           = tBamFeatures['noise_read_count'],                                    \
-                        tBAM_Poor_Reads            = tBamFeatures['poor_read_count'],                                     \
-                        tBAM_REF_InDel_3bp         = tBamFeatures['ref_indel_3bp'],                                       \
-                        tBAM_REF_InDel_2bp         = tBamFeatures['ref_indel_2bp'],                                       \
-                        tBAM_REF_InDel_1bp         = tBamFeatures['ref_indel_1bp'],                                       \
-                        tBAM_ALT_InDel_3bp         = tBamFeatures['alt_indel_3bp'],                                       \
-                        tBAM_ALT_InDel_2bp         = tBamFeatures['alt_indel_2bp'],                                       \
-                        tBAM_ALT_InDel_1bp         = tBamFeatures['alt_indel_1bp'],                                       \
                         InDel_Length               = indel_length,                                                        \
                         TrueVariant_or_False       = judgement )
 
-                        # Print it out to stdout:
-                        outhandle.write(out_line + '\n')
+                        # The p-values from the BAM files are computed for many sites at once, so the sites are written out in batches:
+                        pending_sites.append( (site_items, nBamFeatures, tBamFeatures) )
+
+                        if len(pending_sites) >= STATISTICS_BATCH_SIZE:
+                            write_pending_sites(outhandle, pending_sites, p_scale, skipped, tsv_header, table)
+                            pending_sites = []
 
             # Read into the next line:
             if not is_vcf:
                 my_line = my_sites.readline().rstrip()
 
+        write_pending_sites(outhandle, pending_sites, p_scale, skipped, tsv_header, table)
+        logger.info( batch_statistics.fisher_exact_cache_summary() )
+
+        if feature_cache:
+            feature_cache.close()
+            logger.info( feature_cache.summary() )
+
+        if table:
+            table.close()
+
         ##########  Close all open files if they were opened  ##########
         opened_files = (ref_fa, nbam, tbam, truth, cosmic, dbsnp, mutect, varscan, jsm, sniper, vardict, muse, lofreq, scalpel, strelka, tnscope, platypus)
         [opened_file.close() for opened_file in opened_files if opened_file]
@@ -709,6 +806,8 @@ def vcf2tsv(is_vcf=None, is_bed=None, is_pos=None, nbam_fn=None, tbam_fn=None, t
 if __name__ == '__main__':
     runParameters = run()
 
+    features = feature_registry.model_features( runParameters['features_from_model'] ) if runParameters['features_from_model'] else None
+
     vcf2tsv(is_vcf     = runParameters['vcf_format'], \
             is_bed     = runParameters['bed_format'], \
             is_pos     = runParameters['positions_list'], \
@@ -734,4 +833,10 @@ if __name__ == '__main__':
             min_caller = runParameters['minimum_num_callers'], \
             ref_fa     = runParameters['genome_reference'], \
             p_scale    = runParameters['p_scale'], \
-            outfile    = runParameters['output_tsv_file'])
+            outfile    = runParameters['output_tsv_file'], \
+            threads    = runParameters['threads'], \
+            features   = features, \
+            feature_cache = runParameters['feature_cache'], \
+            feature_cache_megabytes = runParameters['feature_cache_megabytes'], \
+            max_depth  = runParameters['max_depth'], \
+            output_table = runParameters['output_table'])
@@ -6,16 +6,24 @@ import pandas as pd
 import numpy as np
 import re
 import logging
+import queue
+import threading
 import somaticseq.ntchange_type as ntchange
+import somaticseq.feature_table as feature_table
 from copy import copy
 from somaticseq._version import  __version__
 
 
 DEFAULT_PARAM = {'max_depth': 8, 'nthread': 1, 'objective': 'binary:logistic', 'seed': 0, 'tree_method': 'hist', 'grow_policy': 'lossguide'}
-NON_FEATURE   = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'Strelka_QSS', 'Strelka_TQSS', 'if_COSMIC', 'COSMIC_CNT', 'TrueVariant_or_False']
+NON_FEATURE   = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'Strelka_QSS', 'Strelka_TQSS', 'if_COSMIC', 'COSMIC_CNT', 'nBAM_Downsampled', 'tBAM_Downsampled', 'TrueVariant_or_False']
 
 DEFAULT_XGB_BOOST_ROUNDS  = 500
 DEFAULT_NUM_TREES_PREDICT = 100
+DEFAULT_TRAINING_CHUNK_SIZE = 100000
+DEFAULT_PREDICTION_CHUNK_SIZE = 10000
+
+# Number of chunks waiting to be scored, and waiting to be written, during prediction
+PREDICTION_QUEUE_SIZE = 4
 
 
 
@@ -42,7 +50,61 @@ def save_feature_importance_to_file(xgb_model, filename):
 
 
 
-def builder(input_tsvs, param=DEFAULT_PARAM, non_feature=NON_FEATURE, num_rounds=DEFAULT_XGB_BOOST_ROUNDS, model=None):
+class Feature_chunks(xgb.DataIter):
+    '''
+    Feed the input files to xgboost chunksize rows at a time, as float32 features, so they never have to be in memory all at once.
+    The feature columns are those of all the input files, in the order pd.concat would put them, and those missing from a chunk are nan.
+    '''
+
+    def __init__(self, input_tsvs, non_feature=NON_FEATURE, chunksize=DEFAULT_TRAINING_CHUNK_SIZE):
+        self.input_tsvs  = input_tsvs
+        self.non_feature = non_feature
+        self.chunksize   = chunksize
+        self.features    = self.feature_columns()
+        self.chunks      = self.read_chunks()
+        super().__init__()
+
+
+    def feature_columns(self):
+        '''The columns of every input file, then those added by ntchange, less the non-features, the same as the in-memory training data.'''
+
+        columns = []
+        for input_tsv_i in self.input_tsvs:
+            columns.extend( column_i for column_i in feature_table.read_columns(input_tsv_i) if column_i not in columns )
+
+        columns = [ column_i for column_i in columns if column_i not in ntchange.NTCHANGE_COLUMNS ] + list(ntchange.NTCHANGE_COLUMNS)
+
+        return [ column_i for column_i in columns if column_i not in self.non_feature ]
+
+
+    def read_chunks(self):
+        for input_tsv_i in self.input_tsvs:
+            yield from feature_table.read_data_in_chunks(input_tsv_i, self.chunksize)
+
+
+    def next(self, input_data):
+
+        chunk_i = next(self.chunks, None)
+        if chunk_i is None:
+            return False
+
+        train_data = ntchange.ntchange(chunk_i)
+
+        input_data( data=train_data.reindex(columns=self.features).astype(np.float32), label=chunk_i['TrueVariant_or_False'].to_numpy(dtype=np.float32) )
+
+        return True
+
+
+    def reset(self):
+        self.chunks = self.read_chunks()
+
+
+
+def builder(input_tsvs, param=DEFAULT_PARAM, non_feature=NON_FEATURE, num_rounds=DEFAULT_XGB_BOOST_ROUNDS, model=None, chunksize=None):
+    '''
+    With chunksize, the input files are streamed through xgboost in chunks of that many rows, and only the quantized features are kept in memory (tree_method must be hist).
+    Otherwise, they are all read into memory first.
+    '''
 
     logger = logging.getLogger( 'XGBOOST_' + builder.__name__)
     logger.info('TRAINING {} for XGBOOST'.format( ','.join(input_tsvs)) )
@@ -54,16 +116,27 @@ def builder(input_tsvs, param=DEFAULT_PARAM, non_feature=NON_FEATURE, num_rounds
     if not model:
         model = input_tsvs[0] + '.xgb.v{}.classifier'.format( __version__ )
     
-    input_data = pd.concat( [pd.read_csv(input_tsv_i, sep='\t', low_memory=False) for input_tsv_i in input_tsvs] )
-    
-    train_data = ntchange.ntchange(input_data)
-    for non_feature_i in non_feature:
-        if non_feature_i in train_data:
-            train_data.drop([non_feature_i,], axis=1, inplace=True)
+    # Each input can be a TSV file, or a .parquet/.npz table file (see feature_table)
+    if chunksize:
+        logger.info('Streaming the input in chunks of {} rows'.format(chunksize) )
+        
+        input_chunks = Feature_chunks(input_tsvs, non_feature, chunksize)
+        dtrain       = xgb.QuantileDMatrix(input_chunks, max_bin=param.get('max_bin'), nthread=param.get('nthread'))
+        
+        logger.info('{} rows of {} features'.format(dtrain.num_row(), dtrain.num_col()) )
     
-    train_label   = input_data['TrueVariant_or_False']
+    else:
+        input_data = pd.concat( [feature_table.read_data(input_tsv_i) for input_tsv_i in input_tsvs] )
+        
+        train_data = ntchange.ntchange(input_data)
+        for non_feature_i in non_feature:
+            if non_feature_i in train_data:
+                train_data.drop([non_feature_i,], axis=1, inplace=True)
+        
+        train_label   = input_data['TrueVariant_or_False']
+        
+        dtrain      = xgb.DMatrix(train_data, label=train_label)
     
-    dtrain      = xgb.DMatrix(train_data, label=train_label)
     bst         = xgb.train(param, dtrain, num_boost_round=num_rounds)
     
     bst.save_model(model)
@@ -75,33 +148,143 @@ def builder(input_tsvs, param=DEFAULT_PARAM, non_feature=NON_FEATURE, num_rounds
 
 
 
-def predictor(model, input_tsv, output_tsv, non_feature=NON_FEATURE, iterations=DEFAULT_NUM_TREES_PREDICT):
+def predict_with_trees(xgb_model, dmatrix, iterations=DEFAULT_NUM_TREES_PREDICT):
+    '''
+    Predict with only the first iterations trees (all of them if iterations is 0 or None, or more than there are):
+    iteration_range in newer xgboost, and ntree_limit in xgboost before 1.4.
+    '''
+
+    try:
+        num_trees = xgb_model.num_boosted_rounds()
+        iterations = min(iterations, num_trees) if iterations else num_trees
+        return xgb_model.predict(dmatrix, iteration_range=(0, iterations))
+
+    except (AttributeError, TypeError):
+        return xgb_model.predict(dmatrix, ntree_limit=iterations if iterations else 0)
+
+
+
+def load_model(model, nthread=None):
+
+    if isinstance(model, xgb.Booster):
+        xgb_model = model
+    else:
+        xgb_model = xgb.Booster()
+        xgb_model.load_model(model)
+
+    if nthread:
+        xgb_model.set_param({'nthread': nthread})
+
+    return xgb_model
+
+
+
+def predict_data_frame(model, input_data, non_feature=NON_FEATURE, iterations=DEFAULT_NUM_TREES_PREDICT, nthread=None):
+    '''The scores of the rows of a data frame with the columns of an Ensemble TSV file. model is a model file or an xgb.Booster.'''
+
+    xgb_model = load_model(model, nthread)
+
+    test_data = ntchange.ntchange(input_data)
+    test_data = test_data.drop( [non_feature_i for non_feature_i in non_feature if non_feature_i in test_data], axis=1 )
+
+    return predict_with_trees(xgb_model, xgb.DMatrix(test_data, nthread=nthread), iterations)
+
+
+
+def run_in_thread(function, *args):
+    '''Start function(*args) in a thread. Its exception, if any, is kept in the returned list to be raised in the main thread.'''
+
+    errors = []
+
+    def keep_error():
+        try:
+            function(*args)
+        except BaseException as error:
+            errors.append( error )
+
+    thread_i = threading.Thread(target=keep_error, daemon=True)
+    thread_i.start()
+
+    return thread_i, errors
+
+
+
+def put_while(out_queue, item, keep_trying):
+    '''Put the item into the bounded queue, unless keep_trying() turns False while waiting for room.'''
+
+    while keep_trying():
+        try:
+            out_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            pass
+
+    return False
+
+
+
+def queued_items(in_queue):
+    '''The items from the queue until None.'''
+
+    item = in_queue.get()
+    while item is not None:
+        yield item
+        item = in_queue.get()
+
+
+
+def predictor(model, input_tsv, output_tsv, non_feature=NON_FEATURE, iterations=DEFAULT_NUM_TREES_PREDICT, chunksize=DEFAULT_PREDICTION_CHUNK_SIZE, nthread=None):
+    '''
+    Reading the chunks of the input, scoring them, and writing them out are done in three threads connected by bounded queues, 
+    so they overlap with one another (xgboost and much of pandas release the GIL). The output is the same as scoring the chunks one after another.
+    '''
 
     logger = logging.getLogger( 'XGBOOST_' + predictor.__name__)
     logger.info('Columns removed for prediction: {}'.format( ','.join(non_feature)) )
     logger.info('Number of trees to use = {}'.format(iterations) )
 
-    xgb_model = xgb.Booster()
-    xgb_model.load_model(model)
+    xgb_model = load_model(model, nthread)
 
-    # Read in chunks, start with write/Header, and append/NoHeader afterwards.
-    chunksize = 10000
-    writeMode, writeHeader = 'w', True
-    
-    for input_data in pd.read_csv(input_tsv, sep='\t', chunksize=chunksize, low_memory=False):
-    
-        test_data = ntchange.ntchange(input_data)
-        for non_feature_i in non_feature:
-            if non_feature_i in test_data:
-                test_data.drop(non_feature_i, axis=1, inplace=True)
-    
-        dtest     = xgb.DMatrix(test_data)
-        scores    = xgb_model.predict(dtest, ntree_limit=iterations)
-        predicted = input_data.assign(SCORE = scores)
-    
-        predicted.to_csv(output_tsv, sep='\t', index=False, mode=writeMode, header=writeHeader, na_rep='nan')
-        
-        writeMode, writeHeader = 'a', False
+    # Chunks read and not scored yet, and chunks scored and not written yet. None marks the end.
+    input_queue  = queue.Queue(maxsize=PREDICTION_QUEUE_SIZE)
+    output_queue = queue.Queue(maxsize=PREDICTION_QUEUE_SIZE)
+    stopped      = threading.Event()
+    not_stopped  = lambda: not stopped.is_set()
+
+    def read_chunks():
+        try:
+            for input_data in feature_table.read_data_in_chunks(input_tsv, chunksize):
+                if not put_while(input_queue, input_data, not_stopped):
+                    return
+        finally:
+            put_while(input_queue, None, not_stopped)
+
+    # The input and output can be TSV files or .parquet/.npz table files (see feature_table), both written a chunk at a time.
+    def write_chunks():
+        with feature_table.open_writer(output_tsv) as out:
+            for predicted in queued_items(output_queue):
+                out.write( predicted )
+
+    reader, reader_errors = run_in_thread(read_chunks)
+    writer, writer_errors = run_in_thread(write_chunks)
+
+    try:
+        for input_data in queued_items(input_queue):
+
+            scores    = predict_data_frame(xgb_model, input_data, non_feature, iterations, nthread)
+            predicted = input_data.assign(SCORE = scores)
+
+            if not put_while(output_queue, predicted, writer.is_alive):
+                break
+
+    finally:
+        stopped.set()
+        put_while(output_queue, None, writer.is_alive)
+        reader.join()
+        writer.join()
+
+    for error_i in reader_errors + writer_errors:
+        raise error_i
 
     return output_tsv
 
@@ -129,13 +312,14 @@ if __name__ == '__main__':
 
     # TRAINING mode
     parser_train = sample_parsers.add_parser('train')
-    parser_train.add_argument('-tsvs',    '--tsvs-in',          type=str, nargs='+', help='labeled tsv file(s)',  required=True)
+    parser_train.add_argument('-tsvs',    '--tsvs-in',          type=str, nargs='+', help='labeled tsv file(s), or .parquet/.npz table file(s)',  required=True)
     parser_train.add_argument('-out',     '--model-out',        type=str, help='output model file name')
     parser_train.add_argument('-threads', '--num-threads',      type=int, help='num threads.')
     parser_train.add_argument('-depth',   '--max-depth',        type=int, help='tree max depth. default=8')
     parser_train.add_argument('-seed',    '--seed',             type=int, help='random seed. default=0')
     parser_train.add_argument('-method',  '--tree-method',      type=str, help='tree method. default=hist')
     parser_train.add_argument('-iter',    '--num-boost-rounds', type=int, help='num boosting rounds, i.e., number of trees', default=1000)
+    parser_train.add_argument('-chunk',   '--chunk-size',       type=int, help='stream the input files through xgboost in chunks of this many rows, instead of reading them all into memory (requires tree method hist)')
     parser_train.add_argument('--extra-params',      nargs='*', type=str, help='extra xgboost training parameters in format of PARAM_1:VALUE_1 PARAM_2:VALUE_2. Will overwrite defaults and other options.')
     parser_train.add_argument('--features-excluded', nargs='*', type=str, help='features to exclude for xgboost training. Must be same for train/predict.', default=[] )
     parser_train.set_defaults(which='train')
@@ -144,9 +328,11 @@ if __name__ == '__main__':
     # PREDICTION mode
     parser_predict = sample_parsers.add_parser('predict')
     parser_predict.add_argument('-model',  '--model',            type=str, help='xgboost model',  required=True)
-    parser_predict.add_argument('-tsv',    '--tsv-in',           type=str, help='tsv file in',    required=True)
-    parser_predict.add_argument('-out',    '--predicted-tsv',    type=str, help='tsv file out',   required=True)
+    parser_predict.add_argument('-tsv',    '--tsv-in',           type=str, help='tsv file in, or .parquet/.npz table file',    required=True)
+    parser_predict.add_argument('-out',    '--predicted-tsv',    type=str, help='tsv file out, or .parquet/.npz table file',   required=True)
     parser_predict.add_argument('-ntrees', '--num-trees', type=int, help='only use this many trees to classify', default=100)
+    parser_predict.add_argument('-chunk',  '--chunk-size', type=int, help='number of rows scored at a time', default=DEFAULT_PREDICTION_CHUNK_SIZE)
+    parser_predict.add_argument('-threads', '--num-threads', type=int, help='num threads for xgboost to score each chunk')
     parser_predict.add_argument('--features-excluded', nargs='*', type=str, help='features to exclude for xgboost training. Must be same for train/predict.', default=[] )
     parser_predict.set_defaults(which='predict')
 
@@ -183,7 +369,7 @@ if __name__ == '__main__':
         for feature_i in args.features_excluded:
             NON_FEATURE.append( feature_i )
         
-        builder(args.tsvs_in, param=PARAM, non_feature=NON_FEATURE, num_rounds=args.num_boost_rounds, model=args.model_out)
+        builder(args.tsvs_in, param=PARAM, non_feature=NON_FEATURE, num_rounds=args.num_boost_rounds, model=args.model_out, chunksize=args.chunk_size)
 
 
 
@@ -192,4 +378,4 @@ if __name__ == '__main__':
         for feature_i in args.features_excluded:
             NON_FEATURE.append( feature_i )
 
-        predictor(args.model, args.tsv_in, args.predicted_tsv, non_feature=NON_FEATURE, iterations=args.num_trees)
+        predictor(args.model, args.tsv_in, args.predicted_tsv, non_feature=NON_FEATURE, iterations=args.num_trees, chunksize=args.chunk_size, nthread=args.num_threads)
@@ -1,52 +1,81 @@
 #!/usr/bin/env python3
 
-import sys, os, argparse, shutil, math, re, subprocess, logging
+import sys, os, argparse, shutil, math, re, subprocess, logging, time
 from multiprocessing import Pool
 from functools import partial
 from shutil import rmtree
 
 import somaticseq.run_somaticseq as run_somaticseq
+import somaticseq.feature_table as feature_table
 import utilities.split_Bed_into_equal_regions as split_bed
 import genomicFileHandler.concat as concat
 
 
 
-def splitRegions(nthreads, outfiles, bed=None, fai=None):
+def splitRegions(nthreads, outfiles, bed=None, fai=None, vcfs=[], bams=[], by_workload=True):
+    '''
+    Split the bed file (or the whole genome in the .fai file) into nthreads bed files.
+    By default, each has about the same amount of work, going by the candidate variants in the caller vcfs and the reads in the bams (see split_bed.split_by_workload).
+    With by_workload=False, or nothing to go by, each has the same number of base pairs.
+    '''
 
     assert bed or fai
     if fai and not bed:
         bed = split_bed.fai2bed(fai, outfiles)
 
-    writtenBeds = split_bed.split(bed, outfiles, nthreads)
+    vcfs = [ vcf_i for vcf_i in vcfs if vcf_i ]
+    bams = [ bam_i for bam_i in bams if bam_i ]
+
+    if by_workload and (vcfs or bams):
+        writtenBeds = split_bed.split_by_workload(bed, outfiles, nthreads, vcfs, bams)
+    else:
+        writtenBeds = split_bed.split(bed, outfiles, nthreads)
 
     return writtenBeds
 
 
 
 
-def runPaired_by_region(inclusion, outdir=None, ref=None, tbam=None, nbam=None, tumor_name='TUMOR', normal_name='NORMAL', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, exclusion=None, mutect=None, indelocator=None, mutect2=None, varscan_snv=None, varscan_indel=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq_snv=None, lofreq_indel=None, scalpel=None, strelka_snv=None, strelka_indel=None, tnscope=None, platypus=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=200, features_excluded=[]):
+def subdir_of_region(inclusion, outdir):
+    '''The sub-directory for the results of the region in the bed file.'''
+    basename = inclusion.split(os.sep)[-1].split('.')[0]
+    return outdir + os.sep + basename
+
+
+
+def region_size(inclusion):
+    with open(inclusion) as bed:
+        return sum( int(line_i.split('\t')[2]) - int(line_i.split('\t')[1]) for line_i in bed if line_i.strip() )
+
+
+
+def runPaired_by_region(inclusion, outdir=None, ref=None, tbam=None, nbam=None, tumor_name='TUMOR', normal_name='NORMAL', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, exclusion=None, mutect=None, indelocator=None, mutect2=None, varscan_snv=None, varscan_indel=None, jsm=None, sniper=None, vardict=None, muse=None, lofreq_snv=None, lofreq_indel=None, scalpel=None, strelka_snv=None, strelka_indel=None, tnscope=None, platypus=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=200, features_excluded=[], skip_unused_features=False, feature_cache=None, feature_table_format=None):
 
     logger = logging.getLogger(runPaired_by_region.__name__)
 
-    basename   = inclusion.split(os.sep)[-1].split('.')[0]
-    outdir_i   = outdir + os.sep + basename
+    outdir_i   = subdir_of_region(inclusion, outdir)
     os.makedirs(outdir_i, exist_ok=True)
+    start_time = time.time()
+
+    run_somaticseq.runPaired(outdir_i, ref, tbam, nbam, tumor_name, normal_name, truth_snv, truth_indel, classifier_snv, classifier_indel, pass_threshold, lowqual_threshold, hom_threshold, het_threshold, dbsnp, cosmic, inclusion, exclusion, mutect, indelocator, mutect2, varscan_snv, varscan_indel, jsm, sniper, vardict, muse, lofreq_snv, lofreq_indel, scalpel, strelka_snv, strelka_indel, tnscope, platypus, min_mq, min_bq, min_caller, somaticseq_train, ensembleOutPrefix, consensusOutPrefix, classifiedOutPrefix, algo, keep_intermediates, train_seed, tree_depth, iterations, features_excluded, skip_unused_features=skip_unused_features, feature_cache=feature_cache, feature_table_format=feature_table_format)
 
-    run_somaticseq.runPaired(outdir_i, ref, tbam, nbam, tumor_name, normal_name, truth_snv, truth_indel, classifier_snv, classifier_indel, pass_threshold, lowqual_threshold, hom_threshold, het_threshold, dbsnp, cosmic, inclusion, exclusion, mutect, indelocator, mutect2, varscan_snv, varscan_indel, jsm, sniper, vardict, muse, lofreq_snv, lofreq_indel, scalpel, strelka_snv, strelka_indel, tnscope, platypus, min_mq, min_bq, min_caller, somaticseq_train, ensembleOutPrefix, consensusOutPrefix, classifiedOutPrefix, algo, keep_intermediates, train_seed, tree_depth, iterations, features_excluded)
+    logger.info( '{} ({} bp) finished in {:.1f} seconds'.format(inclusion, region_size(inclusion), time.time() - start_time) )
 
     return outdir_i
 
 
 
-def runSingle_by_region(inclusion, outdir, ref, bam, sample_name='TUMOR', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, exclusion=None, mutect=None, mutect2=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=200, features_excluded=[]):
+def runSingle_by_region(inclusion, outdir, ref, bam, sample_name='TUMOR', truth_snv=None, truth_indel=None, classifier_snv=None, classifier_indel=None, pass_threshold=0.5, lowqual_threshold=0.1, hom_threshold=0.85, het_threshold=0.01, dbsnp=None, cosmic=None, exclusion=None, mutect=None, mutect2=None, varscan=None, vardict=None, lofreq=None, scalpel=None, strelka=None, min_mq=1, min_bq=5, min_caller=0.5, somaticseq_train=False, ensembleOutPrefix='Ensemble.', consensusOutPrefix='Consensus.', classifiedOutPrefix='SSeq.Classified.', algo='ada', keep_intermediates=False, train_seed=0, tree_depth=12, iterations=200, features_excluded=[], skip_unused_features=False, feature_cache=None, feature_table_format=None):
 
     logger = logging.getLogger(runSingle_by_region.__name__)
     
-    basename   = inclusion.split(os.sep)[-1].split('.')[0]
-    outdir_i   = outdir + os.sep + basename
+    outdir_i   = subdir_of_region(inclusion, outdir)
     os.makedirs(outdir_i, exist_ok=True)
+    start_time = time.time()
 
-    run_somaticseq.runSingle(outdir_i, ref, bam, sample_name, truth_snv, truth_indel, classifier_snv, classifier_indel, pass_threshold, lowqual_threshold, hom_threshold, het_threshold, dbsnp, cosmic, inclusion, exclusion, mutect, mutect2, varscan, vardict, lofreq, scalpel, strelka, min_mq, min_bq, min_caller, somaticseq_train, ensembleOutPrefix, consensusOutPrefix, classifiedOutPrefix, algo, keep_intermediates, train_seed, tree_depth, iterations, features_excluded)
+    run_somaticseq.runSingle(outdir_i, ref, bam, sample_name, truth_snv, truth_indel, classifier_snv, classifier_indel, pass_threshold, lowqual_threshold, hom_threshold, het_threshold, dbsnp, cosmic, inclusion, exclusion, mutect, mutect2, varscan, vardict, lofreq, scalpel, strelka, min_mq, min_bq, min_caller, somaticseq_train, ensembleOutPrefix, consensusOutPrefix, classifiedOutPrefix, algo, keep_intermediates, train_seed, tree_depth, iterations, features_excluded, skip_unused_features=skip_unused_features, feature_cache=feature_cache, feature_table_format=feature_table_format)
+
+    logger.info( '{} ({} bp) finished in {:.1f} seconds'.format(inclusion, region_size(inclusion), time.time() - start_time) )
 
     return outdir_i
 
@@ -60,6 +89,10 @@ def mergeSubdirVcf(dirList, filename, outdir=os.curdir):
     fileList = ['{}/{}'.format(dir_i, filename) for dir_i in dirList]
     concat.vcf(fileList, outdir + os.sep + filename)
 
+def mergeSubdirTable(dirList, filename, outdir=os.curdir):
+    fileList = ['{}/{}'.format(dir_i, filename) for dir_i in dirList]
+    feature_table.concat_tables(fileList, outdir + os.sep + filename)
+
 
 
 if __name__ == '__main__':
@@ -68,7 +101,15 @@ if __name__ == '__main__':
 
     os.makedirs(args.output_directory, exist_ok=True)
 
-    bed_splitted = splitRegions(args.threads, args.output_directory+os.sep+'th.input.bed', args.inclusion_region, args.genome_reference+'.fai')
+    if args.which == 'paired':
+        caller_vcfs = [args.mutect_vcf, args.indelocator_vcf, args.mutect2_vcf, args.varscan_snv, args.varscan_indel, args.jsm_vcf, args.somaticsniper_vcf, args.vardict_vcf, args.muse_vcf, args.lofreq_snv, args.lofreq_indel, args.scalpel_vcf, args.strelka_snv, args.strelka_indel, args.tnscope_vcf, args.platypus_vcf]
+        bam_files   = [args.tumor_bam_file, args.normal_bam_file]
+    else:
+        caller_vcfs = [args.mutect_vcf, args.mutect2_vcf, args.varscan_vcf, args.vardict_vcf, args.lofreq_vcf, args.scalpel_vcf, args.strelka_vcf]
+        bam_files   = [args.bam_file]
+
+    # Many more regions than threads, handed out to whichever process is free, so a slow region cannot hold up the rest:
+    bed_splitted = splitRegions(args.threads * args.chunks_per_thread, args.output_directory+os.sep+'th.input.bed', args.inclusion_region, args.genome_reference+'.fai', caller_vcfs, bam_files, not args.split_by_base_pairs)
 
     pool = Pool(processes = args.threads)
 
@@ -118,9 +159,12 @@ if __name__ == '__main__':
                    iterations         = args.iterations, \
                    features_excluded  = args.features_excluded, \
                    keep_intermediates = args.keep_intermediates, \
+                   skip_unused_features = args.skip_unused_features, \
+                   feature_cache      = args.feature_cache, \
+                   feature_table_format = args.feature_table, \
                    )
 
-        subdirs = pool.map(runPaired_by_region_i, bed_splitted)
+        subdirs = list( pool.imap_unordered(runPaired_by_region_i, bed_splitted) )
         pool.close()
 
     elif args.which == 'single':
@@ -158,18 +202,29 @@ if __name__ == '__main__':
                    iterations         = args.iterations, \
                    features_excluded  = args.features_excluded, \
                    keep_intermediates = args.keep_intermediates, \
+                   skip_unused_features = args.skip_unused_features, \
+                   feature_cache      = args.feature_cache, \
+                   feature_table_format = args.feature_table, \
                    )
 
-        subdirs = pool.map(runSingle_by_region_i, bed_splitted)
+        subdirs = list( pool.imap_unordered(runSingle_by_region_i, bed_splitted) )
         pool.close()
 
 
+    # Sub-results in genomic order, i.e., the order of the regions:
+    region_order = { subdir_of_region(bed_i, args.output_directory): n for n, bed_i in enumerate(bed_splitted) }
+    subdirs = sorted(subdirs, key=lambda subdir_i: region_order[subdir_i])
+
     run_somaticseq.logger.info('Sub-directories created: {}'.format(', '.join(subdirs)) )
 
     # Merge sub-results
     mergeSubdirTsv(subdirs, 'Ensemble.sSNV.tsv', args.output_directory)
     mergeSubdirTsv(subdirs, 'Ensemble.sINDEL.tsv', args.output_directory)
 
+    if args.feature_table:
+        mergeSubdirTable(subdirs, run_somaticseq.ensemble_table('Ensemble.sSNV.tsv',   args.feature_table), args.output_directory)
+        mergeSubdirTable(subdirs, run_somaticseq.ensemble_table('Ensemble.sINDEL.tsv', args.feature_table), args.output_directory)
+
     if args.classifier_snv:
         mergeSubdirTsv(subdirs, 'SSeq.Classified.sSNV.tsv', args.output_directory)
         mergeSubdirVcf(subdirs, 'SSeq.Classified.sSNV.vcf', args.output_directory)
@@ -185,8 +240,10 @@ if __name__ == '__main__':
     # If there is training, it should be done after merging the results
     if args.somaticseq_train:
 
-        snv_training_file   = args.output_directory + os.sep + 'Ensemble.sSNV.tsv'
-        indel_training_file = args.output_directory + os.sep + 'Ensemble.sINDEL.tsv'
+        snv_training_tsv    = args.output_directory + os.sep + 'Ensemble.sSNV.tsv'
+        indel_training_tsv  = args.output_directory + os.sep + 'Ensemble.sINDEL.tsv'
+        snv_training_file   = run_somaticseq.model_input(snv_training_tsv,   run_somaticseq.ensemble_table(snv_training_tsv,   args.feature_table), args.algorithm)
+        indel_training_file = run_somaticseq.model_input(indel_training_tsv, run_somaticseq.ensemble_table(indel_training_tsv, args.feature_table), args.algorithm)
         
         num_iterations = args.iterations if args.iterations else run_somaticseq.DEFAULT_XGB_BOOST_ROUNDS
             
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+# Score Ensemble TSV files with a SomaticSeq XGBoost model compiled into flat NumPy arrays, without xgboost.
+# A model is compiled once (which needs xgboost, unless the model is saved as .json), and truncated to its first N trees, e.g.,
+#     tree_ensemble.py compile -model sSNV.classifier -ntrees 100 -out sSNV.classifier.trees.npz
+#     tree_ensemble.py predict -model sSNV.classifier.trees.npz -tsv Ensemble.sSNV.tsv -out SSeq.Classified.sSNV.tsv
+
+import sys, os, argparse, json, logging
+import numpy as np
+
+MY_DIR = os.path.dirname(os.path.realpath(__file__))
+PRE_DIR = os.path.join(MY_DIR, os.pardir)
+sys.path.append( PRE_DIR )
+
+import somaticseq.ntchange_type as ntchange
+import somaticseq.feature_table as feature_table
+
+COMPILED_MODEL_SUFFIX = '.trees.npz'
+SUPPORTED_OBJECTIVES  = ('binary:logistic', 'reg:logistic', 'binary:logitraw')
+
+logger = logging.getLogger('TREE_ENSEMBLE')
+
+
+
+def model_json(model_file):
+    '''The xgboost model as the JSON dictionary xgboost saves it as.'''
+
+    if model_file.lower().endswith('.json'):
+        with open(model_file) as model_in:
+            return json.load(model_in)
+
+    import xgboost as xgb
+
+    xgb_model = xgb.Booster()
+    xgb_model.load_model(model_file)
+
+    return json.loads( xgb_model.save_raw('json') )
+
+
+
+def compile_model(model_file, num_trees=None, out_file=None):
+    '''
+    Flatten the first num_trees trees (all of them if None) of the model into arrays of shape (number of trees, most nodes in a tree),
+    saved as a .npz file. Every leaf points to itself, so walking a fixed number of steps from the root always ends at a leaf.
+    '''
+
+    learner   = model_json(model_file)['learner']
+    objective = learner['objective']['name']
+    trees     = learner['gradient_booster']['model']['trees']
+
+    if objective not in SUPPORTED_OBJECTIVES:
+        raise ValueError('Objective {} is not supported'.format(objective) )
+
+    if num_trees:
+        trees = trees[:num_trees]
+
+    max_nodes = max( len(tree_i['left_children']) for tree_i in trees )
+
+    feature      = np.zeros( (len(trees), max_nodes), dtype=np.int32 )
+    threshold    = np.zeros( (len(trees), max_nodes), dtype=np.float32 )
+    left         = np.zeros( (len(trees), max_nodes), dtype=np.int32 )
+    right        = np.zeros( (len(trees), max_nodes), dtype=np.int32 )
+    default_left = np.zeros( (len(trees), max_nodes), dtype=bool )
+    is_leaf      = np.ones(  (len(trees), max_nodes), dtype=bool )
+
+    for n, tree_i in enumerate(trees):
+
+        if any( tree_i.get('split_type', []) ):
+            raise ValueError('Categorical splits are not supported')
+
+        num_nodes = len(tree_i['left_children'])
+        nodes     = np.arange(num_nodes)
+        leaves    = np.array(tree_i['left_children']) == -1
+
+        feature[n, :num_nodes]      = tree_i['split_indices']
+        threshold[n, :num_nodes]    = tree_i['split_conditions']
+        default_left[n, :num_nodes] = tree_i['default_left']
+        is_leaf[n, :num_nodes]      = leaves
+        left[n, :num_nodes]         = np.where(leaves, nodes, tree_i['left_children'])
+        right[n, :num_nodes]        = np.where(leaves, nodes, tree_i['right_children'])
+
+    # Longest path from the root to a leaf, over all the trees:
+    depth = max( tree_depth(tree_i['left_children'], tree_i['right_children']) for tree_i in trees )
+
+    # base_score is a probability, written as "5E-1" or "[5.6854654E-2]" depending on the xgboost version
+    base_score  = float( learner['learner_model_param']['base_score'].strip('[]') )
+    base_margin = np.log( base_score / (1 - base_score) ) if objective != 'binary:logitraw' else base_score
+
+    if not out_file:
+        out_file = model_file + COMPILED_MODEL_SUFFIX
+
+    np.savez_compressed(out_file, feature=feature, threshold=threshold, left=left, right=right, default_left=default_left, \
+                        leaf_value=np.where(is_leaf, threshold, 0).astype(np.float32), depth=depth, base_margin=base_margin, \
+                        feature_names=np.array(learner['feature_names'], dtype=str), objective=objective)
+
+    logger.info('{} trees of {} compiled into {}'.format(len(trees), model_file, out_file) )
+
+    return out_file
+
+
+
+def tree_depth(left_children, right_children):
+
+    node_depth = [0] * len(left_children)
+    for node_i, (left_i, right_i) in enumerate( zip(left_children, right_children) ):
+        if left_i != -1:
+            node_depth[left_i]  = node_depth[node_i] + 1
+            node_depth[right_i] = node_depth[node_i] + 1
+
+    return max(node_depth)
+
+
+
+class Tree_ensemble:
+    '''A compiled model, scoring a batch of rows by walking all of its trees at once.'''
+
+    def __init__(self, compiled_model):
+
+        with np.load(compiled_model, allow_pickle=False) as model:
+            self.feature       = model['feature']
+            self.threshold     = model['threshold']
+            self.left          = model['left']
+            self.right         = model['right']
+            self.default_left  = model['default_left']
+            self.leaf_value    = model['leaf_value']
+            self.depth         = int( model['depth'] )
+            self.base_margin   = float( model['base_margin'] )
+            self.feature_names = list( model['feature_names'] )
+            self.objective     = str( model['objective'] )
+
+
+    def num_trees(self):
+        return self.feature.shape[0]
+
+
+    def margin(self, features, num_trees=None):
+        '''features is an array of (rows, features) in the order of feature_names.'''
+
+        num_trees = min(num_trees, self.num_trees()) if num_trees else self.num_trees()
+        features  = np.asarray(features, dtype=np.float32)
+        rows      = np.arange( features.shape[0] )[:, None]
+        trees     = np.arange( num_trees )[None, :]
+        nodes     = np.zeros( (features.shape[0], num_trees), dtype=np.int64 )
+
+        for step_i in range(self.depth):
+            values  = features[ rows, self.feature[trees, nodes] ]
+            go_left = np.where( np.isnan(values), self.default_left[trees, nodes], values < self.threshold[trees, nodes] )
+            nodes   = np.where( go_left, self.left[trees, nodes], self.right[trees, nodes] )
+
+        leaf_sum = self.leaf_value[trees, nodes].sum(axis=1, dtype=np.float64)
+
+        return self.base_margin + leaf_sum
+
+
+    def predict(self, features, num_trees=None):
+
+        margins = self.margin(features, num_trees)
+
+        if self.objective == 'binary:logitraw':
+            return margins.astype(np.float32)
+
+        return ( 1 / (1 + np.exp(-margins)) ).astype(np.float32)
+
+
+    def predict_data_frame(self, input_data, num_trees=None, chunksize=10000):
+        '''The scores of the rows of a data frame with the columns of an Ensemble TSV file, which must have every feature of the model.'''
+
+        test_data = ntchange.ntchange(input_data)
+
+        # Like xgboost, refuse to score data without all the features, e.g., a single-sample TSV file with a paired model:
+        missing_features = [ feature_i for feature_i in self.feature_names if feature_i not in test_data ]
+        if missing_features:
+            raise ValueError( 'feature_names mismatch: features missing from the input data: {}'.format(', '.join(missing_features)) )
+
+        test_data = test_data[ self.feature_names ]
+        features  = test_data.to_numpy(dtype=np.float32)
+
+        return np.concatenate( [ self.predict(features[i:i+chunksize], num_trees) for i in range(0, len(features), chunksize) ] + [np.zeros(0, dtype=np.float32)] )
+
+
+
+def predictor(compiled_model, input_tsv, output_tsv, iterations=None, chunksize=10000):
+    '''Like somatic_xgboost.predictor, without xgboost.'''
+
+    model = Tree_ensemble(compiled_model)
+    logger.info('Number of trees to use = {}'.format(iterations if iterations else model.num_trees()) )
+
+    with feature_table.open_writer(output_tsv) as out:
+        for input_data in feature_table.read_data_in_chunks(input_tsv, chunksize):
+            out.write( input_data.assign( SCORE = model.predict_data_frame(input_data, iterations, chunksize) ) )
+
+    return output_tsv
+
+
+
+def run():
+
+    parser = argparse.ArgumentParser(description='Compile a SomaticSeq XGBoost model into NumPy arrays, and score with it without xgboost.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    modes  = parser.add_subparsers(title='mode')
+
+    parser_compile = modes.add_parser('compile')
+    parser_compile.add_argument('-model',  '--model',     type=str, help='xgboost model', required=True)
+    parser_compile.add_argument('-ntrees', '--num-trees', type=int, help='only keep the first this many trees')
+    parser_compile.add_argument('-out',    '--out',       type=str, help='compiled model, model{} by default'.format(COMPILED_MODEL_SUFFIX) )
+    parser_compile.set_defaults(which='compile')
+
+    parser_predict = modes.add_parser('predict')
+    parser_predict.add_argument('-model',  '--model',         type=str, help='compiled model', required=True)
+    parser_predict.add_argument('-tsv',    '--tsv-in',        type=str, help='tsv file in, or .parquet/.npz table file', required=True)
+    parser_predict.add_argument('-out',    '--predicted-tsv', type=str, help='tsv file out, or .parquet/.npz table file', required=True)
+    parser_predict.add_argument('-ntrees', '--num-trees',     type=int, help='only use this many trees to classify')
+    parser_predict.set_defaults(which='predict')
+
+    args = parser.parse_args()
+
+    if args.which == 'compile':
+        compile_model(args.model, args.num_trees, args.out)
+
+    elif args.which == 'predict':
+        predictor(args.model, args.tsv_in, args.predicted_tsv, args.num_trees)
+
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    run()
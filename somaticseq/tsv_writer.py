@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Write the sites of somatic_vcf2tsv.py and single_sample_vcf2tsv.py a block at a time:
+# each column of the block is formatted in one go, and the block is written out in one write call.
+
+import re
+from genomicFileHandler.read_info_extractor import rescale
+
+
+# The columns that come from a BAM file, {S} being N or T, and {s} being n or t, i.e., N_DP, nBAM_REF_MQ, ..., for the normal.
+# Values are written as is, with '%g', or rescaled from a fraction like the other p-values.
+# {s}BAM_Downsampled is only in the header of the runs with a max_depth.
+BAM_COLUMNS = ( \
+('{S}_DP',                       'dp',                    None),       \
+('{s}BAM_REF_MQ',                'ref_mq',                '%g'),       \
+('{s}BAM_ALT_MQ',                'alt_mq',                '%g'),       \
+('{s}BAM_p_MannWhitneyU_MQ',     'p_mannwhitneyu_mq',     '%g'),       \
+('{s}BAM_REF_BQ',                'ref_bq',                '%g'),       \
+('{s}BAM_ALT_BQ',                'alt_bq',                '%g'),       \
+('{s}BAM_p_MannWhitneyU_BQ',     'p_mannwhitneyu_bq',     '%g'),       \
+('{s}BAM_REF_NM',                'ref_NM',                '%g'),       \
+('{s}BAM_ALT_NM',                'alt_NM',                '%g'),       \
+('{s}BAM_NM_Diff',               'NM_Diff',               '%g'),       \
+('{s}BAM_REF_Concordant',        'ref_concordant_reads',  None),       \
+('{s}BAM_REF_Discordant',        'ref_discordant_reads',  None),       \
+('{s}BAM_ALT_Concordant',        'alt_concordant_reads',  None),       \
+('{s}BAM_ALT_Discordant',        'alt_discordant_reads',  None),       \
+('{s}BAM_Concordance_FET',       'concordance_fet',       'fraction'), \
+('{S}_REF_FOR',                  'ref_for',               None),       \
+('{S}_REF_REV',                  'ref_rev',               None),       \
+('{S}_ALT_FOR',                  'alt_for',               None),       \
+('{S}_ALT_REV',                  'alt_rev',               None),       \
+('{s}BAM_StrandBias_FET',        'strandbias_fet',        'fraction'), \
+('{s}BAM_p_MannWhitneyU_EndPos', 'p_mannwhitneyu_endpos', '%g'),       \
+('{s}BAM_REF_Clipped_Reads',     'ref_SC_reads',          None),       \
+('{s}BAM_ALT_Clipped_Reads',     'alt_SC_reads',          None),       \
+('{s}BAM_Clipping_FET',          'clipping_fet',          'fraction'), \
+('{s}BAM_MQ0',                   'MQ0',                   None),       \
+('{s}BAM_Other_Reads',           'noise_read_count',      None),       \
+('{s}BAM_Poor_Reads',            'poor_read_count',       None),       \
+('{s}BAM_REF_InDel_3bp',         'ref_indel_3bp',         None),       \
+('{s}BAM_REF_InDel_2bp',         'ref_indel_2bp',         None),       \
+('{s}BAM_REF_InDel_1bp',         'ref_indel_1bp',         None),       \
+('{s}BAM_ALT_InDel_3bp',         'alt_indel_3bp',         None),       \
+('{s}BAM_ALT_InDel_2bp',         'alt_indel_2bp',         None),       \
+('{s}BAM_ALT_InDel_1bp',         'alt_indel_1bp',         None),       \
+('{s}BAM_Downsampled',           'downsampled',           None),       \
+)
+
+# The mates are counted in the last, i.e., the tumor, BAM file:
+MATE_COLUMNS = ( ('Consistent_Mates', 'consistent_mates'), ('Inconsistent_Mates', 'inconsistent_mates') )
+
+
+
+def column_formatter(conversion, p_scale):
+    '''A function that turns a value into the string that str.format would have written for the conversion.'''
+
+    if conversion == '%g':
+        return lambda x: '%g' % x
+
+    elif conversion == 'fraction':
+        return lambda x: format( rescale(x, 'fraction', p_scale, 1001) )
+
+    else:
+        return format
+
+
+
+class Block_writer:
+    '''
+    The output columns are the {placeholders} in out_header. The sites are tuples of (site_items, BAM features of each sample),
+    where site_items has every column that does not come from the BAM files, and the samples are labeled, e.g., ('N', 'T').
+    '''
+
+    def __init__(self, out_header, samples, p_scale=None):
+
+        self.columns = re.findall(r'\{(\w+)\}', out_header)
+
+        bam_columns = {}
+        for n, sample_i in enumerate(samples):
+            for template_i, key_i, conversion_i in BAM_COLUMNS:
+                column_i = template_i.format(S=sample_i.upper(), s=sample_i.lower())
+                bam_columns[ column_i ] = (n+1, key_i, column_formatter(conversion_i, p_scale))
+
+        for column_i, key_i in MATE_COLUMNS:
+            bam_columns[ column_i ] = (len(samples), key_i, format)
+
+        # (index in the site tuple, key, formatter) of every column:
+        self.schema = [ bam_columns[column_i] if column_i in bam_columns else (0, column_i, format) for column_i in self.columns ]
+
+
+    def header(self):
+        return '\t'.join(self.columns) + '\n'
+
+
+    def write(self, outhandle, sites):
+        '''Write the sites, and return the formatted columns, e.g., for feature_table.text_columns_as_frame.'''
+
+        column_buffers = []
+        for index_i, key_i, formatter_i in self.schema:
+            column_buffers.append( [ formatter_i( site_i[index_i][key_i] ) for site_i in sites ] )
+
+        if sites:
+            outhandle.write( '\n'.join( map('\t'.join, zip(*column_buffers)) ) + '\n' )
+
+        return column_buffers
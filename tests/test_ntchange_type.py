@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+'''
+Pins what ntchange adds for every REF/ALT pair, including the existing classifiers' quirk that all six columns are the GC2CG indicator.
+'''
+
+import itertools, warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from somaticseq.ntchange_type import ntchange, NTCHANGE_COLUMNS
+
+
+BASES = ('A', 'C', 'G', 'T', 'a', 'c', 'g', 't', 'N', 'n')
+
+
+def expected_gc2cg(ref, alt):
+    return int( (ref.upper(), alt.upper()) in (('G', 'C'), ('C', 'G')) )
+
+
+
+def test_every_ref_alt_pair():
+
+    pairs        = list( itertools.product(BASES, BASES) )
+    variants     = pd.DataFrame({'REF': [ref for ref, alt in pairs], 'ALT': [alt for ref, alt in pairs], 'T_DP': np.arange(len(pairs))})
+    new_variants = ntchange(variants)
+
+    assert list(new_variants.columns) == ['REF', 'ALT', 'T_DP'] + list(NTCHANGE_COLUMNS)
+    assert new_variants['T_DP'].tolist() == list(range(len(pairs)))
+
+    for column_i in NTCHANGE_COLUMNS:
+        assert new_variants[column_i].dtype == np.int64
+        assert new_variants[column_i].tolist() == [ expected_gc2cg(ref, alt) for ref, alt in pairs ], column_i
+
+    # G>C, C>G, g>c, and c>g, and also the mixed cases:
+    assert new_variants['GC2CG'].sum() == 8
+
+
+@pytest.mark.parametrize('ref, alt', [('GC', 'G'), ('G', 'GC'), ('GC', 'CG'), ('C', 'GG'), ('G', 'C,T'), ('N', 'C'), ('G', 'N'), ('G', '.'), ('', 'C')])
+def test_indels_mnps_and_others_are_zero(ref, alt):
+
+    new_variants = ntchange( pd.DataFrame({'REF': [ref], 'ALT': [alt]}) )
+
+    for column_i in NTCHANGE_COLUMNS:
+        assert new_variants[column_i].tolist() == [0]
+
+
+def test_index_and_existing_columns():
+
+    variants     = pd.DataFrame({'REF': ['G', 'A', 'C'], 'ALT': ['C', 'G', 'G'], 'GC2TA': [9, 9, 9]}, index=[10, 5, 7])
+    new_variants = ntchange(variants)
+
+    assert new_variants.index.tolist() == [10, 5, 7]
+    assert list(new_variants.columns).count('GC2TA') == 1
+    assert new_variants['GC2TA'].tolist() == [1, 0, 1]
+    assert variants['GC2TA'].tolist() == [9, 9, 9]
+
+
+def test_no_fragmentation_warning():
+
+    # A fragmented frame, like one that columns have been added to one by one:
+    variants = pd.DataFrame({'REF': ['G'] * 4, 'ALT': ['C', 'G', 'T', 'A']})
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', pd.errors.PerformanceWarning)
+        for column_n in range(120):
+            variants['feature_{}'.format(column_n)] = np.arange(4)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', pd.errors.PerformanceWarning)
+        new_variants = ntchange(variants)
+
+    assert new_variants['TA2CG'].tolist() == [1, 0, 0, 0]
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+'''
+Sliding_subLC.lc must give exactly what subLC gives for the same window, however the windows move along the contigs.
+'''
+
+import math, random
+import pytest
+
+from somaticseq.sequencing_features import subLC, Sliding_subLC
+
+
+WINDOW = 80
+
+
+def random_contigs(seed):
+
+    random_i = random.Random(seed)
+    contigs  = {}
+
+    for contig_i in ('chr1', 'chr2'):
+        sequence = [ random_i.choice('ACGTacgt') for _ in range(2000) ]
+
+        # Low-complexity stretches, so the windows are not all near 1:
+        for position_i in random_i.sample(range(0, 1900), 5):
+            sequence[position_i: position_i+60] = random_i.choice('ACGT') * 60
+
+        # A few N-containing stretches:
+        for position_i in random_i.sample(range(0, 1990), 3):
+            n_length = random_i.randint(1, 10)
+            sequence[position_i: position_i+n_length] = 'N' * n_length
+
+        contigs[contig_i] = ''.join(sequence)
+
+    return contigs
+
+
+def same_lc(lc_i, expected_lc):
+    return (math.isnan(lc_i) and math.isnan(expected_lc)) or lc_i == expected_lc
+
+
+def check_windows(windows, contigs, max_substring_length=20):
+
+    sliding_lc = Sliding_subLC(max_substring_length)
+
+    for contig_i, start_i in windows:
+        sequence_i = contigs[contig_i][start_i: start_i+WINDOW]
+        lc_i       = sliding_lc.lc(contig_i, start_i, sequence_i)
+        assert same_lc(lc_i, subLC(sequence_i, max_substring_length)), (contig_i, start_i, sequence_i)
+
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_overlapping_windows(seed):
+
+    contigs  = random_contigs(seed)
+    random_i = random.Random(seed)
+    windows  = []
+
+    start_i = 0
+    while start_i < 2000 - WINDOW:
+        windows.append( ('chr1', start_i) )
+        start_i += random_i.choice( (0, 1, 1, 2, 3, 5, 8, 13) )
+
+    check_windows(windows, contigs)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_non_overlapping_jumps_and_backward_windows(seed):
+
+    contigs  = random_contigs(seed)
+    random_i = random.Random(seed)
+    windows  = [ ('chr1', random_i.randint(0, 2000-WINDOW)) for _ in range(300) ]
+
+    check_windows(windows, contigs)
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_contig_changes(seed):
+
+    contigs  = random_contigs(seed)
+    random_i = random.Random(seed)
+    windows  = []
+
+    # The same position on the next contig must not be taken for an overlapping window:
+    start_i = 0
+    while start_i < 2000 - WINDOW:
+        windows.append( (random_i.choice(('chr1', 'chr2')), start_i) )
+        start_i += random_i.randint(0, 4)
+
+    check_windows(windows, contigs)
+
+
+def test_n_containing_windows():
+
+    contigs = {'chr1': 'ACGT' * 100 + 'N' * 5 + 'TTGCA' * 100}
+    windows = [ ('chr1', start_i) for start_i in range(300, 500) ]
+
+    check_windows(windows, contigs)
+
+
+def test_short_windows_and_other_substring_lengths():
+
+    contigs = random_contigs(0)
+    windows = [ ('chr1', start_i) for start_i in range(0, 300, 2) ]
+
+    for max_substring_length in (1, 5, 20, 80):
+        check_windows(windows, contigs, max_substring_length)
+
+    # Near the end of the contig, the windows get shorter:
+    sliding_lc = Sliding_subLC(20)
+    for start_i in range(1900, 1981):
+        sequence_i = contigs['chr2'][start_i: start_i+WINDOW]
+        assert same_lc(sliding_lc.lc('chr2', start_i, sequence_i), subLC(sequence_i, 20))
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+'''
+The predictor's TSV output must be the same, to the character, as that of the original loop of read_csv, xgboost, and to_csv, one chunk at a time.
+'''
+
+import warnings
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xgb = pytest.importorskip('xgboost')
+
+import somaticseq.somatic_xgboost as somatic_xgboost
+from somaticseq.ntchange_type import ntchange
+
+
+PARAM = {'max_depth': 3, 'nthread': 1, 'objective': 'binary:logistic', 'seed': 0, 'tree_method': 'hist'}
+
+
+def ensemble_data(seed, num_rows):
+    '''
+    An Ensemble-like data frame with integer caller flags and counts, and float MQ's, as vcf2tsv writes them.
+    The counts have nan's in some chunks only, so their inferred type differs from chunk to chunk.
+    '''
+
+    random_i = np.random.default_rng(seed)
+
+    depths = pd.Series( random_i.integers(5, 60, num_rows), dtype='Int64' )
+    depths[ (np.arange(num_rows) >= 100) & (np.arange(num_rows) < 200) & (random_i.random(num_rows) < 0.2) ] = pd.NA
+
+    return pd.DataFrame({'CHROM':     '1',
+                         'POS':       np.arange(1, num_rows+1) * 10,
+                         'ID':        '.',
+                         'REF':       random_i.choice(['A', 'C', 'G', 'T'], num_rows),
+                         'ALT':       random_i.choice(['A', 'C', 'G', 'T'], num_rows),
+                         'if_MuTect': random_i.integers(0, 2, num_rows),
+                         'if_VarDict': random_i.integers(0, 2, num_rows),
+                         'T_DP':      depths,
+                         'tBAM_ALT_MQ': random_i.choice([20.0, 38.0, 60.0, np.nan], num_rows),
+                         'Seq_Complexity_Span': random_i.normal(size=num_rows),
+                         'TrueVariant_or_False': random_i.integers(0, 2, num_rows)})
+
+
+def baseline_predictor(model, input_tsv, output_tsv, iterations, chunksize):
+    '''The original predictor, with iteration_range for ntree_limit.'''
+
+    xgb_model = xgb.Booster()
+    xgb_model.load_model(model)
+
+    writeMode, writeHeader = 'w', True
+
+    for input_data in pd.read_csv(input_tsv, sep='\t', chunksize=chunksize, low_memory=False):
+
+        test_data = ntchange(input_data)
+        test_data = test_data.drop( [non_feature_i for non_feature_i in somatic_xgboost.NON_FEATURE if non_feature_i in test_data], axis=1 )
+
+        scores    = xgb_model.predict(xgb.DMatrix(test_data), iteration_range=(0, iterations))
+        predicted = input_data.assign(SCORE = scores)
+        predicted.to_csv(output_tsv, sep='\t', index=False, mode=writeMode, header=writeHeader, na_rep='nan')
+
+        writeMode, writeHeader = 'a', False
+
+
+
+def test_predictor_output_is_the_baseline_output(tmp_path):
+
+    train_tsv = str(tmp_path / 'train.tsv')
+    test_tsv  = str(tmp_path / 'test.tsv')
+    ensemble_data(0, 500).to_csv(train_tsv, sep='\t', index=False, na_rep='nan')
+    ensemble_data(1, 300).to_csv(test_tsv,  sep='\t', index=False, na_rep='nan')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = somatic_xgboost.builder([train_tsv], dict(PARAM), list(somatic_xgboost.NON_FEATURE), 10, str(tmp_path / 'model'))
+
+        somatic_xgboost.predictor(model, test_tsv, str(tmp_path / 'predicted.tsv'), list(somatic_xgboost.NON_FEATURE), 10, chunksize=100)
+        baseline_predictor(model, test_tsv, str(tmp_path / 'baseline.tsv'), 10, chunksize=100)
+
+    predicted = (tmp_path / 'predicted.tsv').read_text()
+    assert predicted == (tmp_path / 'baseline.tsv').read_text()
+
+    # The caller flags are written as integers, and so are the counts, except in the chunk with nan's:
+    rows   = [ line_i.split('\t') for line_i in predicted.splitlines()[1:] ]
+    depths = [ row_i[7] for row_i in rows ]
+    assert { row_i[5] for row_i in rows } == {'0', '1'}
+    assert all( depth_i.isdigit() for depth_i in depths[:100] + depths[200:] )
+    assert 'nan' in depths[100:200] and all( depth_i.endswith('.0') for depth_i in depths[100:200] if depth_i != 'nan' )
+
+
+
+def test_chunked_training_has_the_features_of_every_input(tmp_path):
+
+    # The second file has a column that the first one does not, and lacks one that it has:
+    first_tsv  = str(tmp_path / 'first.tsv')
+    second_tsv = str(tmp_path / 'second.tsv')
+    ensemble_data(2, 300).drop(columns='if_VarDict').to_csv(first_tsv, sep='\t', index=False, na_rep='nan')
+    ensemble_data(3, 300).drop(columns='Seq_Complexity_Span').assign(M2_TLOD=np.linspace(0, 30, 300)).to_csv(second_tsv, sep='\t', index=False, na_rep='nan')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        in_memory = somatic_xgboost.builder([first_tsv, second_tsv], dict(PARAM), list(somatic_xgboost.NON_FEATURE), 10, str(tmp_path / 'in_memory'))
+        chunked   = somatic_xgboost.builder([first_tsv, second_tsv], dict(PARAM), list(somatic_xgboost.NON_FEATURE), 10, str(tmp_path / 'chunked'), chunksize=100)
+        booster   = somatic_xgboost.load_model(chunked)
+
+    assert booster.feature_names[-8:] == ['if_VarDict', 'M2_TLOD', 'GC2CG', 'GC2TA', 'GC2AT', 'TA2AT', 'TA2GC', 'TA2CG']
+    assert (tmp_path / 'chunked.txt').read_text() == (tmp_path / 'in_memory.txt').read_text()
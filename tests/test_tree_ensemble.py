@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+'''
+A model compiled by tree_ensemble must score rows the way xgboost's Booster.predict does, with the same number of trees, nan included.
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+
+xgb = pytest.importorskip('xgboost')
+
+from somaticseq.tree_ensemble import compile_model, Tree_ensemble
+
+
+FEATURES = ['T_DP', 'tBAM_ALT_MQ', 'tBAM_REF_BQ', 'Seq_Complexity_Span', 'if_MuTect']
+
+
+def training_data(seed, num_rows=2000):
+
+    random_i = np.random.default_rng(seed)
+    features = random_i.normal(size=(num_rows, len(FEATURES))).astype(np.float32)
+    labels   = ( features[:, 0] + features[:, 1] * features[:, 2] + random_i.normal(scale=0.5, size=num_rows) > 0 ).astype(np.float32)
+
+    # Missing values, so that the trees learn default directions:
+    features[ random_i.random(features.shape) < 0.15 ] = np.nan
+
+    return pd.DataFrame(features, columns=FEATURES), labels
+
+
+@pytest.fixture(scope='module')
+def model_file(tmp_path_factory):
+
+    features, labels = training_data(0)
+    booster          = xgb.train({'objective': 'binary:logistic', 'max_depth': 5, 'seed': 0, 'nthread': 1, 'tree_method': 'hist'}, xgb.DMatrix(features, label=labels), num_boost_round=40)
+    model_file       = str( tmp_path_factory.mktemp('tree_ensemble') / 'model.json' )
+    booster.save_model(model_file)
+
+    return model_file
+
+
+
+@pytest.mark.parametrize('num_trees', [1, 7, 40])
+def test_compiled_model_matches_booster_predict(model_file, num_trees):
+
+    booster = xgb.Booster()
+    booster.load_model(model_file)
+
+    compiled_model = Tree_ensemble( compile_model(model_file, num_trees, model_file + '.{}.trees.npz'.format(num_trees)) )
+    assert compiled_model.num_trees() == num_trees
+
+    features, labels = training_data(1, 500)
+    expected_scores  = booster.predict( xgb.DMatrix(features), iteration_range=(0, num_trees) )
+
+    assert np.allclose( compiled_model.predict(features.to_numpy()), expected_scores, rtol=0, atol=1e-6 )
+    assert np.allclose( compiled_model.predict_data_frame(features.assign(REF='G', ALT='C')), expected_scores, rtol=0, atol=1e-6 )
+
+
+def test_fewer_trees_at_prediction(model_file):
+
+    booster = xgb.Booster()
+    booster.load_model(model_file)
+
+    compiled_model   = Tree_ensemble( compile_model(model_file, None, model_file + '.all.trees.npz') )
+    features, labels = training_data(2, 300)
+
+    assert np.allclose( compiled_model.predict(features.to_numpy(), 10), booster.predict(xgb.DMatrix(features), iteration_range=(0, 10)), rtol=0, atol=1e-6 )
+
+
+def test_missing_features_are_an_error(model_file):
+
+    compiled_model   = Tree_ensemble( compile_model(model_file, 5, model_file + '.5.trees.npz') )
+    features, labels = training_data(3, 50)
+
+    with pytest.raises(ValueError, match='tBAM_ALT_MQ'):
+        compiled_model.predict_data_frame( features.drop(columns='tBAM_ALT_MQ').assign(REF='G', ALT='C') )
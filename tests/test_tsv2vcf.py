@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+'''
+tsv2vcf must write the same VCF file from an Ensemble TSV file as from the table file made from it, i.e., the values of the table are written as vcf2tsv wrote them.
+'''
+
+import numpy as np
+import pytest
+
+import somaticseq.tsv_writer as tsv_writer
+import somaticseq.feature_table as feature_table
+from somaticseq.SSeq_tsv2vcf import tsv2vcf
+
+
+def bam_value(random_i, key, conversion, n):
+    '''The raw values of the BAM columns as sequencing_features computes them, some of which are nan.'''
+
+    if conversion is None:
+        return int( random_i.integers(0, 80) )
+
+    elif conversion == 'fraction':
+        return float( random_i.choice([1.0, 0.5, random_i.random()]) )
+
+    elif n % 7 == 3:
+        return float('nan')
+
+    else:
+        return float( random_i.choice([38.0, 60.0, 0.0, random_i.random() * 60]) )
+
+
+def write_ensemble_tsv(tsv_file, p_scale, num_rows=60):
+    '''An Ensemble TSV file, with the BAM columns written with the conversions of tsv_writer, as in vcf2tsv.'''
+
+    random_i = np.random.default_rng(0)
+
+    bam_columns = [ (template_i.format(S=sample_i, s=sample_i.lower()), key_i, conversion_i) for sample_i in ('N', 'T') for template_i, key_i, conversion_i in tsv_writer.BAM_COLUMNS ]
+    header      = ['CHROM', 'POS', 'ID', 'REF', 'ALT', 'if_MuTect', 'if_VarDict', 'Seq_Complexity_Span'] + [ column_i for column_i, key_i, conversion_i in bam_columns ]
+
+    with open(tsv_file, 'w') as tsv:
+
+        tsv.write( '\t'.join(header) + '\n' )
+
+        for n in range(num_rows):
+
+            items = ['1', n*100+1, '.', 'G', 'A', int(random_i.integers(0, 2)), float(random_i.choice([0, 0.5, 1])) if n % 2 else int(random_i.integers(0, 2)), random_i.random() * 40]
+            items = [ format(item_i) for item_i in items ]
+
+            for column_i, key_i, conversion_i in bam_columns:
+                items.append( tsv_writer.column_formatter(conversion_i, p_scale)( bam_value(random_i, key_i, conversion_i, n) ) )
+
+            tsv.write( '\t'.join(items) + '\n' )
+
+
+
+@pytest.mark.parametrize('p_scale', [None, 'fraction'])
+def test_table_and_tsv_make_the_same_vcf(tmp_path, p_scale):
+
+    tsv_file   = str(tmp_path / 'Ensemble.sSNV.tsv')
+    table_file = str(tmp_path / 'Ensemble.sSNV.npz')
+
+    write_ensemble_tsv(tsv_file, p_scale)
+    feature_table.tsv2table(tsv_file, table_file)
+
+    tsv2vcf(tsv_file,   str(tmp_path / 'from_tsv.vcf'),   ['MuTect2', 'VarDict'])
+    tsv2vcf(table_file, str(tmp_path / 'from_table.vcf'), ['MuTect2', 'VarDict'])
+
+    # Everything but the line with the time:
+    vcf_lines = lambda vcf_file: [ line_i for line_i in open(vcf_file) if not line_i.startswith('##SomaticSeq') ]
+
+    assert vcf_lines(str(tmp_path / 'from_tsv.vcf')) == vcf_lines(str(tmp_path / 'from_table.vcf'))
+    assert len( vcf_lines(str(tmp_path / 'from_tsv.vcf')) ) > 60
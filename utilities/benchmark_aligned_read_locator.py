@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+# Benchmark read_info_extractor.position_of_aligned_read (CIGAR-block locator) against the previous get_aligned_pairs() implementation.
+# Reads are simulated in memory with random CIGARs, or taken from a BAM file. Every call is also checked for identical results.
+
+import sys, os, argparse, random, time
+import pysam
+
+MY_DIR = os.path.dirname(os.path.realpath(__file__))
+PRE_DIR = os.path.join(MY_DIR, os.pardir)
+sys.path.append( PRE_DIR )
+
+import genomicFileHandler.read_info_extractor as read_info_extractor
+
+nan = float('nan')
+inf = float('inf')
+
+
+def position_of_aligned_read_by_aligned_pairs(read_i, target_position, win_size=3):
+    '''The previous implementation, which scans read_i.get_aligned_pairs() for every read at every site.'''
+
+    flanking_deletion, flanking_insertion = nan, nan
+
+    aligned_pairs = read_i.get_aligned_pairs()
+
+    for i, align_i in enumerate(aligned_pairs):
+        if align_i[1] == target_position:
+            seq_i = align_i[0]
+            idx_aligned_pair = i
+            break
+
+    try:
+        if seq_i is not None:
+            base_at_target = read_i.seq[seq_i]
+
+            if i != len(aligned_pairs) - 1:
+
+                indel_length = 0
+                if aligned_pairs[i+1][0] == seq_i+1 and aligned_pairs[i+1][1] == target_position + 1:
+                    code = 1
+
+                elif aligned_pairs[i+1][0] == None and aligned_pairs[i+1][1] == target_position + 1:
+                    code = 2
+                    for align_j in aligned_pairs[ i+1:: ]:
+                        if align_j[0] == None:
+                            indel_length -= 1
+                        else:
+                            break
+
+                elif aligned_pairs[i+1][0] == seq_i+1 and aligned_pairs[i+1][1] == None:
+                    code = 3
+                    for align_j in aligned_pairs[ i+1:: ]:
+                        if align_j[1] == None:
+                            indel_length += 1
+                        else:
+                            break
+            else:
+                code = 1
+                indel_length = nan
+
+        else:
+            code = 0
+            base_at_target, indel_length, flanking_indel = None, None, None
+
+        if isinstance(indel_length, int):
+            right_indel_flanks = inf
+            left_indel_flanks  = inf
+            left_side_start    = idx_aligned_pair - 1
+            right_side_start   = idx_aligned_pair + abs(indel_length) + 1
+
+            for step_right_i in range( min(win_size, len(aligned_pairs)-right_side_start-1 ) ):
+                j = right_side_start + step_right_i
+                if (aligned_pairs[j+1][1] == None or aligned_pairs[j+1][0] == None):
+                    right_indel_flanks = step_right_i + 1
+                    break
+
+            for step_left_i in range( min(win_size, left_side_start) ):
+                j = left_side_start - step_left_i
+                if (aligned_pairs[j][1] == None or aligned_pairs[j][0] == None):
+                    left_indel_flanks = step_left_i + 1
+                    break
+
+            flanking_indel = min(left_indel_flanks, right_indel_flanks)
+
+        else:
+            flanking_indel = None
+
+        return code, seq_i, base_at_target, indel_length, flanking_indel
+
+    except UnboundLocalError:
+        return None, None, None, None, None
+
+
+
+def simulate_reads(read_length, num_reads, seed=0):
+    '''Reads with a mix of matches, mismatches, indels, soft/hard clips and skips.'''
+
+    random.seed(seed)
+    header = pysam.AlignmentHeader.from_dict( {'SQ': [{'SN': 'sim', 'LN': 10000000}]} )
+    ops    = (0, 0, 0, 0, 7, 8, 1, 2, 3)
+
+    reads = []
+    for n in range(num_reads):
+
+        cigar = []
+        if random.random() < 0.1:
+            cigar.append( (5, random.randint(1, 20)) )
+        if random.random() < 0.2:
+            cigar.append( (4, random.randint(1, 30)) )
+
+        query_length = sum( length_i for op_i, length_i in cigar if op_i == 4 )
+        while query_length < read_length:
+            op_i = random.choice(ops) if random.random() < 0.15 else 0
+            length_i = random.randint(1, 6) if op_i != 0 else random.randint(1, 80)
+            if op_i in (0, 1, 7, 8):
+                length_i = min(length_i, read_length - query_length)
+                query_length += length_i
+            cigar.append( (op_i, length_i) )
+
+        if random.random() < 0.2:
+            cigar.append( (4, random.randint(1, 30)) )
+            query_length += cigar[-1][1]
+        if random.random() < 0.1:
+            cigar.append( (5, random.randint(1, 20)) )
+
+        read_i = pysam.AlignedSegment(header)
+        read_i.query_name      = 'read{}'.format(n)
+        read_i.reference_id    = 0
+        read_i.reference_start = random.randint(1000, 9000000)
+        read_i.cigartuples     = cigar
+        read_i.query_sequence  = ''.join( random.choice('ACGT') for i in range(query_length) )
+        reads.append( read_i )
+
+    return reads
+
+
+
+def targets_of(read_i):
+    return range(read_i.reference_start - 2, read_i.reference_end + 2)
+
+
+
+def time_locator(locator, reads):
+
+    t0 = time.perf_counter()
+    calls = 0
+    for read_i in reads:
+        for position_i in targets_of(read_i):
+            locator(read_i, position_i)
+            calls += 1
+
+    return time.perf_counter() - t0, calls
+
+
+
+def same_results(result_1, result_2):
+    return all( (x == y) or (x != x and y != y) for x, y in zip(result_1, result_2) )
+
+
+
+def run():
+
+    parser = argparse.ArgumentParser(description='Compare the CIGAR-block locator in position_of_aligned_read against scanning get_aligned_pairs(), on simulated reads or on reads from a BAM file.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-lengths', '--read-lengths', type=int, nargs='+', help='lengths of simulated reads', default=[150, 250])
+    parser.add_argument('-num',     '--num-reads',    type=int, help='number of reads for each read length', default=2000)
+    parser.add_argument('-bam',     '--bam-file',     type=str, help='use reads from this BAM file instead of simulated reads')
+    parser.add_argument('-region',  '--region',       type=str, help='region of the BAM file, e.g., chr1:1000000-1100000')
+
+    args = parser.parse_args()
+
+    if args.bam_file:
+        with pysam.AlignmentFile(args.bam_file) as bam:
+            reads = [ read_i for read_i in bam.fetch(region=args.region) if not read_i.is_unmapped ][:args.num_reads]
+        read_sets = [ ('BAM', reads), ]
+    else:
+        read_sets = [ ('{}bp'.format(length_i), simulate_reads(length_i, args.num_reads, length_i)) for length_i in args.read_lengths ]
+
+    for label, reads in read_sets:
+
+        for read_i in reads:
+            for position_i in targets_of(read_i):
+                result_1 = read_info_extractor.position_of_aligned_read(read_i, position_i)
+                result_2 = position_of_aligned_read_by_aligned_pairs(read_i, position_i)
+                assert same_results(result_1, result_2), (read_i.cigarstring, position_i, result_1, result_2)
+
+        old_seconds, calls = time_locator(position_of_aligned_read_by_aligned_pairs, reads)
+        new_seconds, calls = time_locator(read_info_extractor.position_of_aligned_read, reads)
+
+        print('{}\t{} reads, {} calls\tget_aligned_pairs: {:.3f} s\tCIGAR blocks: {:.3f} s\tspeed-up: {:.1f}x'.format(label, len(reads), calls, old_seconds, new_seconds, old_seconds/new_seconds))
+
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+
+# Benchmark the merge loop of vcf2tsv, i.e., genomicFileHandler.genomic_file_handlers.catchup_multilines over several caller VCF files,
+# with (contig_rank, position) coordinate keys against the previous whoisbehind on coordinate strings.
+# VCF files are simulated in memory, or taken from files. Every lookup is also checked for identical results.
+
+import sys, os, argparse, io, random, re, time
+
+MY_DIR = os.path.dirname(os.path.realpath(__file__))
+PRE_DIR = os.path.join(MY_DIR, os.pardir)
+sys.path.append( PRE_DIR )
+
+import genomicFileHandler.genomic_file_handlers as genome
+
+
+
+def whoisbehind_by_strings(coord_0, coord_1, chrom_sequence):
+    '''The previous whoisbehind, which splits the coordinate strings and looks up the contigs on every call.'''
+
+    end_of_0 = end_of_1 = False
+
+    if coord_0 == '' or coord_0==['',''] or coord_0==('','') or not coord_0:
+        end_of_0 = True
+
+    if coord_1 == '' or coord_1==['',''] or coord_1==('','') or not coord_1:
+        end_of_1 = True
+
+    if end_of_0 and end_of_1:
+        return 10
+
+    elif end_of_1:
+        return 0
+
+    elif end_of_0:
+        return 1
+
+    else:
+
+        if isinstance(coord_0, str):
+            chrom0, position0 = coord_0.split()
+        elif isinstance(coord_0, list) or isinstance(coord_0, tuple):
+            chrom0, position0 = coord_0[0], coord_0[1]
+
+        if isinstance(coord_1, str):
+            chrom1, position1 = coord_1.split()
+        elif isinstance(coord_1, list) or isinstance(coord_1, tuple):
+            chrom1, position1 = coord_1[0], coord_1[1]
+
+        if isinstance(chrom_sequence, dict):
+            chrom0_position = chrom_sequence[chrom0]
+            chrom1_position = chrom_sequence[chrom1]
+        elif isinstance(chrom_sequence, list) or isinstance(chrom_sequence, tuple):
+            chrom0_position = chrom_sequence.index(chrom0)
+            chrom1_position = chrom_sequence.index(chrom1)
+
+        if chrom0_position < chrom1_position:
+            return 0
+
+        elif chrom0_position > chrom1_position:
+            return 1
+
+        else:
+
+            position0 = int(position0)
+            position1 = int(position1)
+
+            if position0 < position1:
+                return 0
+
+            elif position0 > position1:
+                return 1
+
+            elif position0 == position1:
+                return 10
+
+
+
+def coordinate_of(line_j):
+    coordinate_j = re.match( genome.pattern_chr_position, line_j )
+    return coordinate_j.group() if coordinate_j else ''
+
+
+
+def catchup_multilines_by_strings(coordinate_i, line_j, filehandle_j, chrom_sequence):
+    '''The previous catchup_multilines (condensed), which calls whoisbehind_by_strings for every line.'''
+
+    coordinate_j = coordinate_of(line_j)
+    is_behind    = whoisbehind_by_strings( coordinate_i, coordinate_j, chrom_sequence )
+
+    while is_behind == 1:
+        line_j     = filehandle_j.readline().rstrip()
+        next_coord = coordinate_of(line_j)
+
+        if next_coord and whoisbehind_by_strings(coordinate_j, next_coord, chrom_sequence) == 1:
+            raise Exception('{} does not seem to be properly sorted'.format(filehandle_j.name) )
+
+        coordinate_j = next_coord
+        is_behind    = whoisbehind_by_strings( coordinate_i, coordinate_j, chrom_sequence )
+
+    lines_of_coordinate_i = []
+    while is_behind == 10:
+        lines_of_coordinate_i.append( line_j )
+        line_j       = filehandle_j.readline().rstrip()
+        coordinate_j = coordinate_of(line_j)
+        is_behind    = whoisbehind_by_strings( coordinate_i, coordinate_j, chrom_sequence )
+
+    return (len(lines_of_coordinate_i) > 0, lines_of_coordinate_i, line_j)
+
+
+
+def simulate_vcf(chrom_sequence, num_lines, seed):
+
+    random.seed(seed)
+    contigs = sorted(chrom_sequence, key=lambda contig_i: chrom_sequence[contig_i])
+
+    coordinates = sorted( (random.randrange(len(contigs)), random.randint(1, 10000000)) for i in range(num_lines) )
+    lines = [ '{}\t{}\t.\tA\tC\t.\tPASS\t.\n'.format(contigs[rank_i], position_i) for rank_i, position_i in coordinates ]
+
+    return '##fileformat=VCFv4.1\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n' + ''.join(lines)
+
+
+
+def merge_loop(catchup_function, sites_text, caller_texts, chrom_sequence):
+    '''For every site, collect the lines at that site in each of the caller files, like vcf2tsv does.'''
+
+    callers = []
+    for text_i in caller_texts:
+        handle_i = io.StringIO(text_i)
+        callers.append( [handle_i, genome.skip_vcf_header(handle_i)] )
+
+    sites = io.StringIO(sites_text)
+    site_line = genome.skip_vcf_header(sites)
+    results = []
+
+    t0 = time.perf_counter()
+    while site_line:
+        site_i = genome.Vcf_line(site_line)
+        for caller_i in callers:
+            got_it, lines_here, caller_i[1] = catchup_function( (site_i.chromosome, site_i.position), caller_i[1], caller_i[0], chrom_sequence )
+            results.append( (got_it, tuple(lines_here)) )
+
+        site_line = sites.readline().rstrip()
+
+    return time.perf_counter() - t0, results
+
+
+
+def run():
+
+    parser = argparse.ArgumentParser(description='Compare the merge loop of vcf2tsv with coordinate keys against whoisbehind on coordinate strings, on simulated or given VCF files.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-fai',     '--reference-fai', type=str, help='.fasta.fai file for the contig order. Human-like contigs 1-22, X, Y, MT if not given.')
+    parser.add_argument('-sites',   '--sites-vcf',     type=str, help='VCF file of the sites, simulated if not given')
+    parser.add_argument('-callers', '--caller-vcfs',   type=str, nargs='*', help='caller VCF files, simulated if not given')
+    parser.add_argument('-num',     '--num-lines',     type=int, help='number of lines in each simulated VCF file', default=100000)
+    parser.add_argument('-nfiles',  '--num-callers',   type=int, help='number of simulated caller VCF files', default=8)
+
+    args = parser.parse_args()
+
+    if args.reference_fai:
+        chrom_sequence = genome.faiordict2contigorder(args.reference_fai, 'fai')
+    else:
+        chrom_sequence = { contig_i: n for n, contig_i in enumerate( [str(i) for i in range(1, 23)] + ['X', 'Y', 'MT'] ) }
+
+    if args.sites_vcf:
+        with genome.open_textfile(args.sites_vcf) as vcf:
+            sites_text = vcf.read()
+    else:
+        sites_text = simulate_vcf(chrom_sequence, args.num_lines, 0)
+
+    if args.caller_vcfs:
+        caller_texts = []
+        for file_i in args.caller_vcfs:
+            with genome.open_textfile(file_i) as vcf:
+                caller_texts.append( vcf.read() )
+    else:
+        caller_texts = [ simulate_vcf(chrom_sequence, args.num_lines, n+1) for n in range(args.num_callers) ]
+
+    old_seconds, old_results = merge_loop(catchup_multilines_by_strings, sites_text, caller_texts, chrom_sequence)
+    new_seconds, new_results = merge_loop(genome.catchup_multilines, sites_text, caller_texts, chrom_sequence)
+
+    assert old_results == new_results
+
+    print('{} lookups\twhoisbehind: {:.3f} s\tcoordinate keys: {:.3f} s\tspeed-up: {:.1f}x'.format(len(new_results), old_seconds, new_seconds, old_seconds/new_seconds))
+
+
+
+if __name__ == '__main__':
+    run()
@@ -2,8 +2,9 @@
 
 from copy import copy
 from sys import float_info
-import argparse
+import argparse, pysam
 import somaticseq.sequencing_features as seq_features
+import genomicFileHandler.genomic_file_handlers as genome
 
 eps = float_info.epsilon
 
@@ -85,21 +86,79 @@ def LC(sequence):
 
 
 
+def lc_track(ref_fa, contigs, outfile, window_size=80, step=1, max_substring_length=20):
+    '''
+    Write the linguistic sequence complexity (subLC) of windows along the given contigs as a bedGraph file, i.e., contig, start, end, LC.
+    contigs is a list of (contig, start, end). Each line covers the step bases at the center of its window. Windows with N are skipped.
+    '''
+
+    reference = genome.Fasta_window( pysam.FastaFile(ref_fa) )
+
+    with open(outfile, 'w') as out:
+
+        sliding_lc = seq_features.Sliding_subLC(max_substring_length)
+        offset     = (window_size - step) // 2
+
+        for contig_i, start_i, end_i in contigs:
+            for window_start in range(start_i, end_i - window_size + 1, step):
+
+                lc = sliding_lc.lc( contig_i, window_start, reference.fetch(contig_i, window_start, window_start+window_size) )
+
+                if lc == lc:
+                    out.write( '{}\t{}\t{}\t{}\n'.format(contig_i, window_start+offset, window_start+offset+step, '%.4g' % lc) )
+
+    reference.close()
+
+
+
+def parse_region(ref_fa, region):
+    '''contig, contig:start-end (1-based, inclusive), or None for the whole genome, into a list of 0-based (contig, start, end).'''
+
+    with pysam.FastaFile(ref_fa) as reference:
+
+        if not region:
+            return [ (contig_i, 0, reference.get_reference_length(contig_i)) for contig_i in reference.references ]
+
+        elif ':' in region:
+            contig_i, coordinates = region.rsplit(':', 1)
+            start_i, end_i = coordinates.replace(',', '').split('-')
+            return [ (contig_i, int(start_i)-1, min(int(end_i), reference.get_reference_length(contig_i))) ]
+
+        else:
+            return [ (region, 0, reference.get_reference_length(region)) ]
+
+
+
+
+
 if __name__ == "__main__":
     
     parser = argparse.ArgumentParser(description="Calculate linguistic sequence complexity according to DOI:10.1093/bioinformatics/18.5.679", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
 
-    parser.add_argument('-seq',  '--sequence',         type=str, help="GCTA sequences")
-    parser.add_argument('-len',  '--substring-length', type=int, help="sub-lenght up to...")
+    parser.add_argument('-seq',     '--sequence',         type=str, help="GCTA sequences")
+    parser.add_argument('-len',     '--substring-length', type=int, help="sub-lenght up to...")
+
+    parser.add_argument('-ref',     '--genome-reference', type=str, help="indexed .fasta file to write genome-wide LC tracks instead, i.e., subLC along the genome as bedGraph")
+    parser.add_argument('-region',  '--region',           type=str, help="contig or contig:start-end for the LC track. Whole genome if not specified.")
+    parser.add_argument('-window',  '--window-size',      type=int, help="window size for the LC track", default=80)
+    parser.add_argument('-step',    '--step-size',        type=int, help="distance between consecutive windows of the LC track", default=1)
+    parser.add_argument('-outfile', '--output-bedgraph',  type=str, help="output bedGraph file for the LC track")
 
     args = parser.parse_args()
 
-    if args.substring_length:
-        length = args.substring_length
-        assert length <= len(args.sequence)
-    
+    if args.genome_reference:
+        assert args.output_bedgraph
+        length = args.substring_length if args.substring_length else 20
+        lc_track(args.genome_reference, parse_region(args.genome_reference, args.region), args.output_bedgraph, args.window_size, args.step_size, length)
+
     else:
-        length = len(args.sequence)
 
-    # This one adds up sub-strings up to a length
-    print( seq_features.subLC(args.sequence, length) )
+        if args.substring_length:
+            length = args.substring_length
+            assert length <= len(args.sequence)
+        
+        else:
+            length = len(args.sequence)
+
+        # This one adds up sub-strings up to a length
+        print( seq_features.subLC(args.sequence, length) )
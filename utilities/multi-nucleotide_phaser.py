@@ -26,6 +26,9 @@ pysam.AlignmentFile(bam) as bam, \
 open(outfile, 'w') as outfile, \
 pysam.FastaFile(ref_fa) as ref_fa:
     
+    # The VCF file is sorted, so reference bases are sliced out of large chunks of the reference
+    ref_fa = genome.Fasta_window(ref_fa)
+    
     my_line = infile.readline().rstrip()
     
     while my_line.startswith('##'):
@@ -1,17 +1,20 @@
 #!/usr/bin/env python3
 
-import sys, os, argparse, shutil, math, re
+import sys, os, argparse, shutil, math, re, struct, gzip
+import pysam
 
 
 def run():
 
     # argparse Stuff
-    parser = argparse.ArgumentParser(description='Given an input bed file, this program will output a number of bed files, each will have same number of total base pairs. This routine is used to parallelize SomaticSeq tasks. One limitation, however, is that some regions of the genome have much higher coverage than others. This is the reason some regions run much slower than others.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser = argparse.ArgumentParser(description='Given an input bed file, this program will output a number of bed files, each will have same number of total base pairs. This routine is used to parallelize SomaticSeq tasks. One limitation, however, is that some regions of the genome have much higher coverage than others. This is the reason some regions run much slower than others. With VCF and/or BAM files, the bed files will instead have about the same amount of work, i.e., candidate variants and/or reads.', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     
     # Variant Call Type, i.e., snp or indel
     parser.add_argument('-infile',    '--input-file',    type=str, help='Input merged BED file',    required=True,  default=None)
     parser.add_argument('-num',       '--num-of-files', type=int, help='1',                        required=False, default=1)
     parser.add_argument('-outfiles',  '--output-files', type=str, help='Output BED file',          required=False, default=sys.stdout)
+    parser.add_argument('-vcfs',      '--vcf-files',    type=str, nargs='*', help='Weigh the regions by the number of variants in these VCF files, e.g., the callers\' outputs', required=False, default=[])
+    parser.add_argument('-bams',      '--bam-files',    type=str, nargs='*', help='Weigh the regions by the number of reads in these BAM files, estimated from their .bai indexes', required=False, default=[])
     
     
     # Parse the arguments:
@@ -21,7 +24,7 @@ def run():
     outfiles = args.output_files
     num      = args.num_of_files
     
-    return infile, outfiles, num
+    return infile, outfiles, num, args.vcf_files, args.bam_files
 
 
 def fai2bed(fai, bedout):
@@ -151,6 +154,208 @@ def split(infile, outfiles, num):
 
 
 
+# The genome is binned into the 16-kbp windows of the BAM index's linear index:
+WINDOW_SIZE = 2**14
+
+# Share of the total weight that goes by base pairs, so regions without candidates or reads still get split:
+BP_WEIGHT = 0.05
+
+
+def read_bed_regions(infile):
+    '''List of (contig, start, end) in a BED file.'''
+
+    regions = []
+    with open(infile) as bedin:
+        for line_i in bedin:
+            if re.match(r'track|browser|#', line_i) or not line_i.strip():
+                continue
+
+            items = line_i.rstrip().split('\t')
+            regions.append( (items[0], int(items[1]), int(items[2])) )
+
+    return regions
+
+
+
+def vcf_window_counts(vcf_files, window_size=WINDOW_SIZE):
+    '''{(contig, window): number of VCF lines} over all the VCF files.'''
+
+    counts = {}
+    for vcf_file in vcf_files:
+
+        opened = gzip.open(vcf_file, 'rt') if vcf_file.lower().endswith('.gz') else open(vcf_file)
+
+        with opened as vcf:
+            for line_i in vcf:
+                if line_i.startswith('#'):
+                    continue
+
+                contig_i, position_i, *rest = line_i.split('\t', 2)
+                window_i = (contig_i, (int(position_i) - 1) // window_size)
+                counts[window_i] = counts.get(window_i, 0) + 1
+
+    return counts
+
+
+
+def bai_window_counts(bam_file):
+    '''
+    {(contig, window): estimated number of reads} of a BAM file from its .bai index, without reading the BAM file.
+    The linear index has the file offset of the first read of each 16-kbp window, and the contig's mapped reads (from the index's pseudo-bin) are distributed in proportion to the compressed bytes between consecutive windows.
+    Returns an empty dictionary if there is no .bai file.
+    '''
+
+    for index_file in (bam_file + '.bai', re.sub(r'\.bam$', '.bai', bam_file)):
+        if os.path.exists(index_file):
+            break
+    else:
+        return {}
+
+    with pysam.AlignmentFile(bam_file) as bam:
+        contigs = bam.references
+
+    counts = {}
+    with open(index_file, 'rb') as bai:
+
+        assert bai.read(4) == b'BAI\x01', '{} is not a BAI file'.format(index_file)
+        num_references, = struct.unpack('<i', bai.read(4))
+
+        for contig_i in contigs[:num_references]:
+
+            num_mapped = 0
+            num_bins,  = struct.unpack('<i', bai.read(4))
+
+            for bin_j in range(num_bins):
+                bin_id, num_chunks = struct.unpack('<Ii', bai.read(8))
+                chunks = bai.read(16 * num_chunks)
+
+                # The pseudo-bin holds the numbers of mapped and unmapped reads:
+                if bin_id == 37450 and num_chunks == 2:
+                    num_mapped = struct.unpack('<4Q', chunks)[2]
+
+            num_windows, = struct.unpack('<i', bai.read(4))
+            offsets      = struct.unpack('<{}Q'.format(num_windows), bai.read(8 * num_windows))
+
+            # Compressed file offsets, where empty windows (0) take the offset of the previous window:
+            file_offsets = []
+            for offset_j in offsets:
+                file_offsets.append( max(offset_j >> 16, file_offsets[-1] if file_offsets else 0) )
+
+            window_bytes = [ file_offsets[j+1] - file_offsets[j] for j in range(len(file_offsets) - 1) ]
+            total_bytes  = sum(window_bytes)
+
+            if num_windows > 0:
+                # The last window is open-ended, so it gets the average:
+                window_bytes.append( total_bytes / max(1, len(window_bytes)) )
+                total_bytes += window_bytes[-1]
+
+            if total_bytes > 0:
+                for j, bytes_j in enumerate(window_bytes):
+                    if bytes_j > 0:
+                        counts[(contig_i, j)] = num_mapped * bytes_j / total_bytes
+
+    return counts
+
+
+
+def split_by_workload(infile, outfiles, num, vcf_files=[], bam_files=[], bp_weight=BP_WEIGHT):
+    '''
+    Like split, but each output bed file gets about the same amount of work rather than the same number of base pairs.
+    The work in each 16-kbp window is the number of candidate variants (i.e., lines in vcf_files), the number of reads (estimated from the .bai indexes of bam_files),
+    or, with both, candidates times reads, so windows of many candidates in deep coverage weigh the most.
+    bp_weight of the total weight is by base pairs. If there is no work to go by, this is the same as split.
+    '''
+
+    candidates = vcf_window_counts(vcf_files)
+
+    reads = {}
+    for bam_file in bam_files:
+        for window_i, reads_i in bai_window_counts(bam_file).items():
+            reads[window_i] = reads.get(window_i, 0) + reads_i
+
+    if candidates and reads:
+        work = { window_i: candidates_i * reads.get(window_i, 0) for window_i, candidates_i in candidates.items() }
+    else:
+        work = candidates or reads
+
+    original_regions = read_bed_regions(infile)
+
+    # Pieces of the regions within each window, with the work in proportion to their size:
+    pieces = []
+    for chr_i, start_i, end_i in original_regions:
+        position_i = start_i
+        while position_i < end_i:
+            window_i = position_i // WINDOW_SIZE
+            end_j    = min(end_i, (window_i + 1) * WINDOW_SIZE)
+            pieces.append( [chr_i, position_i, end_j, work.get((chr_i, window_i), 0) * (end_j - position_i) / WINDOW_SIZE] )
+            position_i = end_j
+
+    total_bp   = sum( end_i - start_i for chr_i, start_i, end_i, work_i in pieces )
+    total_work = sum( work_i for chr_i, start_i, end_i, work_i in pieces )
+
+    if total_work == 0 or total_bp == 0:
+        return split(infile, outfiles, num)
+
+    for piece_i in pieces:
+        piece_i[3] = (1 - bp_weight) * piece_i[3] / total_work + bp_weight * (piece_i[2] - piece_i[1]) / total_bp
+
+    # Fill each output bed file up to 1/num of the total weight, cutting a piece where the weight runs over:
+    weight_per_file = 1 / num
+    regions_of_files = [ [] ]
+    current_weight   = 0
+
+    for chr_i, start_i, end_i, weight_i in pieces:
+
+        weight_per_bp = weight_i / (end_i - start_i)
+
+        while start_i < end_i:
+
+            if len(regions_of_files) == num or current_weight + weight_per_bp * (end_i - start_i) <= weight_per_file:
+                breakpoint_i = end_i
+            else:
+                breakpoint_i = start_i + int( (weight_per_file - current_weight) / weight_per_bp )
+
+            if breakpoint_i > start_i:
+
+                current_regions = regions_of_files[-1]
+
+                if current_regions and current_regions[-1][0] == chr_i and current_regions[-1][2] == start_i:
+                    current_regions[-1][2] = breakpoint_i
+                else:
+                    current_regions.append( [chr_i, start_i, breakpoint_i] )
+
+                current_weight += weight_per_bp * (breakpoint_i - start_i)
+                start_i = breakpoint_i
+
+            if start_i < end_i:
+                regions_of_files.append( [] )
+                current_weight = 0
+
+    out_basename  = os.path.basename(outfiles)
+    out_directory = os.path.dirname(outfiles)
+
+    if not out_directory:
+        out_directory = os.curdir
+
+    outfilesWritten = []
+    for regions_i in regions_of_files:
+
+        if not regions_i:
+            continue
+
+        ithOutName = '{}{}{}.{}'.format(out_directory, os.sep, len(outfilesWritten)+1, out_basename)
+        outfilesWritten.append( ithOutName )
+
+        with open( ithOutName, 'w' ) as ith_out:
+            for chr_i, start_i, end_i in regions_i:
+                ith_out.write( '{}\t{}\t{}\n'.format(chr_i, start_i, end_i) )
+
+    return outfilesWritten
+
+
+
+
+
 def split_vcf_file(vcf_file, work_dir=os.curdir, num=1):
     
     num_lines = 0
@@ -200,5 +405,9 @@ def split_vcf_file(vcf_file, work_dir=os.curdir, num=1):
 
 
 if __name__ == '__main__':
-    infile, outfiles, num = run()
-    split(infile, outfiles, num)
+    infile, outfiles, num, vcf_files, bam_files = run()
+    
+    if vcf_files or bam_files:
+        split_by_workload(infile, outfiles, num, vcf_files, bam_files)
+    else:
+        split(infile, outfiles, num)
@@ -43,45 +43,6 @@ else:
 
 
 
-def whoisbehind(coord_0, coord_1):
-    '''coord_0 and coord_1 are two strings, specifying the chromosome, a (typically) tab, and then the location.'''
-    
-    if coord_0[0] == coord_1[0] == '':
-        return 10
-        
-    elif coord_1[0] == '':
-        return 0
-        
-    elif coord_0[0] == '':
-        return 1
-    
-    else:
-    
-        chrom0, position0 = coord_0[0], coord_0[1]
-        chrom1, position1 = coord_1[0], coord_1[1]
-        
-        
-        if chrom_sequence[chrom0] < chrom_sequence[chrom1]:
-            return 0   # 1st coordinate is behind
-            
-        elif chrom_sequence[chrom0] > chrom_sequence[chrom1]:
-            return 1   # 2nd coordinate is behind
-        
-        # Must be in the same chromosome
-        else:
-                        
-            if position0 < position1:
-                return 0
-            
-            elif position0 > position1:
-                return 1
-            
-            # Same chromosome, same position, then same coordinate:
-            else:
-                return 10
-
-
-
 def only_care(nth_col, itsays, string_input):
     '''itsays is a regex pattern that matches string_input in the nth_col. Returns True if it matches.  Returns False it it does not.
     IGNORE CASE FOR NOW.'''
@@ -108,13 +69,15 @@ def catch_up(line_1, line_2, file_1, file_2, output_vcf, id_1, id_2, id_12 ):
     
     print(coord_1, coord_2)
     
-    is_behind = whoisbehind( coord_1, coord_2 )
+    # (contig_rank, position) of each line, parsed once per line:
+    key_1 = genome.coordinate_key( coord_1, chrom_sequence )
+    key_2 = genome.coordinate_key( coord_2, chrom_sequence )
     
     # As long as the coordinates are not the same, and both files are not finished:
-    while is_behind != 10:
+    while key_1 != key_2:
         
         # If 1st VCF is behind:
-        if is_behind == 0:
+        if key_1 < key_2:
             
             item_1 = line_1.rstrip('\n').split('\t')
             
@@ -134,9 +97,10 @@ def catch_up(line_1, line_2, file_1, file_2, output_vcf, id_1, id_2, id_12 ):
             line_1 = file_1.readline()
             vcf_1  = genome.Vcf_line(line_1)
             coord_1 = [vcf_1.chromosome, vcf_1.position]
+            key_1   = genome.coordinate_key( coord_1, chrom_sequence )
                     
         # If 2nd VCF is behind:    
-        elif is_behind == 1:
+        else:
             
             item_2 = line_2.rstrip('\n').split('\t')
             
@@ -159,8 +123,7 @@ def catch_up(line_1, line_2, file_1, file_2, output_vcf, id_1, id_2, id_12 ):
             line_2 = file_2.readline()
             vcf_2  = genome.Vcf_line(line_2)
             coord_2 = [vcf_2.chromosome, vcf_2.position]
-        
-        is_behind = whoisbehind( coord_1, coord_2 )
+            key_2   = genome.coordinate_key( coord_2, chrom_sequence )
     
     
     # Returns the value of the function:
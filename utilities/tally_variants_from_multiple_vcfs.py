@@ -10,6 +10,11 @@ import vcfModifier.vcfIntersector as vcfIntersector
 import tempfile
 from warnings import warn
 
+# Seed of the reservoir sampling of the reads at sites deeper than max_depth:
+DOWNSAMPLING_SEED = 0
+
+
+
 def intersect_multiple_vcf_files(inVcfList_and_BedFile):
     
     vcf_files, bed_file = inVcfList_and_BedFile
@@ -72,17 +77,22 @@ def extract_dbsnp_cosmic(vcf_line):
 
 
 
-def vaf_from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, ):
+def vaf_from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, max_depth=None):
 
     '''
     bam is the opened file handle of bam file
     my_coordiate is a list or tuple of 0-based (contig, position)
     Returns: number of variant calls, reference calls, other calls, and total calls
+    If there are more than max_depth reads, the calls are counted in max_depth reads sampled at random (with a fixed seed) from them.
     '''
     
     indel_length = len(first_alt) - len(ref_base)
     reads = bam.fetch( my_coordinate[0], my_coordinate[1]-1, my_coordinate[1] )
 
+    if max_depth:
+        reads, true_depth = read_info_extractor.downsample_reads( (read_i for read_i in reads if (not read_i.is_unmapped) and read_info_extractor.dedup_test(read_i) and read_i.mapping_quality >= min_mq), \
+                                                                  max_depth, '{}:{}:{}'.format(DOWNSAMPLING_SEED, my_coordinate[0], my_coordinate[1]) )
+
     dp          = 0
     var_calls   = 0
     ref_calls   = 0
@@ -114,7 +124,7 @@ def vaf_from_bam(bam, my_coordinate, ref_base, first_alt, min_mq=1, ):
     
 
 
-def vcfs2variants(vcf_files, bam_files, sample_names):
+def vcfs2variants(vcf_files, bam_files, sample_names, max_depth=None):
     
     assert len(vcf_files) == len(sample_names) == len(bam_files)
     
@@ -145,7 +155,7 @@ def vcfs2variants(vcf_files, bam_files, sample_names):
                 
                 variant_id = (contig_i, pos_i, refbase, altbase,)
                 
-                vdp, rdp, odp, totaldp = vaf_from_bam(bam, (contig_i, pos_i), refbase, altbase, 1)
+                vdp, rdp, odp, totaldp = vaf_from_bam(bam, (contig_i, pos_i), refbase, altbase, 1, max_depth)
 
                 try:
                     vaf_i = vdp / totaldp
@@ -169,7 +179,7 @@ def vcfs2variants(vcf_files, bam_files, sample_names):
 
 
 
-def fills_missing_vafs(variantDict, bam_files, sample_names):
+def fills_missing_vafs(variantDict, bam_files, sample_names, max_depth=None):
     
     assert len(sample_names) == len(bam_files)
 
@@ -183,7 +193,7 @@ def fills_missing_vafs(variantDict, bam_files, sample_names):
             
             if sample_i not in variantDict[ variant_i ]:
                 
-                vdp, rdp, odp, totaldp = vaf_from_bam(bamDict[sample_i], (variant_i[0], variant_i[1]), variant_i[2], variant_i[3], 1)
+                vdp, rdp, odp, totaldp = vaf_from_bam(bamDict[sample_i], (variant_i[0], variant_i[1]), variant_i[2], variant_i[3], 1, max_depth)
                 
                 try:
                     vaf_i = vdp / totaldp
@@ -200,15 +210,15 @@ def fills_missing_vafs(variantDict, bam_files, sample_names):
 
 
 def make_variant_dict(inputListofLists):
-    vcf_files, bam_files, sample_names = inputListofLists
-    varDictWithMissings = vcfs2variants(vcf_files, bam_files, sample_names)
-    completeVariantDict = fills_missing_vafs(varDictWithMissings, bam_files, sample_names)
+    vcf_files, bam_files, sample_names, max_depth = inputListofLists
+    varDictWithMissings = vcfs2variants(vcf_files, bam_files, sample_names, max_depth)
+    completeVariantDict = fills_missing_vafs(varDictWithMissings, bam_files, sample_names, max_depth)
     
     return completeVariantDict
 
 
 
-def make_variant_dict_parallel(vcf_files, bam_files, sample_names, bed_region, nthreads):
+def make_variant_dict_parallel(vcf_files, bam_files, sample_names, bed_region, nthreads, max_depth=None):
 
     dirname         = tempfile.gettempdir() #os.curdir
     partial_regions = split_regions.split(bed_region, os.path.join(dirname, uuid.uuid4().hex+'.bed'), nthreads)
@@ -218,7 +228,7 @@ def make_variant_dict_parallel(vcf_files, bam_files, sample_names, bed_region, n
     map_args              = map( lambda bed_i: (vcf_files, bed_i), partial_regions )
     partitioned_vcf_files = pool.map_async(intersect_multiple_vcf_files, map_args).get()
     
-    map_args             = map( lambda partial_vcf_files: (partial_vcf_files, bam_files, sample_names), partitioned_vcf_files )
+    map_args             = map( lambda partial_vcf_files: (partial_vcf_files, bam_files, sample_names, max_depth), partitioned_vcf_files )
     variant_dictionaries = pool.map_async(make_variant_dict, map_args).get()
 
     pool.close()
@@ -285,6 +295,7 @@ def run():
     parser.add_argument('-bed',     '--bed-inclusion',            type=str,  help='Bed file to include.')
     parser.add_argument('-nt',      '--num-threads',              type=int,  help="threads", default=1)
     parser.add_argument('-min',     '--minimum-samples',          type=int,  help='Print out only if at least this number of vcf files have the variant.', default=1)
+    parser.add_argument('-maxdepth', '--max-depth',               type=int,  help='At sites with more reads than this, count the calls in this many reads sampled at random (with a fixed seed).')
     
     args = parser.parse_args()
     
@@ -299,7 +310,7 @@ if __name__ == '__main__':
     
     if args.num_threads > 1 and args.bed_inclusion:
         
-        partitioned_variant_dicts = make_variant_dict_parallel(args.vcf_files, args.bam_files, args.sample_names, args.bed_inclusion, args.num_threads)
+        partitioned_variant_dicts = make_variant_dict_parallel(args.vcf_files, args.bam_files, args.sample_names, args.bed_inclusion, args.num_threads, args.max_depth)
         
         for n, dict_i in enumerate(partitioned_variant_dicts):
             if n == 0:
@@ -314,5 +325,5 @@ if __name__ == '__main__':
         if args.num_threads > 1:
             warn('This module is unable parallelize this task without bed file input.')
         
-        variant_dict = make_variant_dict( (args.vcf_files, args.bam_files, args.sample_names) )
+        variant_dict = make_variant_dict( (args.vcf_files, args.bam_files, args.sample_names, args.max_depth) )
         print_variantDict(variant_dict, args.sample_names, args.filter_labels, args.minimum_samples)
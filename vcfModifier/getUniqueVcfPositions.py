@@ -2,7 +2,13 @@
 
 # A simple and quick way to replace GATK3 CombineVariants
 
-import sys, argparse, gzip, re
+import sys, os, argparse, gzip, re, heapq, itertools
+
+MY_DIR = os.path.dirname(os.path.realpath(__file__))
+PRE_DIR = os.path.join(MY_DIR, os.pardir)
+sys.path.append( PRE_DIR )
+
+import genomicFileHandler.genomic_file_handlers as genome
 
 
 def open_textfile(file_name):
@@ -20,17 +26,68 @@ def run():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-vcfs',  '--input-vcfs', nargs='*', type=str, help='Input VCF file', required=True, default=None)
     parser.add_argument('-out',   '--output-vcf',            type=str, help='Output VCF file', required=True)
+    parser.add_argument('-fai',   '--reference-fai',         type=str, help='.fasta.fai file. If given, the input VCF files must be sorted in its contig order, and are merged in one pass.')
 
     args = parser.parse_args()
 
     infiles = args.input_vcfs
     outfile  = args.output_vcf
+    fai      = args.reference_fai
+
+    return infiles, outfile, fai
+
+
+
+def sorted_variants(file_name, chrom_seq):
+    '''
+    Yield (contig rank, contig, position, ref, alt) for every ALT in a VCF file sorted in the contig order,
+    and raise if the file turns out not to be sorted.
+    '''
+
+    last_key = None
+    with open_textfile(file_name) as vcf:
+        for line_i in vcf:
+
+            if line_i.startswith('#') or not line_i.strip():
+                continue
+
+            item = line_i.rstrip().split('\t')
+
+            chromosome = item[0]
+            position   = int( item[1] )
+            key_i      = (chrom_seq.get(chromosome, len(chrom_seq)), chromosome, position)
+
+            if last_key and key_i < last_key:
+                raise Exception('{} does not seem to be properly sorted'.format(file_name) )
+
+            last_key = key_i
+
+            for altbase_i in re.split(r'[,/]', item[4]):
+                yield key_i + (item[3], altbase_i)
+
+
+
+def combine(infiles, outfile, fai=None):
+    '''
+    Write every unique (chrom, pos, ref, alt) in the VCF files, one per line.
+    With fai, the input VCF files, already sorted in the contig order of the fai file, are merged a position at a time,
+    so the output is sorted the same way and only the variants at one position are kept in memory.
+    Without fai, they are all held in a set, and sorted by contig name.
+    '''
 
-    return infiles, outfile
+    if fai:
+        chrom_seq = genome.faiordict2contigorder(fai, 'fai')
+        variants  = heapq.merge( *[sorted_variants(file_i, chrom_seq) for file_i in infiles], key=lambda variant_i: variant_i[:3] )
 
+        with open(outfile, 'w') as vcf_out:
+            vcf_out.write('##fileformat=VCFv4.1\n')
+            vcf_out.write('#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n')
 
+            for key_i, variants_i in itertools.groupby(variants, key=lambda variant_i: variant_i[:3]):
+                for variant_i in sorted( set(variants_i) ):
+                    vcf_out.write('{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n'.format(variant_i[1], variant_i[2], '.', variant_i[3], variant_i[4], '.', 'PASS', '.') )
 
-def combine(infiles, outfile):
+        return outfile
 
     variant_positions = set()
 
@@ -69,5 +126,5 @@ def combine(infiles, outfile):
 
 
 if __name__ == '__main__':
-    infiles, outfile = run()
-    combine(infiles, outfile)
+    infiles, outfile, fai = run()
+    combine(infiles, outfile, fai)
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
-import sys, os, argparse, gzip, re, subprocess, uuid
+import sys, os, argparse, gzip, re, heapq, tempfile, functools
+import numpy as np
 
 MY_DIR = os.path.dirname(os.path.realpath(__file__))
 PRE_DIR = os.path.join(MY_DIR, os.pardir)
@@ -8,6 +9,9 @@ sys.path.append( PRE_DIR )
 
 import genomicFileHandler.genomic_file_handlers as genome
 
+# Beyond this many lines, vcfsorter sorts the VCF file in sorted runs on disk and merges them
+VCF_SORT_BUFFER_LINES = 2000000
+
 
 
 def remove_vcf_illegal_lines(invcf, outvcf):
@@ -57,14 +61,129 @@ def remove_vcf_illegal_lines(invcf, outvcf):
         return hasIllegalLine
 
 
+class Interval_index:
+    '''
+    The regions in a bed file, merged into non-overlapping intervals, as sorted start and end arrays for each contig.
+    Since the merged intervals do not overlap, both arrays are sorted, and whether a region overlaps any of them is one binary search.
+    '''
+
+    def __init__(self, bed_file):
+
+        regions = {}
+        with genome.open_textfile(bed_file) as bed:
+            for line_i in bed:
+                if line_i.startswith( ('#', 'track', 'browser') ) or not line_i.strip():
+                    continue
+
+                item = line_i.split('\t')
+                regions.setdefault(item[0], []).append( (int(item[1]), int(item[2])) )
+
+        self.starts = {}
+        self.ends   = {}
+        for contig_i in regions:
+
+            intervals = np.array( regions[contig_i], dtype=np.int64 )
+            intervals = intervals[ np.argsort(intervals[:, 0], kind='stable') ]
+
+            # A new merged interval starts wherever the region begins after the end of all the regions before it
+            running_ends = np.maximum.accumulate( intervals[:, 1] )
+            is_new       = np.ones( len(intervals), dtype=bool )
+            is_new[1:]   = intervals[1:, 0] > running_ends[:-1]
+            last_of_each = np.append( np.flatnonzero(is_new)[1:] - 1, len(intervals) - 1 )
+
+            self.starts[contig_i] = intervals[is_new, 0]
+            self.ends[contig_i]   = running_ends[last_of_each]
+
+
+    def overlaps(self, contig, start, end):
+        '''Whether the 0-based, half-open region overlaps any of the intervals.'''
+
+        if contig not in self.starts:
+            return False
+
+        # The last interval that starts before the region ends
+        i = self.starts[contig].searchsorted(end) - 1
+
+        return i >= 0 and self.ends[contig][i] > start
+
+
+
+def interval_index(bed_file):
+    '''
+    The same bed file is used for every caller, so it is read only once,
+    unless it has been rewritten since, e.g., in a long-lived worker process.
+    '''
+
+    stat_i = os.stat(bed_file)
+    return cached_interval_index(bed_file, stat_i.st_mtime_ns, stat_i.st_size)
+
+
+
+@functools.lru_cache(maxsize=16)
+def cached_interval_index(bed_file, mtime_ns, size):
+    return Interval_index(bed_file)
+
+
+
+def vcf_line_region(vcf_line):
+    '''
+    The 0-based, half-open region of a VCF line, as bedtools would have it: the reference bases,
+    or up to END in the INFO for symbolic ALT like <DEL>.
+    '''
+
+    item  = vcf_line.split('\t', 8)
+    start = int(item[1]) - 1
+    end   = start + len(item[3])
+
+    if item[4].startswith('<') and len(item) > 7:
+        end_in_info = re.search(r'(?:^|;)END=([0-9]+)', item[7])
+        if end_in_info:
+            end = max( int(end_in_info.group(1)), end )
+
+    return item[0], start, end
+
+
+
+def write_lines_in_regions(infile, outfile, inclusion_region=None, exclusion_region=None):
+    '''
+    Write the header and the VCF lines that overlap the inclusion region and not the exclusion region, without adjacent duplicate lines,
+    i.e., what "intersectBed -header -a infile -b inclusion_region | intersectBed -header -a stdin -b exclusion_region -v | uniq" did.
+    '''
+
+    included = interval_index(inclusion_region) if inclusion_region else None
+    excluded = interval_index(exclusion_region) if exclusion_region else None
+
+    with genome.open_textfile(infile) as vcf, open(outfile, 'w') as out:
+
+        last_line = None
+        for line_i in vcf:
+
+            line_i = line_i.rstrip('\n')
+            if not line_i or line_i == last_line:
+                continue
+
+            if not line_i.startswith('#'):
+                region_i = vcf_line_region(line_i)
+
+                if included and not included.overlaps(*region_i):
+                    continue
+
+                if excluded and excluded.overlaps(*region_i):
+                    continue
+
+            out.write( line_i + '\n' )
+            last_line = line_i
+
+    return outfile
+
+
+
 def bed_include(infile, inclusion_region, outfile):
     
     assert infile != outfile
     
     if inclusion_region:
-    
-        cmd_line = 'intersectBed -header -a {} -b {} | uniq > {}'.format(infile, inclusion_region, outfile)
-        subprocess.check_call(cmd_line, shell=True)
+        write_lines_in_regions(infile, outfile, inclusion_region=inclusion_region)
         
     else:
         outfile = None
@@ -78,8 +197,7 @@ def bed_exclude(infile, exclusion_region, outfile):
     assert infile != outfile
     
     if exclusion_region:
-        cmd_line = 'intersectBed -header -a {} -b {} -v | uniq > {}'.format(infile, exclusion_region, outfile) 
-        subprocess.check_call(cmd_line, shell=True)
+        write_lines_in_regions(infile, outfile, exclusion_region=exclusion_region)
         
     else:
         outfile = None
@@ -94,55 +212,69 @@ def bed_intersector(infile, outfile, inclusion_region=None, exclusion_region=Non
     assert infile != outfile
     from shutil import copyfile
     
-    # Get the input file name minus the extention, and also get the extension
-    infile_noext = re.sub(r'\.\w+$', '', infile)
-    file_ext     = re.search(r'\.\w+$',  infile).group()
+    if inclusion_region or exclusion_region:
+        write_lines_in_regions(infile, outfile, inclusion_region, exclusion_region)
     
-    temp_files   = []
+    elif infile.endswith('.gz'):
+        with genome.open_textfile(infile) as vcf, open(outfile, 'w') as out:
+            for line_i in vcf:
+                out.write( line_i )
     
-    if inclusion_region:
-        
-        included_temp_file = infile_noext + uuid.uuid4().hex + file_ext
+    else:
+        copyfile(infile, outfile)
+    
+    return outfile
+
+
+
+def write_sorted_run(lines, sort_key, outdir):
+
+    lines.sort(key=sort_key)
+    with tempfile.NamedTemporaryFile(mode='w', suffix='.vcf', dir=outdir, delete=False) as run_i:
+        run_i.writelines( lines )
+    
+    return run_i.name
+
 
-        cmd_line = 'intersectBed -header -a {} -b {} | uniq > {}'.format(infile, inclusion_region, included_temp_file)
-        subprocess.check_call(cmd_line, shell=True)
 
-        infile  = included_temp_file
-        temp_files.append( included_temp_file )
+# Sort the VCF lines by the contig order in the .fai file, then by position
+def vcfsorter(ref, vcfin, vcfout, max_lines_in_memory=VCF_SORT_BUFFER_LINES):
     
+    chrom_seq = genome.faiordict2contigorder(ref + '.fai', 'fai')
     
-    if exclusion_region:
-        
-        cmd_line = 'intersectBed -header -a {} -b {} -v | uniq > {}'.format(infile, exclusion_region, outfile)
-        subprocess.check_call(cmd_line, shell=True)
+    def sort_key(line_i):
+        contig_i, position_i = line_i.split('\t', 2)[:2]
+        return chrom_seq.get(contig_i, len(chrom_seq)), contig_i, int(position_i)
     
-    if inclusion_region and not exclusion_region:
-        copyfile(included_temp_file, outfile)
+    outdir     = os.path.dirname( os.path.abspath(vcfout) )
+    run_files  = []
+    vcf_lines  = []
     
-    elif not (inclusion_region or exclusion_region):
-        if infile.endswith('.gz'):
+    with genome.open_textfile(vcfin) as vcf, open(vcfout, 'w') as out:
         
-            cmd_line = 'gunzip -c {} > {}'.format(infile, outfile)
-            subprocess.check_call(cmd_line, shell=True)
+        for line_i in vcf:
+            
+            if line_i.startswith('#'):
+                out.write( line_i )
+            
+            elif line_i.strip():
+                vcf_lines.append( line_i if line_i.endswith('\n') else line_i + '\n' )
+                
+                if len(vcf_lines) >= max_lines_in_memory:
+                    run_files.append( write_sorted_run(vcf_lines, sort_key, outdir) )
+                    vcf_lines = []
         
-        else:
-            copyfile(infile, outfile)
-    
-    
-    for file_i in temp_files:
-        os.remove( file_i )
+        if run_files:
+            if vcf_lines:
+                run_files.append( write_sorted_run(vcf_lines, sort_key, outdir) )
+            
+            runs = [ open(file_i) for file_i in run_files ]
+            out.writelines( heapq.merge(*runs, key=sort_key) )
+            
+            for run_i, file_i in zip(runs, run_files):
+                run_i.close()
+                os.remove( file_i )
         
-    return outfile
-
-
-
-
-# Use utilities/vcfsorter.pl fa.dict unsorted.vcf > sorted.vcf
-def vcfsorter(ref, vcfin, vcfout):
-    
-    #vcfsort = '{}/utilities/vcfsorter.pl'.format(PRE_DIR)
-    #os.system( '{} {} {} > {}'.format(vcfsort, hg_dict, vcfin, vcfout ) )
-    fai = ref + '.fai'
-    
-    cmd_line = 'bedtools sort -faidx {} -header -i {} > {}'.format(fai, vcfin, vcfout)
-    subprocess.check_call(cmd_line, shell=True)
+        else:
+            vcf_lines.sort(key=sort_key)
+            out.writelines( vcf_lines )